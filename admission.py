@@ -0,0 +1,110 @@
+# This is an admission controller of tasks waiting for a worker thread.
+# ThreadPoolExecutor queues every submitted task without limit, so in a burst
+# DecisionEngine would accept everything and queue wait would grow without
+# limit. The controller bounds the queue, and sheds new tasks while queue
+# wait stays above a target, like CoDel does for packets.
+
+import threading
+import time
+
+from config import Config
+
+
+class EngineOverloaded(Exception):
+    """
+    Raised by DecisionEngine.submit_task() for a task rejected by admission control.
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Engine is overloaded: {reason}")
+        self.reason = reason
+        # Seconds a client should wait before trying again
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Usage:
+        controller.admit()                  # raises EngineOverloaded if rejected
+        controller.dequeued(wait_seconds)   # when a worker starts it
+        controller.dequeued()               # or if it's not queued after all
+
+    admit() counts the task as queued already, so a burst admitted at once
+    can't go above max_queue. Tasks queued without admit(), such as retries,
+    call controller.enqueued() instead.
+
+    A task is rejected if max_queue tasks are waiting already, or while the
+    controller is shedding. Shedding starts when queue wait of started tasks
+    stays above target for a whole interval, which means the queue is a
+    standing queue and not a burst being drained. It stops when a task starts
+    within target again, or the queue is empty.
+    """
+
+    def __init__(
+            self,
+            *,
+            max_queue: int = Config.ADMISSION_MAX_QUEUE,
+            target: float = Config.ADMISSION_TARGET_WAIT,
+            interval: float = Config.ADMISSION_INTERVAL,
+            clock=time.monotonic,
+    ):
+        """
+        :param max_queue: Max tasks waiting for a worker.
+        :param target   : Acceptable queue wait in seconds.
+        :param interval : Seconds queue wait must stay above target before shedding.
+        """
+        self.max_queue = max_queue
+        self.target = target
+        self.interval = interval
+        self.clock = clock
+
+        # Tasks waiting for a worker
+        self.queued = 0
+        self.shedding = False
+        # self.clock() when queue wait went above target, None if it's below
+        self._above_since = None
+        self._lock = threading.Lock()
+
+        self.admitted = 0
+        self.rejected = 0
+
+    def admit(self):
+        """
+        Admit a new task or reject it. An admitted task takes a slot of the
+        queue, released by dequeued().
+        :return: None
+        :raise EngineOverloaded: If the task is rejected.
+        """
+        with self._lock:
+            if self.queued >= self.max_queue:
+                reason = f"{self.queued} tasks waiting for a worker"
+            elif self.shedding and self.queued > 0:
+                reason = f"queue wait above {self.target * 1000:.0f} ms for {self.interval} s"
+            else:
+                self.shedding = False
+                self.admitted += 1
+                self.queued += 1
+                return
+            self.rejected += 1
+        raise EngineOverloaded(reason, retry_after=self.interval)
+
+    def enqueued(self):
+        with self._lock:
+            self.queued += 1
+
+    def dequeued(self, wait: float = None):
+        """
+        :param wait: Seconds the task waited in queue, None if it never started,
+                     such as a cancelled task.
+        """
+        with self._lock:
+            self.queued -= 1
+            if wait is None:
+                return
+            if wait < self.target:
+                self._above_since = None
+                self.shedding = False
+            elif self._above_since is None:
+                self._above_since = self.clock()
+            elif self.clock() - self._above_since >= self.interval:
+                self.shedding = True
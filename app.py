@@ -1,22 +1,83 @@
 import json
+import math
+import os
 import time
 
-from flask import Flask, jsonify
+import aiohttp
+import requests
+from flask import Flask, Response, jsonify
 from loguru import logger
 
-from engine import DecisionEngine, TaskInfo
+from admission import EngineOverloaded
+from breaker import CircuitOpenError
+from config import FlaskTestConfig
+from engine import DecisionEngine, AsyncDecisionEngine, DeadlineExceeded, NoServerAvailable, TaskInfo
+from frontend import AsyncFrontend
+from prober import HealthProber
+from recording import TraceRecorder
+from tasklog import configure_logging
+from tracing import RingSink, Tracer
 from server import ServerList, FlaskTestServerList
 from interfaces import FlaskTestInterfaces
 
 app = Flask(__name__)
-server_list = FlaskTestServerList()
+# Log sinks are written from a background thread, see tasklog.py
+configure_logging()
+
+# Settings below can be overridden by environment variables, such as when
+# benchmarks/loadgen.py runs this app in front of local servers:
+#     OFFLOADING_SERVERS           : Comma separated server ips instead of
+#                                    FlaskTestConfig.server_list.
+#     OFFLOADING_SERVER_PORT       : Port of flask_test_example/app.py on servers.
+#     OFFLOADING_DECISION_ALGORITHM: A key of Config.decision_algorithm.
+#     OFFLOADING_PORT              : Port this app listens on.
+#     OFFLOADING_RECORD            : Trace file every task is recorded to,
+#                                    replay it with replay.py.
+#     OFFLOADING_ASYNC_FRONTEND    : 1 to serve with frontend.AsyncFrontend,
+#                                    same as FlaskTestConfig.ASYNC_FRONTEND.
+server_ips = os.environ.get("OFFLOADING_SERVERS")
+if server_ips:
+    server_list = FlaskTestServerList.specify_server_list({
+        ("LocalDevice" if ip == "127.0.0.1" else f"server{i}"): ip
+        for i, ip in enumerate(server_ips.split(","))
+    })
+else:
+    server_list = FlaskTestServerList()
+server_port = int(os.environ.get("OFFLOADING_SERVER_PORT", FlaskTestInterfaces.default_port))
+decision_algorithm = os.environ.get("OFFLOADING_DECISION_ALGORITHM", "minimum_ping_delay")
+# Ping servers in background, so minimum_ping_delay decisions don't ping
+# servers on every request.
+prober = HealthProber(server_list).start()
+# Recent traces of sampled tasks, served on /traces
+trace_ring = RingSink()
 # DecisionEngine instance's decision algorithm: minimum_ping_delay
 # see more info in config.py
-de = DecisionEngine(
-    decision_algorithm="minimum_ping_delay",
+# AsyncDecisionEngine.submit_task() returns a concurrent.futures.Future too,
+# so routes below work with both engines.
+async_frontend = FlaskTestConfig.ASYNC_FRONTEND or os.environ.get("OFFLOADING_ASYNC_FRONTEND") == "1"
+engine_cls = AsyncDecisionEngine if FlaskTestConfig.USE_ASYNC_ENGINE or async_frontend else DecisionEngine
+de = engine_cls(
+    decision_algorithm=decision_algorithm,
     server_list=server_list,
     max_workers=20,
-    consider_throughput=True
+    consider_throughput=True,
+    # Cache results of interfaces declaring a ttl in interfaces.py
+    result_cache=True,
+    # Send a copy of slow idempotent tasks to the next best server
+    hedge_percentile=95,
+    # Stop offloading to servers failing in a row, see breaker.py
+    circuit_breaker=True,
+    # Reject tasks quickly when too many wait for a worker, see admission.py
+    admission_control=True,
+    # Health calls don't wait behind slow tasks, see priority in interfaces.py
+    priority_scheduler=FlaskTestConfig.SCHEDULER_MODE,
+    # Counters and latency histograms served on /metrics
+    metrics=True,
+    # Timestamp phases of sampled tasks, see tracing.py
+    tracer=Tracer(sinks=[trace_ring]),
+    recorder=TraceRecorder(os.environ["OFFLOADING_RECORD"]) if os.environ.get("OFFLOADING_RECORD") else None,
+    # Log lines of 10% of tasks, counts of all of them are on /metrics
+    log_sample_rate=0.1,
 )
 
 
@@ -29,6 +90,29 @@ def resource_not_found(e):
 app.register_error_handler(404, resource_not_found)
 
 
+# Tasks failed on every server tried (see retries in interfaces.py), or no server to try
+@app.errorhandler(requests.RequestException)
+@app.errorhandler(aiohttp.ClientError)
+@app.errorhandler(CircuitOpenError)
+@app.errorhandler(NoServerAvailable)
+def offloading_failed(e):
+    logger.info(f"Failed to offload task: {e}")
+    return jsonify(error=f"502 Bad Gateway: {e}"), 502
+
+
+@app.errorhandler(DeadlineExceeded)
+def deadline_exceeded(e):
+    logger.info(f"Task exceeded its deadline: {e}")
+    return jsonify(error=f"504 Gateway Timeout: {e}"), 504
+
+
+# Tasks rejected by admission control of the engine, clients retry later
+@app.errorhandler(EngineOverloaded)
+def engine_overloaded(e):
+    logger.info(f"Reject request: {e}")
+    return jsonify(error=f"503 Service Unavailable: {e}"), 503, {"Retry-After": str(math.ceil(e.retry_after))}
+
+
 @app.route("/")
 def hello_world():
     """
@@ -43,7 +127,8 @@ def hello_world():
     # offloading start time
     st = time.time()
     task = FlaskTestInterfaces.hello_world()
-    ret, server = de.submit_task(task=task, port=FlaskTestInterfaces.default_port)
+    ret, server = de.submit_task(task=task, port=server_port,
+                                 timeout=FlaskTestConfig.REQUEST_TIMEOUT)
     data = ret.result().text
     # get the result from offloading task, then calculate total time
     total_time = time.time() - st
@@ -68,7 +153,8 @@ def square(num):
     )
     st = time.time()
     task = FlaskTestInterfaces.get_double(num)
-    ret, server = de.submit_task(task=task, port=FlaskTestInterfaces.default_port)
+    ret, server = de.submit_task(task=task, port=server_port,
+                                 timeout=FlaskTestConfig.REQUEST_TIMEOUT)
     data = ret.result().text
     total_time = time.time() - st
     return jsonify(
@@ -94,7 +180,8 @@ def get_server_lists():
     )
     st = time.time()
     task = FlaskTestInterfaces.get_server()
-    ret, server = de.submit_task(task, port=FlaskTestInterfaces.default_port)
+    ret, server = de.submit_task(task, port=server_port,
+                                 timeout=FlaskTestConfig.REQUEST_TIMEOUT)
     data = ret.result().text
     total_time = time.time() - st
     data = json.loads(data)["data"]
@@ -118,6 +205,74 @@ def list_servers():
     return jsonify(data=de.server_list.convert_to_ip_list())
 
 
+@app.route("/breakers")
+def list_breakers():
+    """
+    List circuit breaker states of servers and their recent state changes.
+    :return: example: {
+        "data": {
+            "192.168.56.2": "open"
+        },
+        "events": [
+            [1600000000.0, "192.168.56.2", "closed", "open"]
+        ]
+    }
+    """
+    logger.info(f"Client interface list_breakers(route'/breakers') has been called")
+    return jsonify(data=de.breaker_states(), events=list(de.breaker_events))
+
+
+@app.route("/scheduler")
+def scheduler_stats():
+    """
+    Queue depth and queue wait of every priority class in the engine.
+    :return: example: {
+        "data": {
+            "high": {"depth": 0, "submitted": 10, "started": 10, "mean_wait": 0.001, "max_wait": 0.003},
+            ...
+        },
+        "mode": "weighted"
+    }
+    """
+    logger.info(f"Client interface scheduler_stats(route'/scheduler') has been called")
+    if de.scheduler is None:
+        return jsonify(data=dict(), mode=None)
+    return jsonify(data=de.scheduler.stats(), mode=de.scheduler.mode)
+
+
+@app.route("/metrics")
+def metrics():
+    """
+    Metrics of the engine in Prometheus text exposition format, such as
+    offloaded tasks, errors and latency histograms per server and interface.
+    """
+    return Response(de.metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/traces")
+def list_traces():
+    """
+    Phases of recent sampled tasks in seconds, see tracing.py.
+    :return: example: {
+        "data": [
+            {
+                "trace_id": "5f0c6a1e2b3d4c5e",
+                "task": "offloading/20",
+                "server": "127.0.0.1",
+                "attempt": 0,
+                "started": 1600000000.0,
+                "phases": {"route": 0.0003, "queue": 0.0001, "remote": 0.0081, "read": 0.0001},
+                "total": 0.0087,
+                "status_code": 200,
+                "error": null
+            }
+        ]
+    }
+    """
+    logger.info(f"Client interface list_traces(route'/traces') has been called")
+    return jsonify(data=[trace.to_dict() for trace in trace_ring.traces()])
+
+
 @app.route("/updateservers")
 def update_servers_from_remote():
     """
@@ -135,7 +290,8 @@ def update_servers_from_remote():
     st = time.time()
     # Submit a task to threadPool for getting server list.
     task = FlaskTestInterfaces.get_server()
-    ret, server = de.submit_task(task, port=FlaskTestInterfaces.default_port)
+    ret, server = de.submit_task(task, port=server_port,
+                                 timeout=FlaskTestConfig.REQUEST_TIMEOUT)
     data = ret.result().text
     total_time = time.time() - st
     ret_json = json.loads(data)
@@ -145,5 +301,51 @@ def update_servers_from_remote():
     )
 
 
+# Offloading routes of the async front-end, see frontend.py. They answer the
+# same as Flask routes above, other routes are served by Flask routes.
+frontend = AsyncFrontend(app)
+
+
+async def offload_async(task: str):
+    """
+    Offload a task on the event loop of de, which must be an AsyncDecisionEngine.
+    :return: (OffloadResponse, server ip, offloading total time)
+    """
+    st = time.time()
+    ret, server = await de.submit_task_async(task, port=server_port,
+                                             timeout=FlaskTestConfig.REQUEST_TIMEOUT)
+    response = await ret
+    return response, server, time.time() - st
+
+
+@frontend.route("/")
+async def hello_world_async(request):
+    logger.info("Client interface hello_world(route'/') has been called")
+    response, server, total_time = await offload_async(FlaskTestInterfaces.hello_world())
+    return dict(data=response.text, server=server, status_code=response.status_code, time=total_time,
+                throughput=de.cal_throughput())
+
+
+@frontend.route("/square/{num}")
+async def square_async(request):
+    num = request.match_info["num"]
+    logger.info("Client interface square(route'/square/<num>') has been called with param {}", num)
+    response, server, total_time = await offload_async(FlaskTestInterfaces.get_double(num))
+    return dict(data=response.text, server=server, status_code=response.status_code, time=total_time,
+                throughput=de.cal_throughput())
+
+
+@frontend.route("/getserverlists")
+async def get_server_lists_async(request):
+    logger.info("Client interface getserverlists(route'/getserverlists') has been called")
+    response, server, total_time = await offload_async(FlaskTestInterfaces.get_server())
+    return dict(data=json.loads(response.text)["data"], server=server, status_code=response.status_code,
+                time=total_time)
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8899)
+    port = int(os.environ.get("OFFLOADING_PORT", 8899))
+    if async_frontend:
+        frontend.run(de, host="0.0.0.0", port=port)
+    else:
+        app.run(host="0.0.0.0", port=port)
@@ -1,20 +1,55 @@
+import math
 import time
 
-from flask import Flask, jsonify, request
+import aiohttp
+import requests
+from flask import Flask, Response, jsonify, request
 from loguru import logger
 
-from engine import DecisionEngine, TaskInfo
+from admission import EngineOverloaded
+from breaker import CircuitOpenError
+from config import SmartContractConfig
+from engine import DecisionEngine, AsyncDecisionEngine, DeadlineExceeded, NoServerAvailable, TaskInfo
+from frontend import AsyncFrontend
+from prober import HealthProber
+from tasklog import configure_logging
+from tracing import RingSink, Tracer
 from server import ServerList, BDContractServerList
 from interfaces import BDInterfaces
 
 app = Flask(__name__)
+# Log sinks are written from a background thread, see tasklog.py
+configure_logging()
 server_list = BDContractServerList()
+# Ping servers in background, so minimum_ping_delay decisions don't ping
+# servers on every request.
+prober = HealthProber(server_list).start()
+# Recent traces of sampled tasks, served on /traces
+trace_ring = RingSink()
 # DecisionEngine instance's decision algorithm: minimum_ping_delay
 # see more info in config.py
-de = DecisionEngine(decision_algorithm="minimum_ping_delay",
-                    server_list=server_list,
-                    max_workers=20,
-                    consider_throughput=True)
+# AsyncDecisionEngine.submit_task() returns a concurrent.futures.Future too,
+# so routes below work with both engines.
+engine_cls = AsyncDecisionEngine if SmartContractConfig.USE_ASYNC_ENGINE or SmartContractConfig.ASYNC_FRONTEND \
+    else DecisionEngine
+de = engine_cls(decision_algorithm="minimum_ping_delay",
+                server_list=server_list,
+                max_workers=20,
+                consider_throughput=True,
+                # Cache results of interfaces declaring a ttl in interfaces.py
+                result_cache=True,
+                # Stop offloading to servers failing in a row, see breaker.py
+                circuit_breaker=True,
+                # Reject tasks quickly when too many wait for a worker, see admission.py
+                admission_control=True,
+                # Health calls don't wait behind slow contracts, see priority in interfaces.py
+                priority_scheduler=SmartContractConfig.SCHEDULER_MODE,
+                # Counters and latency histograms served on /metrics
+                metrics=True,
+                # Timestamp phases of sampled tasks, see tracing.py
+                tracer=Tracer(sinks=[trace_ring]),
+                # Log lines of 10% of tasks, counts of all of them are on /metrics
+                log_sample_rate=0.1)
 
 
 # Error handler with invalid interfaces on this flask server
@@ -26,12 +61,36 @@ def resource_not_found(e):
 app.register_error_handler(404, resource_not_found)
 
 
+# Tasks failed on every server tried (see retries in interfaces.py), or no server to try
+@app.errorhandler(requests.RequestException)
+@app.errorhandler(aiohttp.ClientError)
+@app.errorhandler(CircuitOpenError)
+@app.errorhandler(NoServerAvailable)
+def offloading_failed(e):
+    logger.info(f"Failed to offload task: {e}")
+    return jsonify(error=f"502 Bad Gateway: {e}"), 502
+
+
+@app.errorhandler(DeadlineExceeded)
+def deadline_exceeded(e):
+    logger.info(f"Task exceeded its deadline: {e}")
+    return jsonify(error=f"504 Gateway Timeout: {e}"), 504
+
+
+# Tasks rejected by admission control of the engine, clients retry later
+@app.errorhandler(EngineOverloaded)
+def engine_overloaded(e):
+    logger.info(f"Reject request: {e}")
+    return jsonify(error=f"503 Service Unavailable: {e}"), 503, {"Retry-After": str(math.ceil(e.retry_after))}
+
+
 @app.route("/ping")
 def ping_pong():
     logger.info("Client interface ping_pong(route'/ping') has been called")
     st = time.time()
     task = BDInterfaces.ping_pong()
-    ret, server = de.submit_task(task=task, port=BDInterfaces.default_port)
+    ret, server = de.submit_task(task=task, port=BDInterfaces.default_port,
+                                 timeout=SmartContractConfig.REQUEST_TIMEOUT)
     data = ret.result().text
     total_time = time.time() - st
     return jsonify(
@@ -51,7 +110,8 @@ def list_contract_process():
     # if value is not set, request.args.get() function will return None
     server_ip = request.args.get("server")
     task = BDInterfaces.list_CProcess()
-    ret, server = de.submit_task(task, port=BDInterfaces.default_port, ip=server_ip)
+    ret, server = de.submit_task(task, port=BDInterfaces.default_port, ip=server_ip,
+                                 timeout=SmartContractConfig.REQUEST_TIMEOUT)
     data = ret.result().text
     total_time = time.time() - st
     return jsonify(
@@ -77,7 +137,8 @@ def execute_contract():
     request_id = request.args.get("requestID")
     server_ip = request.args.get("server")
     task = BDInterfaces.execute_contract(contractID=contract_id, operation=operation, arg=arg, request_id=request_id)
-    ret, server = de.submit_task(task, port=BDInterfaces.default_port, ip=server_ip)
+    ret, server = de.submit_task(task, port=BDInterfaces.default_port, ip=server_ip,
+                                 timeout=SmartContractConfig.REQUEST_TIMEOUT)
     data = ret.result().text
     total_time = time.time() - st
     return jsonify(
@@ -103,7 +164,8 @@ def hello_world():
         request_id="123456",
     )
     server_ip = request.args.get("server")
-    ret, server = de.submit_task(task, port=BDInterfaces.default_port, ip=server_ip)
+    ret, server = de.submit_task(task, port=BDInterfaces.default_port, ip=server_ip,
+                                 timeout=SmartContractConfig.REQUEST_TIMEOUT)
     data = ret.result().text
     total_time = time.time() - st
     return jsonify(
@@ -127,5 +189,128 @@ def list_servers():
     return jsonify(data=de.server_list.convert_to_ip_list())
 
 
+@app.route("/breakers")
+def list_breakers():
+    """
+    List circuit breaker states of servers and their recent state changes.
+    :return: example: {
+        "data": {
+            "192.168.56.2": "open"
+        },
+        "events": [
+            [1600000000.0, "192.168.56.2", "closed", "open"]
+        ]
+    }
+    """
+    logger.info(f"Client interface list_breakers(route'/breakers') has been called")
+    return jsonify(data=de.breaker_states(), events=list(de.breaker_events))
+
+
+@app.route("/scheduler")
+def scheduler_stats():
+    """
+    Queue depth and queue wait of every priority class in the engine.
+    :return: example: {
+        "data": {
+            "high": {"depth": 0, "submitted": 10, "started": 10, "mean_wait": 0.001, "max_wait": 0.003},
+            ...
+        },
+        "mode": "weighted"
+    }
+    """
+    logger.info(f"Client interface scheduler_stats(route'/scheduler') has been called")
+    if de.scheduler is None:
+        return jsonify(data=dict(), mode=None)
+    return jsonify(data=de.scheduler.stats(), mode=de.scheduler.mode)
+
+
+@app.route("/metrics")
+def metrics():
+    """
+    Metrics of the engine in Prometheus text exposition format, such as
+    offloaded tasks, errors and latency histograms per server and interface.
+    """
+    return Response(de.metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/traces")
+def list_traces():
+    """
+    Phases of recent sampled tasks in seconds, see tracing.py.
+    :return: example: {
+        "data": [
+            {
+                "trace_id": "5f0c6a1e2b3d4c5e",
+                "task": "offloading/20",
+                "server": "127.0.0.1",
+                "attempt": 0,
+                "started": 1600000000.0,
+                "phases": {"route": 0.0003, "queue": 0.0001, "remote": 0.0081, "read": 0.0001},
+                "total": 0.0087,
+                "status_code": 200,
+                "error": null
+            }
+        ]
+    }
+    """
+    logger.info(f"Client interface list_traces(route'/traces') has been called")
+    return jsonify(data=[trace.to_dict() for trace in trace_ring.traces()])
+
+
+# Offloading routes of the async front-end, see frontend.py. They answer the
+# same as Flask routes above, other routes are served by Flask routes.
+frontend = AsyncFrontend(app)
+
+
+async def offload_async(task: str, server_ip: str = None):
+    """
+    Offload a task on the event loop of de, which must be an AsyncDecisionEngine.
+    :return: A dict answered by routes.
+    """
+    st = time.time()
+    ret, server = await de.submit_task_async(task, port=BDInterfaces.default_port, ip=server_ip,
+                                             timeout=SmartContractConfig.REQUEST_TIMEOUT)
+    response = await ret
+    return dict(data=response.text, server=server, status_code=response.status_code, time=time.time() - st,
+                throughput=de.cal_throughput())
+
+
+@frontend.route("/ping")
+async def ping_pong_async(request):
+    logger.info("Client interface ping_pong(route'/ping') has been called")
+    return await offload_async(BDInterfaces.ping_pong())
+
+
+@frontend.route("/listcontractprocess")
+async def list_contract_process_async(request):
+    logger.info("Client interface list_contract_process(url: {}) has been called", request.url)
+    return await offload_async(BDInterfaces.list_CProcess(), request.query.get("server"))
+
+
+@frontend.route("/execcontract")
+async def execute_contract_async(request):
+    logger.info("Client interface execute_contract(url: {}) has been called", request.url)
+    task = BDInterfaces.execute_contract(contractID=request.query.get("contractID"),
+                                         operation=request.query.get("operation"),
+                                         arg=request.query.get("arg"),
+                                         request_id=request.query.get("requestID"))
+    return await offload_async(task, request.query.get("server"))
+
+
+@frontend.route("/hello")
+async def hello_world_async(request):
+    logger.info("Client interface hello(url: {}) has been called", request.url)
+    task = BDInterfaces.execute_contract(
+        contractID="Hello",
+        operation="hello",
+        arg="hhh",
+        request_id="123456",
+    )
+    return await offload_async(task, request.query.get("server"))
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8899)
+    if SmartContractConfig.ASYNC_FRONTEND:
+        frontend.run(de, host="0.0.0.0", port=8899)
+    else:
+        app.run(host="0.0.0.0", port=8899)
@@ -0,0 +1,262 @@
+# Microbenchmarks of hot paths in DecisionEngine and ServerList.
+#
+# Every benchmark runs offline: decision functions read precomputed probe
+# results instead of pinging, and submit_task() offloads to a local stub
+# server. Results are printed as a table, and can be written as JSON to
+# compare across commits:
+#
+#     python3 -m benchmarks.bench_hotpaths --json before.json
+#     ... change something ...
+#     python3 -m benchmarks.bench_hotpaths --json after.json --compare before.json
+#
+# With --compare, benchmarks slower than the baseline by more than
+# --threshold are reported as regressions and the exit code is 1.
+#
+# Run on root folder:
+#
+#     python3 -m benchmarks.bench_hotpaths [--fleet 10,100,1000] [--only choose_server]
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+import requests
+from loguru import logger
+
+from config import Config
+from engine import DecisionEngine
+from prober import HealthProber
+from server import ServerList
+from tests.stub_server import StubServer
+
+
+def fleet(size: int, local: bool = False):
+    """
+    :param size : Number of remote servers.
+    :param local: If True, 127.0.0.1 is in the list too.
+    :return: A ServerList with probe results of every server, so
+             minimum_ping_delay and minimum_observed_latency don't ping.
+    """
+    servers = {f"server{i}": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(size)}
+    if local:
+        servers["LocalDevice"] = "127.0.0.1"
+    server_list = ServerList.specify_server_list(servers)
+    for i, server in enumerate(server_list.serverList):
+        server.reachable = True
+        server.smoothed_delay = 1.0 + i % 97
+    # A prober which never runs, with the ranking of its last round
+    prober = HealthProber(server_list)
+    prober.ranking = sorted(server_list.serverList, key=lambda server: server.smoothed_delay)
+    server_list.prober = prober
+    return server_list
+
+
+def measure(func, repeat: int, min_time: float):
+    """
+    Time func() like timeit: find a number of calls taking at least
+    min_time, then time that many calls repeat times.
+    :return: (median ns per call, min ns per call, calls per repeat)
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.1))
+    per_call = [timer.timeit(number) / number * 1e9 for _ in range(repeat)]
+    return statistics.median(per_call), min(per_call), number
+
+
+class Suite:
+    def __init__(self, repeat: int, min_time: float, only: str = None, out=sys.stdout):
+        """
+        :param out: Stream of the table, stderr if JSON goes to stdout.
+        """
+        self.repeat = repeat
+        self.min_time = min_time
+        self.only = only
+        self.out = out
+        self.results = list()
+
+    def run(self, name: str, params: dict, func):
+        if self.only and self.only not in name:
+            return
+        median, best, number = measure(func, self.repeat, self.min_time)
+        self.results.append({"name": name, "params": params, "ns_per_op": median,
+                             "ns_min": best, "ops": number})
+        params_str = " ".join(f"{key}={value}" for key, value in params.items())
+        print(f"{name:<32} {params_str:<48} {median / 1000:12.3f} {best / 1000:12.3f}", file=self.out)
+
+
+def bench_choose_server(suite: Suite, sizes):
+    for algorithm in Config.decision_algorithm:
+        for size in sizes:
+            de = DecisionEngine(decision_algorithm=algorithm, server_list=fleet(size), max_workers=1)
+            suite.run("choose_server", {"policy": algorithm, "servers": size}, de.choose_server)
+            de.close()
+    # Throughput check in front of the policy, local device takes the task
+    for size in sizes:
+        de = DecisionEngine(decision_algorithm="default", server_list=fleet(size, local=True),
+                            max_workers=1, consider_throughput=True)
+        suite.run("choose_server", {"policy": "consider_throughput", "servers": size}, de.choose_server)
+        de.close()
+
+
+def bench_cal_throughput(suite: Suite, recorded_sizes):
+    # req_time_lst was replaced by throughput.SlidingWindowCounter, cost must
+    # not grow with requests recorded
+    de = DecisionEngine(decision_algorithm="default", server_list=fleet(1, local=True), max_workers=1)
+    recorded = 0
+    for size in recorded_sizes:
+        for _ in range(size - recorded):
+            de.throughput_counter.record()
+        recorded = size
+        suite.run("cal_throughput", {"recorded": size}, de.cal_throughput)
+    suite.run("throughput_record", {}, de.throughput_counter.record)
+    de.close()
+
+
+def bench_choose_server_except_localhost(suite: Suite, sizes):
+    for size in sizes:
+        de = DecisionEngine(decision_algorithm="default", server_list=fleet(size, local=True), max_workers=1)
+        suite.run("choose_server_except_localhost", {"servers": size}, de._choose_server_except_localhost)
+        de.close()
+
+
+def bench_server_list(suite: Suite, sizes):
+    for size in sizes:
+        server_list = fleet(size)
+        # The last server is the worst case of a linear scan
+        last = server_list.serverList[-1]
+        suite.run("contains_ip", {"servers": size, "found": True},
+                  lambda: server_list.contains_ip(last.serverIP))
+        suite.run("contains_ip", {"servers": size, "found": False},
+                  lambda: server_list.contains_ip("192.0.2.1"))
+
+        def remove_and_restore():
+            server_list.remove_ip(last.serverIP)
+            server_list.serverList.append(last)
+
+        suite.run("remove_ip", {"servers": size}, remove_and_restore)
+
+
+def bench_submit_task(suite: Suite):
+    stub = StubServer().start()
+    server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+    task = "offloading/10"
+    try:
+        # A plain request on a keep-alive session, submit_task() overhead is
+        # the difference to this
+        session = requests.Session()
+        url = f"http://127.0.0.1:{stub.port}/{task}"
+        suite.run("session_get", {}, lambda: session.get(url))
+        session.close()
+
+        features = {
+            "plain": dict(),
+            "full": dict(circuit_breaker=True, admission_control=True,
+                         priority_scheduler="weighted", metrics=True),
+        }
+        for name, kwargs in features.items():
+            de = DecisionEngine(decision_algorithm="default", server_list=server_list, **kwargs)
+            suite.run("submit_task", {"engine": name},
+                      lambda: de.submit_task(task, port=stub.port)[0].result())
+            de.close()
+    finally:
+        stub.stop()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result: dict):
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(results: list, baseline: dict, threshold: float, out=sys.stdout):
+    """
+    Print change of every benchmark against baseline.
+    :return: Number of regressions.
+    """
+    base = {result_key(result): result for result in baseline["results"]}
+    regressions = 0
+    print(f"\nCompared with {baseline.get('commit')}:", file=out)
+    for result in results:
+        old = base.get(result_key(result))
+        if old is None:
+            continue
+        ratio = result["ns_per_op"] / old["ns_per_op"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        params_str = " ".join(f"{key}={value}" for key, value in result["params"].items())
+        print(f"{result['name']:<32} {params_str:<48} {ratio:8.2f}x{flag}", file=out)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks of engine and ServerList hot paths")
+    parser.add_argument("--fleet", default="10,100,1000",
+                        help="Comma separated server list sizes")
+    parser.add_argument("--recorded", default="1000,100000,1000000",
+                        help="Comma separated request counts recorded before timing cal_throughput")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repeats of every benchmark")
+    parser.add_argument("--min-time", type=float, default=0.1,
+                        help="Min seconds of every timed repeat")
+    parser.add_argument("--only", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--json", help="Write results to this file, - for stdout")
+    parser.add_argument("--compare", help="Baseline JSON written by --json")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Slowdown against baseline reported as regression, 0.2 for 20%%")
+    args = parser.parse_args(argv)
+
+    # Logging on every decision would dominate the timings
+    logger.remove()
+
+    sizes = [int(size) for size in args.fleet.split(",")]
+    recorded_sizes = [int(size) for size in args.recorded.split(",")]
+    out = sys.stderr if args.json == "-" else sys.stdout
+    suite = Suite(args.repeat, args.min_time, args.only, out)
+
+    print(f"{'benchmark':<32} {'params':<48} {'median (us)':>12} {'min (us)':>12}", file=out)
+    bench_choose_server(suite, sizes)
+    bench_cal_throughput(suite, recorded_sizes)
+    bench_choose_server_except_localhost(suite, sizes)
+    bench_server_list(suite, sizes)
+    bench_submit_task(suite)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timestamp": time.time(),
+        "results": suite.results,
+    }
+    if args.json == "-":
+        print(json.dumps(report, indent=2))
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(suite.results, baseline, args.threshold, out):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
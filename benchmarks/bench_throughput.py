@@ -0,0 +1,90 @@
+# Benchmark of per-decision throughput cost.
+#
+# Records millions of local requests into a DecisionEngine and measures the
+# cost of choose_server() (which calls cal_throughput()) at checkpoints. With
+# the sliding window counter the cost stays flat, while the old approach of
+# sorting and bisecting a list of every request timestamp grows with the
+# number of requests handled.
+#
+# Run on root folder:
+#
+#     python3 -m benchmarks.bench_throughput [--total 2000000]
+
+import argparse
+import bisect
+import sys
+import time
+
+from loguru import logger
+
+from engine import DecisionEngine
+from server import ServerList
+
+
+def legacy_cal_throughput(req_time_lst: list, period: float):
+    """
+    The old DecisionEngine.cal_throughput(), kept here for comparison.
+    """
+    start_time = time.time() - period
+    req_time_lst.sort()
+    return len(req_time_lst) - bisect.bisect_right(req_time_lst, start_time)
+
+
+def time_per_call(func, repeat: int):
+    st = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - st) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-decision throughput cost benchmark")
+    parser.add_argument("--total", type=int, default=2_000_000,
+                        help="Total requests recorded before the last checkpoint")
+    parser.add_argument("--repeat", type=int, default=1000,
+                        help="choose_server() calls timed at every checkpoint")
+    parser.add_argument("--legacy-limit", type=int, default=200_000,
+                        help="Stop timing the legacy list approach after this many requests")
+    args = parser.parse_args(argv)
+
+    # Logging on every decision would dominate the timings
+    logger.remove()
+
+    server_list = ServerList.specify_server_list({
+        "LocalDevice": "127.0.0.1",
+        "remote": "192.168.56.2",
+    })
+    de = DecisionEngine(decision_algorithm="default", server_list=server_list,
+                        consider_throughput=True)
+    legacy_lst = list()
+
+    checkpoints = [10 ** i for i in range(3, 8) if 10 ** i <= args.total]
+    if not checkpoints or checkpoints[-1] != args.total:
+        checkpoints.append(args.total)
+
+    print(f"{'requests':>10} {'choose_server (us)':>20} {'legacy cal_throughput (us)':>28}")
+    recorded = 0
+    for checkpoint in checkpoints:
+        for _ in range(checkpoint - recorded):
+            de.throughput_counter.record()
+        if checkpoint <= args.legacy_limit:
+            now = time.time()
+            legacy_lst.extend([now] * (checkpoint - recorded))
+        recorded = checkpoint
+
+        per_decision = time_per_call(de.choose_server, args.repeat)
+        if checkpoint <= args.legacy_limit:
+            legacy = time_per_call(
+                lambda: legacy_cal_throughput(legacy_lst, de.default_throughput_period),
+                max(1, args.repeat // 100),
+            )
+            legacy_str = f"{legacy * 1e6:28.2f}"
+        else:
+            legacy_str = f"{'skipped':>28}"
+        print(f"{checkpoint:>10} {per_decision * 1e6:20.2f} {legacy_str}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
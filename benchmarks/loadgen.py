@@ -0,0 +1,243 @@
+# End-to-end load generator, a scripted version of the throughput
+# experiments in docs/ (task-offloading-experiment.ipynb).
+#
+# Starts N instances of flask_test_example/app.py on 127.0.0.1 ... 127.0.0.N,
+# all on the same port (the engine sends a task to the same port on every
+# server), where 127.0.0.1 plays the local device. Then, for every decision
+# algorithm, runs app.py in front of them and drives open-loop traffic to
+# /square at every rate: requests are sent on schedule whether or not earlier
+# ones finished, and latency is counted from the scheduled time, so a slow
+# server can't hide queueing by slowing the client down.
+#
+# Reports throughput, p50/p95/p99 latency and the split between tasks run on
+# local device and offloaded ones, as a table or JSON.
+#
+# Run on root folder:
+#
+#     python3 -m benchmarks.loadgen --servers 3 --rates 5,10,20 --duration 30 \
+#         [--algorithms default,least_outstanding] [--task-max-sleep 1] [--json results.json]
+#         [--async-frontend]
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import aiohttp
+import requests
+
+from config import Config
+from latency import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    """
+    Wait until url answers, or raise RuntimeError if process exits or timeout passes.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process {process.args} exited with code {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} is not ready after {timeout} s")
+
+
+def start_servers(count: int, port: int, task_max_sleep: float, log):
+    """
+    Start count instances of flask_test_example/app.py on 127.0.0.1 ... 127.0.0.count.
+    :return: A list of (ip, subprocess.Popen).
+    """
+    env = dict(os.environ, FLASK_APP=os.path.join(ROOT, "flask_test_example", "app.py"),
+               TASK_MAX_SLEEP=str(task_max_sleep))
+    servers = list()
+    for i in range(1, count + 1):
+        ip = f"127.0.0.{i}"
+        process = subprocess.Popen(
+            [sys.executable, "-m", "flask", "run", "--host", ip, "--port", str(port)],
+            env=env, cwd=ROOT, stdout=log, stderr=log,
+        )
+        servers.append((ip, process))
+    for ip, process in servers:
+        wait_ready(f"http://{ip}:{port}/hello", process)
+    return servers
+
+
+def start_front(algorithm: str, server_ips: list, server_port: int, port: int, log, async_frontend: bool = False):
+    """
+    Start app.py with given decision algorithm in front of servers.
+    :param async_frontend: Serve app.py with frontend.AsyncFrontend instead of Flask.
+    :return: A subprocess.Popen.
+    """
+    env = dict(os.environ,
+               OFFLOADING_SERVERS=",".join(server_ips),
+               OFFLOADING_SERVER_PORT=str(server_port),
+               OFFLOADING_DECISION_ALGORITHM=algorithm,
+               OFFLOADING_PORT=str(port),
+               OFFLOADING_ASYNC_FRONTEND="1" if async_frontend else "0")
+    process = subprocess.Popen([sys.executable, "app.py"], env=env, cwd=ROOT, stdout=log, stderr=log)
+    wait_ready(f"http://127.0.0.1:{port}/listservers", process)
+    return process
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def one_request(session, url: str, scheduled: float, loop):
+    """
+    :return: (status code or None, seconds since scheduled, server ip or None)
+    """
+    try:
+        async with session.get(url) as r:
+            body = await r.text()
+            status = r.status
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None, loop.time() - scheduled, None
+    latency = loop.time() - scheduled
+    server = None
+    if status == 200:
+        try:
+            server = json.loads(body).get("server")
+        except ValueError:
+            pass
+    return status, latency, server
+
+
+async def drive(base_url: str, rate: float, duration: float, poisson: bool, timeout: float, first: int):
+    """
+    Send GET /square/<num> at rate requests per second for duration seconds.
+    Every request has a different num, so results are never served from cache.
+    :return: (list of one_request() results, seconds from the first send to the last answer)
+    """
+    loop = asyncio.get_running_loop()
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = loop.time()
+        offset = 0.0
+        tasks = list()
+        while offset < duration:
+            scheduled = start + offset
+            await asyncio.sleep(max(0.0, scheduled - loop.time()))
+            url = f"{base_url}/square/{first + len(tasks)}"
+            tasks.append(loop.create_task(one_request(session, url, scheduled, loop)))
+            offset += random.expovariate(rate) if poisson else 1 / rate
+        results = await asyncio.gather(*tasks)
+        return results, loop.time() - start
+
+
+def summarize(algorithm: str, rate: float, results: list, elapsed: float):
+    latencies = sorted(latency for status, latency, server in results if status == 200)
+    servers = Counter(server for status, latency, server in results if status == 200)
+    ok = len(latencies)
+    local = servers.get("127.0.0.1", 0)
+    return {
+        "algorithm": algorithm,
+        "rate": rate,
+        "sent": len(results),
+        "ok": ok,
+        # Status code (None for connection errors) -> count of failed requests
+        "errors": {str(status): count for status, count in
+                   Counter(status for status, _, _ in results if status != 200).items()},
+        "throughput": ok / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "local": local,
+        "offloaded": ok - local,
+        "servers": dict(servers),
+    }
+
+
+def print_row(row: dict):
+    def seconds(value):
+        return f"{value:8.3f}" if value is not None else f"{'-':>8}"
+
+    ok = row["ok"] or 1
+    print(f"{row['algorithm']:<26} {row['rate']:>6g} {row['sent']:>6} {row['ok']:>6} "
+          f"{row['sent'] - row['ok']:>6} {row['throughput']:>8.2f} {seconds(row['p50'])} "
+          f"{seconds(row['p95'])} {seconds(row['p99'])} {row['local'] / ok:>7.0%} {row['offloaded'] / ok:>7.0%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end load generator of app.py")
+    parser.add_argument("--servers", type=int, default=3,
+                        help="Servers started on 127.0.0.1 ... 127.0.0.N, 127.0.0.1 is local device")
+    parser.add_argument("--algorithms", default=",".join(Config.decision_algorithm),
+                        help="Comma separated keys of Config.decision_algorithm")
+    parser.add_argument("--rates", default="5,10,20", help="Comma separated requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of traffic at every rate")
+    parser.add_argument("--poisson", action="store_true",
+                        help="Poisson arrivals instead of evenly spaced requests")
+    parser.add_argument("--task-max-sleep", type=float, default=1,
+                        help="Max seconds a task sleeps on servers, flask_test_example default is 10")
+    parser.add_argument("--timeout", type=float, default=60, help="Client timeout of every request")
+    parser.add_argument("--async-frontend", action="store_true",
+                        help="Serve app.py with frontend.AsyncFrontend instead of Flask threads")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--log", default=os.devnull, help="File of server and app.py output")
+    args = parser.parse_args(argv)
+
+    algorithms = args.algorithms.split(",")
+    rates = [float(rate) for rate in args.rates.split(",")]
+    server_port = free_port()
+    front_port = free_port()
+    rows = list()
+    first = 0
+
+    with open(args.log, "a") as log:
+        servers = start_servers(args.servers, server_port, args.task_max_sleep, log)
+        try:
+            print(f"{'algorithm':<26} {'rate':>6} {'sent':>6} {'ok':>6} {'failed':>6} {'req/s':>8} "
+                  f"{'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8} {'local':>7} {'remote':>7}")
+            for algorithm in algorithms:
+                front = start_front(algorithm, [ip for ip, _ in servers], server_port, front_port, log,
+                                    args.async_frontend)
+                try:
+                    for rate in rates:
+                        results, elapsed = asyncio.run(drive(
+                            f"http://127.0.0.1:{front_port}", rate, args.duration,
+                            args.poisson, args.timeout, first,
+                        ))
+                        first += len(results)
+                        row = summarize(algorithm, rate, results, elapsed)
+                        rows.append(row)
+                        print_row(row)
+                finally:
+                    stop(front)
+        finally:
+            for _, process in servers:
+                stop(process)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"servers": args.servers, "duration": args.duration, "task_max_sleep": args.task_max_sleep,
+                       "async_frontend": args.async_frontend, "results": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+# This is a circuit breaker of a server.
+# DecisionEngine feeds outcomes of offloaded tasks into one breaker per server
+# (Server.breaker), and decision functions in ServerList skip servers whose
+# breaker is open. So tasks stop holding worker threads on a dead server,
+# until a few probe tasks show it's back.
+
+import threading
+import time
+
+from config import Config
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised for a task sent to a server whose circuit breaker doesn't allow it.
+    """
+
+    def __init__(self, server_ip: str):
+        super().__init__(f"Circuit breaker of server {server_ip} is open")
+        self.server_ip = server_ip
+
+
+class CircuitBreaker:
+    """
+    States:
+        closed   : Tasks are sent as usual. After failure_threshold consecutive
+                   failures, the breaker opens.
+        open     : No task is sent. After reset_timeout seconds, the breaker
+                   goes half-open on the next task.
+        half_open: At most half_open_calls probe tasks are in flight at a time.
+                   After half_open_calls successes in a row the breaker closes,
+                   any failure opens it again.
+
+    Usage:
+        if breaker.allow_request():
+            send task, then breaker.record_success() or breaker.record_failure()
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+            self,
+            name: str,
+            *,
+            failure_threshold: int = Config.BREAKER_FAILURE_THRESHOLD,
+            reset_timeout: float = Config.BREAKER_RESET_TIMEOUT,
+            half_open_calls: int = Config.BREAKER_HALF_OPEN_CALLS,
+            clock=time.monotonic,
+            on_state_change=None,
+    ):
+        """
+        :param name           : Name in logs and state changes, such as a server ip.
+        :param on_state_change: A function called with (breaker, old_state, new_state)
+                                after every state change.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        self.on_state_change = on_state_change
+
+        self.state = self.CLOSED
+        # Consecutive failures in closed state, successes in half-open state
+        self.failures = 0
+        self.successes = 0
+        # Probe tasks in flight in half-open state
+        self.probes = 0
+        # self.clock() when the breaker opened last time
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"CircuitBreaker({self.name}, {self.state})"
+
+    def available(self, now: float = None):
+        """
+        Check if a task may be sent now, without changing state.
+        Decision functions call this to skip servers.
+        :return: True or False.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN:
+            if now is None:
+                now = self.clock()
+            return now - self.opened_at >= self.reset_timeout
+        return self.probes < self.half_open_calls
+
+    def allow_request(self):
+        """
+        Check if a task may be sent now, and count it as a probe in half-open state.
+        :return: True or False.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if self.clock() - self.opened_at < self.reset_timeout:
+                    return False
+                changed = self._set_state(self.HALF_OPEN)
+            else:
+                changed = None
+                if self.probes >= self.half_open_calls:
+                    return False
+            self.probes += 1
+        self._notify(changed)
+        return True
+
+    def record_success(self):
+        with self._lock:
+            changed = None
+            if self.state == self.CLOSED:
+                self.failures = 0
+            elif self.state == self.HALF_OPEN:
+                self.probes = max(0, self.probes - 1)
+                self.successes += 1
+                if self.successes >= self.half_open_calls:
+                    changed = self._set_state(self.CLOSED)
+        self._notify(changed)
+
+    def record_failure(self):
+        with self._lock:
+            changed = None
+            if self.state == self.CLOSED:
+                self.failures += 1
+                if self.failures >= self.failure_threshold:
+                    changed = self._set_state(self.OPEN)
+            elif self.state == self.HALF_OPEN:
+                changed = self._set_state(self.OPEN)
+            # Late failures of tasks sent before opening don't extend open state
+        self._notify(changed)
+
+    def release(self):
+        """
+        Forget a task allowed by allow_request() which was cancelled before
+        finishing, so it doesn't hold a probe slot.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.probes = max(0, self.probes - 1)
+
+    def _set_state(self, state: str):
+        """
+        Must be called with self._lock held.
+        :return: (old_state, new_state), pass it to self._notify() after releasing the lock.
+        """
+        old_state, self.state = self.state, state
+        self.failures = 0
+        self.successes = 0
+        self.probes = 0
+        if state == self.OPEN:
+            self.opened_at = self.clock()
+        return old_state, state
+
+    def _notify(self, changed):
+        if changed is not None and self.on_state_change is not None:
+            self.on_state_change(self, *changed)
@@ -0,0 +1,49 @@
+# This is a budget of extra requests, such as hedged requests and retries.
+# Purpose of this module is to stop extra requests from amplifying an overload:
+# extra requests are only allowed up to a ratio of primary requests in the
+# last period.
+
+import threading
+
+from throughput import SlidingWindowCounter
+
+
+class RequestBudget:
+    """
+    Usage:
+        budget = RequestBudget(ratio=0.05)
+        budget.record_request()      # for every primary request
+        if budget.try_acquire():     # before every extra request
+            send an extra request
+    """
+
+    def __init__(self, ratio: float, period: float = 10, min_per_period: int = 1):
+        """
+        :param ratio         : Max extra requests per primary request, 0.05 is 5% extra load.
+        :param period        : Seconds of the sliding window counting requests.
+        :param min_per_period: Extra requests always allowed in a period, so a
+                               quiet engine can still send some.
+        """
+        self.ratio = ratio
+        self.min_per_period = min_per_period
+        self.requests = SlidingWindowCounter(period=period)
+        self.extra = SlidingWindowCounter(period=period)
+        self._lock = threading.Lock()
+
+        # Extra requests denied by this budget
+        self.denied = 0
+
+    def record_request(self):
+        self.requests.record()
+
+    def try_acquire(self):
+        """
+        :return: True and count an extra request if budget allows, else False.
+        """
+        with self._lock:
+            allowed = max(self.min_per_period, self.ratio * self.requests.count())
+            if self.extra.count() < allowed:
+                self.extra.record()
+                return True
+            self.denied += 1
+            return False
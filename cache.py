@@ -0,0 +1,94 @@
+# This is a result cache for idempotent offloaded tasks.
+# DecisionEngine looks up (task, port) here before offloading a task whose
+# interface declares a ttl (see interfaces.offload_interface), and stores
+# successful responses after offloading.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    A thread-safe TTL + LRU cache.
+
+    Every entry expires ttl seconds after it's stored. The cache is bounded by
+    entry count and by total size of stored values (such as response body
+    bytes); when either is exceeded, least recently used entries are evicted.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+
+        # key -> (value, expire_time, size), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        :return: Cached value of key, None if not cached or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self.clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, ttl: float, size: int = 0):
+        """
+        Store value of key for ttl seconds.
+        :param size: Size of value counted against self.max_bytes.
+        :return: None
+        """
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, self.clock() + ttl, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        """
+        Must be called with self._lock held.
+        """
+        value, expire_time, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        :return: A dict of hit/miss counters and current usage.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
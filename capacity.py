@@ -0,0 +1,98 @@
+# This is an adaptive controller of local device capacity.
+# DecisionEngine(consider_throughput=True) runs tasks on local device until
+# local throughput reaches a limit, and offloads the rest. The right limit
+# depends on the device and the workload, so instead of the static
+# Config.EXPECTED_THROUGHPUT, the controller learns it from observed latency
+# of local tasks with AIMD: additive increase while local tasks meet a latency
+# target and the limit is used up, multiplicative decrease when they don't.
+
+import threading
+import time
+
+from config import Config
+from latency import LatencyEstimator
+
+
+class LocalCapacityController:
+    """
+    Usage:
+        controller = LocalCapacityController()
+        if local_throughput > controller.current():
+            offload the task
+        ...
+        controller.record(latency_of_a_local_task, local_throughput)
+
+    The limit is adjusted at most once every period seconds. After a decrease,
+    latency samples before it are dropped, so one overload is not punished
+    again in the following periods while the moving average catches up.
+    """
+
+    def __init__(
+            self,
+            *,
+            initial: float = Config.EXPECTED_THROUGHPUT,
+            target: float = Config.LOCAL_LATENCY_TARGET,
+            min_limit: float = Config.LOCAL_CAPACITY_MIN,
+            max_limit: float = Config.LOCAL_CAPACITY_MAX,
+            increase: float = Config.LOCAL_CAPACITY_INCREASE,
+            decrease: float = Config.LOCAL_CAPACITY_DECREASE,
+            period: float = Config.DEFAULT_THROUGHPUT_PERIOD,
+            clock=time.monotonic,
+    ):
+        """
+        :param initial  : Limit before any sample, requests per throughput period.
+        :param target   : Latency target of local tasks in seconds, including queue wait.
+        :param min_limit: Lower bound of limit, local device always takes some
+                          tasks, so latency samples keep coming.
+        :param max_limit: Upper bound of limit.
+        :param increase : Added to limit when local tasks meet target and limit is used up.
+        :param decrease : Limit is multiplied by this when local tasks miss target.
+        :param period   : Min seconds between adjustments.
+        """
+        self.limit = float(initial)
+        self.target = target
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.period = period
+        self.clock = clock
+
+        self.latency = LatencyEstimator(Config.OBSERVED_LATENCY_ALPHA)
+        self._last_adjust = clock()
+        self._lock = threading.Lock()
+
+        self.increases = 0
+        self.decreases = 0
+
+    def __repr__(self):
+        return f"LocalCapacityController(limit={self.limit:.1f}, latency={self.latency.mean:.4f})"
+
+    def current(self):
+        """
+        :return: Current limit of requests per throughput period on local device.
+        """
+        return int(self.limit)
+
+    def record(self, latency: float, demand: int, now: float = None):
+        """
+        Record a finished local task, and adjust limit if a period passed.
+        :param latency: Seconds from queuing to finishing of the task.
+        :param demand : Requests on local device in the last throughput period.
+        :return: None
+        """
+        if now is None:
+            now = self.clock()
+        with self._lock:
+            self.latency.update(latency, now)
+            if now - self._last_adjust < self.period:
+                return
+            self._last_adjust = now
+            if self.latency.mean > self.target:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self.latency = LatencyEstimator(Config.OBSERVED_LATENCY_ALPHA)
+                self.decreases += 1
+            elif demand >= self.current() and self.limit < self.max_limit:
+                # Only grow a limit which is really used, not while local device idles
+                self.limit = min(self.max_limit, self.limit + self.increase)
+                self.increases += 1
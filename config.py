@@ -7,15 +7,142 @@ class Config:
     decision_algorithm = {
         "default": "select_random_server",
         "minimum_ping_delay": "select_min_ping_server",
+        # Based on tasks in flight on every server, see Server.outstanding
+        "least_outstanding": "select_least_outstanding_server",
+        "power_of_two_choices": "select_power_of_two_choices_server",
+        # Based on observed service time of offloaded tasks, ping for cold servers
+        "minimum_observed_latency": "select_min_observed_latency_server",
     }
+    # Decision functions choosing the same server for every task of a batch,
+    # as they don't read tasks in flight. DecisionEngine.plan_batch() calls
+    # them once per batch.
+    LOAD_INDEPENDENT_DECISION_FUNCS = {"select_min_ping_server", "select_min_observed_latency_server"}
 
     DEFAULT_THROUGHPUT_PERIOD = 1
+    # Throughput period is split into this many buckets when counting requests,
+    # see throughput.SlidingWindowCounter.
+    THROUGHPUT_BUCKETS = 10
 
     # User expected throughput in local device, which means that
     # this is max number of requests per second processed on local device,
     # if more than this, offload requests to remote servers.
     EXPECTED_THROUGHPUT = 25
 
+    # If True, the max number of requests processed on local device is learned
+    # by capacity.LocalCapacityController, starting from EXPECTED_THROUGHPUT:
+    # it grows by LOCAL_CAPACITY_INCREASE while local tasks finish within
+    # LOCAL_LATENCY_TARGET seconds (queue wait included), and is multiplied by
+    # LOCAL_CAPACITY_DECREASE when they don't. If False, EXPECTED_THROUGHPUT is used.
+    ADAPTIVE_LOCAL_CAPACITY = True
+    LOCAL_LATENCY_TARGET = 0.5
+    LOCAL_CAPACITY_MIN = 1
+    LOCAL_CAPACITY_MAX = 1000
+    LOCAL_CAPACITY_INCREASE = 1
+    LOCAL_CAPACITY_DECREASE = 0.75
+
+    # Observed service time of offloaded tasks (latency.LatencyEstimator):
+    # weight of the newest sample, samples needed before a server is routed on
+    # its observed time, and seconds after which an estimate is stale.
+    OBSERVED_LATENCY_ALPHA = 0.2
+    OBSERVED_LATENCY_MIN_SAMPLES = 3
+    OBSERVED_LATENCY_MAX_AGE = 30
+
+    # DecisionEngine(result_cache=True): max cached results, and max total
+    # bytes of cached response bodies
+    RESULT_CACHE_ENTRIES = 1024
+    RESULT_CACHE_BYTES = 16 * 1024 * 1024
+
+    # DecisionEngine(hedge_percentile=...): max hedged requests per task
+    HEDGE_BUDGET = 0.05
+
+    # breaker.CircuitBreaker of every server, DecisionEngine(circuit_breaker=True):
+    # consecutive failed tasks opening the breaker, seconds before an open
+    # breaker lets probe tasks through, and probe tasks at a time (and
+    # successes needed to close it again).
+    BREAKER_FAILURE_THRESHOLD = 5
+    BREAKER_RESET_TIMEOUT = 5
+    BREAKER_HALF_OPEN_CALLS = 1
+
+    # Retries of failed tasks of interfaces declaring retries in interfaces.py:
+    # backoff before the n-th retry is random in [0, min(RETRY_BACKOFF_MAX,
+    # RETRY_BACKOFF_BASE * 2 ** n)] seconds, and retries are limited to
+    # RETRY_BUDGET of tasks of these interfaces, so they can't amplify an overload.
+    RETRY_BACKOFF_BASE = 0.05
+    RETRY_BACKOFF_MAX = 1
+    RETRY_BUDGET = 0.1
+
+    # Seconds to wait for connecting to a server and for reading its response,
+    # when a task has no deadline. Tasks with a deadline wait at most until it.
+    CONNECT_TIMEOUT = 3
+    READ_TIMEOUT = 60
+    # Header carrying the remaining deadline of a task in ms to servers
+    DEADLINE_HEADER = "X-Deadline-Ms"
+    # Seconds application servers give every task
+    REQUEST_TIMEOUT = 30
+
+    # DecisionEngine(admission_control=True), see admission.AdmissionController:
+    # max tasks waiting for a worker thread, acceptable queue wait in seconds,
+    # and seconds queue wait must stay above it before new tasks are shed.
+    ADMISSION_MAX_QUEUE = 200
+    ADMISSION_TARGET_WAIT = 0.1
+    ADMISSION_INTERVAL = 1
+    # AsyncDecisionEngine(admission_control=True): max tasks sent at once on
+    # its event loop, others wait for a slot as tasks wait for a worker thread.
+    ASYNC_MAX_IN_FLIGHT = 1000
+
+    # scheduler.PriorityScheduler, DecisionEngine(priority_scheduler=...):
+    # priority classes of interfaces (see interfaces.py) from the highest to
+    # the lowest with their weights, and how workers pick the next task:
+    # "strict" for the highest class first, "weighted" for shares by weight.
+    PRIORITY_WEIGHTS = {
+        "high": 8,
+        "normal": 4,
+        "low": 1,
+    }
+    SCHEDULER_MODE = "weighted"
+
+    # Upper bounds in seconds of latency histogram buckets, see metrics.py
+    METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    # Fraction of tasks traced, and header sending trace ids to servers, see tracing.py
+    TRACE_SAMPLE_RATE = 0.1
+    TRACE_HEADER = "X-Trace-Id"
+    # Traces kept in memory by tracing.RingSink
+    TRACE_RING_SIZE = 1000
+
+    # recording.TraceRecorder: bytes buffered and max seconds a record stays
+    # buffered before it's appended to the trace file, and strings kept in
+    # its string table before the table starts over.
+    RECORD_BUFFER_SIZE = 64 * 1024
+    RECORD_FLUSH_INTERVAL = 1
+    RECORD_STRING_TABLE_SIZE = 4096
+
+    # tasklog.py: min level of log sinks set by configure_logging(), and
+    # fraction of tasks whose lines are logged, DecisionEngine(log_sample_rate=...)
+    LOG_LEVEL = "INFO"
+    LOG_SAMPLE_RATE = 1.0
+
+    # Max availability samples kept per server, older ones are overwritten
+    AVAILABILITY_HISTORY_SIZE = 64
+
+    # prober.HealthProber: seconds between probing rounds at start, after
+    # reachability of a server changes, and at most when servers are stable.
+    PROBE_INTERVAL = 2
+    PROBE_MIN_INTERVAL = 0.5
+    PROBE_MAX_INTERVAL = 30
+    # Intervals vary randomly by this fraction
+    PROBE_JITTER = 0.2
+    # Weight of the newest ping delay in smoothed delay
+    PROBE_EWMA_ALPHA = 0.3
+
+    # Use engine.AsyncDecisionEngine in application servers, which runs
+    # offloading tasks as coroutines instead of holding a worker thread each.
+    USE_ASYNC_ENGINE = False
+    # Serve application servers with frontend.AsyncFrontend: offloading routes
+    # are coroutines awaiting their task on the engine's event loop, instead
+    # of Flask routes holding a thread each. Implies USE_ASYNC_ENGINE.
+    ASYNC_FRONTEND = False
+
 
 class FlaskTestConfig(Config):
     server_list = {
@@ -5,16 +5,34 @@
 # If not, execute this task on this client.
 
 import time
-import copy
-import bisect
+import random
+import asyncio
+import threading
 from typing import NamedTuple
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from loguru import logger
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
 
+from admission import AdmissionController, EngineOverloaded
+from breaker import CircuitBreaker, CircuitOpenError
+from budget import RequestBudget
+from cache import ResultCache
+from capacity import LocalCapacityController
 from config import Config
+from interfaces import interface_name, task_spec
+from latency import LatencyEstimator
+from metrics import EngineMetrics
+from scheduler import PriorityScheduler
+from recording import TraceRecorder
 from server import Server, ServerList
+from tasklog import TaskLog
+from throughput import SlidingWindowCounter
+from timers import TimerQueue
+from tracing import TaskTrace, Tracer, aiohttp_trace_config, set_sending, trace_connections
 
 
 class TaskInfo(NamedTuple):
@@ -27,6 +45,27 @@ class TaskInfo(NamedTuple):
     server: Server
     task: str
     port: int
+    # time.monotonic() when the task must be finished, None if no deadline
+    deadline: float = None
+    # Phases of this attempt if the task is traced, see tracing.py
+    trace: TaskTrace = None
+    # Whether lines of this task are logged, see tasklog.TaskLog
+    logged: bool = True
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised for a task not finished before its deadline, or which no server
+    can finish before its deadline.
+    """
+
+
+class NoServerAvailable(Exception):
+    """
+    Raised for a task with a deadline which no server was chosen for, for
+    reasons other than the deadline, such as an empty server list or open
+    circuits of every server.
+    """
 
 
 class DecisionEngine:
@@ -37,64 +76,493 @@ class DecisionEngine:
             server_list: ServerList,
             max_workers: int = 20,
             consider_throughput: bool = False,
+            prewarm_port: int = None,
+            result_cache: bool = False,
+            hedge_percentile: float = None,
+            hedge_budget: float = Config.HEDGE_BUDGET,
+            circuit_breaker: bool = False,
+            retry_budget: float = Config.RETRY_BUDGET,
+            admission_control: bool = False,
+            priority_scheduler: str = None,
+            adaptive_capacity: bool = Config.ADAPTIVE_LOCAL_CAPACITY,
+            metrics: bool = False,
+            tracer: Tracer = None,
+            recorder: TraceRecorder = None,
+            log_sample_rate: float = Config.LOG_SAMPLE_RATE,
+            clock=time.monotonic,
     ):
+        # Time source of routing decisions and the state they read, such as
+        # throughput, circuit breakers and observed latency. simulator.py
+        # replaces it with virtual time; deadlines of tasks sent for real are
+        # always time.monotonic().
+        self.clock = clock
         # Now decision_func is a str
         self.decision_func = Config.decision_algorithm[decision_algorithm]
         # Current server list
         self.server_list = server_list
         # A thread_pool to execute offloading tasks
+        self.max_workers = max_workers
         self.pool = ThreadPoolExecutor(max_workers)
 
+        # Keep-alive HTTP sessions, one per server ip. Every session has its own
+        # connection pool sized by Server.pool_size (default max_workers), so
+        # offloaded tasks reuse TCP connections instead of a handshake per task.
+        self.sessions = dict()
+        self._sessions_lock = threading.Lock()
+        # Drop pooled connections of servers leaving the server list
+        self.server_list.add_removal_listener(self.evict_sessions)
+
+        # Protects Server.outstanding, counts of tasks in flight on every server.
+        self._outstanding_lock = threading.Lock()
+
+        # Observed service time of offloaded tasks. Per server estimators are
+        # Server.observed_latency, per (serverIP, interface name) ones are here.
+        self.interface_latency = dict()
+        self._latency_lock = threading.Lock()
+
+        # Opt-in cache of successful results keyed by (task, port), only for
+        # interfaces declaring a ttl in interfaces.py. None if disabled.
+        self.result_cache = ResultCache(
+            max_entries=Config.RESULT_CACHE_ENTRIES,
+            max_bytes=Config.RESULT_CACHE_BYTES,
+        ) if result_cache else None
+
+        # Identical in-flight tasks of idempotent interfaces share one Future:
+        # (task, port) -> [Future, serverIP]. coalesced_tasks counts submissions
+        # which joined an in-flight task instead of making a remote call.
+        self.in_flight_tasks = dict()
+        self._in_flight_lock = threading.Lock()
+        self.coalesced_tasks = 0
+
+        # Hedged requests: if a task of an idempotent interface is not finished
+        # within hedge_percentile of its observed latency, send a copy to the
+        # next best server and use whichever answers first. None disables it.
+        # Hedges are limited to hedge_budget of tasks, such as 0.05 for 5%.
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = RequestBudget(hedge_budget)
+        self.hedged_tasks = 0
+        self.hedge_wins = 0
+        # Failed tasks of interfaces declaring retries in interfaces.py are
+        # sent again to another server, limited to retry_budget of them.
+        self.retry_budget = RequestBudget(retry_budget)
+        self.retried_tasks = 0
+        # Tasks sent to another server because the circuit of the chosen one was open
+        self.rerouted_tasks = 0
+        # Protects counters updated by many threads
+        self._stats_lock = threading.Lock()
+        # Delayed calls of this engine, started on first use
+        self._timers = None
+        self._timers_lock = threading.Lock()
+        # Set by close(), delayed retries and hedges are not sent from then on
+        self._closing = False
+
+        # Circuit breakers of servers by ip, fed with outcomes of offloaded
+        # tasks. The breaker of a server in self.server_list is Server.breaker
+        # too, so decision functions skip servers whose breaker is open.
+        # Recent state changes are kept for operators, newest last.
+        self.circuit_breaker = circuit_breaker
+        self.breakers = dict()
+        self.breaker_events = deque(maxlen=100)
+        self._breaker_lock = threading.Lock()
+
+        # Bounds tasks waiting for a worker thread, and sheds new tasks while
+        # queue wait stays high. None if disabled.
+        self.admission = AdmissionController(clock=clock) if admission_control else None
+
+        # Tasks wait for a worker in per-class priority queues instead of the
+        # FIFO queue of self.pool, classes are declared by interfaces.
+        # priority_scheduler is "strict" or "weighted", None if disabled.
+        self.scheduler = PriorityScheduler(self.pool, mode=priority_scheduler) \
+            if priority_scheduler is not None else None
+
         # Something to calculate throughput
         #
         # If task offloading consider throughput on local device,
         # all fields below matters.
         self.consider_throughout = consider_throughput
-        # When (end_time - start_time) > default_throughput_period,
-        # calculate throughput once
+        # Throughput is the request count on local device in the last
+        # default_throughput_period seconds.
         self.default_throughput_period: int = Config.DEFAULT_THROUGHPUT_PERIOD
         self.expected_throughput: int = Config.EXPECTED_THROUGHPUT
-        # A list to store all requests timestamp. Used to calculate throughput
-        # in a certain range times.
-        self.req_time_lst = list()
+        # Learns the limit of local throughput from latency of local tasks,
+        # see local_limit(). None if expected_throughput is used as is.
+        self.local_capacity = LocalCapacityController(initial=self.expected_throughput, clock=clock) \
+            if adaptive_capacity else None
+        # A bounded, thread-safe sliding window counter of local requests.
+        # Recording and querying are both O(1), so the cost of a routing decision
+        # does not grow with the number of requests handled.
+        self.throughput_counter = SlidingWindowCounter(
+            period=self.default_throughput_period,
+            buckets=Config.THROUGHPUT_BUCKETS,
+            clock=clock,
+        )
+
+        # Counters and latency histograms of tasks, see metrics.EngineMetrics.
+        # None if disabled. busy_workers counts worker threads running a task,
+        # only while metrics are enabled, and never in AsyncDecisionEngine.
+        self.busy_workers = 0
+        self.metrics = self._new_metrics() if metrics else None
+
+        # Timestamps phases of sampled tasks and passes them to its sinks,
+        # see tracing.Tracer. None if disabled.
+        self.tracer = tracer
+        # Appends every submitted task to a trace file for replay.py, see
+        # recording.TraceRecorder. None if disabled.
+        self.recorder = recorder
+        # Per-task lines are logged for log_sample_rate of tasks, such as 0.01
+        # for 1%, and counted for all of them, see tasklog.TaskLog.
+        self.task_log = TaskLog(log_sample_rate)
 
         logger.info(
             f"Initial DecisionEngine with decision_algorithm: [{decision_algorithm}], [{max_workers}] workers, throughput period [{self.default_throughput_period}] s"
         )
 
+        if prewarm_port is not None:
+            self.prewarm_sessions(prewarm_port)
+
+    def _new_metrics(self):
+        return EngineMetrics(self)
+
+    def get_session(self, server: Server):
+        """
+        Get the keep-alive session of given server, create one if not exists.
+        :param server: A Server instance.
+        :return: A requests.Session instance.
+        """
+        session = self.sessions.get(server.serverIP)
+        if session is not None:
+            return session
+        with self._sessions_lock:
+            # Another thread may have created it while waiting for the lock
+            session = self.sessions.get(server.serverIP)
+            if session is None:
+                pool_size = self._pool_size(server)
+                session = self._new_session(pool_size)
+                self.sessions[server.serverIP] = session
+                logger.info(f"Create session for {server} with pool size [{pool_size}]")
+        return session
+
+    def _new_session(self, pool_size: int):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        if self.tracer is not None:
+            # Time new connections of traced tasks
+            trace_connections(adapter)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _is_pooled(self, server: Server):
+        """
+        Only servers in self.server_list get keep-alive sessions. Others, such
+        as Server("UserSpecific", ip) chosen by clients, are never removed from
+        the list, so nothing would evict their sessions: each of their tasks
+        opens a connection and closes it.
+        """
+        return self.server_list.contains_ip(server.serverIP)
+
+    def _pool_size(self, server: Server, default: int = None):
+        """
+        Server in TaskInfo may be a temporary instance, such as
+        Server("LocalDevice", "127.0.0.1"), so use pool_size of the one in
+        server list if exists. If not configured, pool size is default,
+        or matches max_workers if default is None.
+        """
+        pool_size = server.pool_size
+        if pool_size is None:
+            pool_size = self.server_list.get_pool_size(server.serverIP)
+        if pool_size is None:
+            pool_size = default if default is not None else self.max_workers
+        return pool_size
+
+    def evict_sessions(self, servers: list):
+        """
+        Close pooled connections of given servers.
+        Registered as a removal listener of self.server_list.
+        :param servers: A list of Server instances.
+        :return: None
+        """
+        with self._sessions_lock:
+            for server in servers:
+                session = self.sessions.pop(server.serverIP, None)
+                if session is not None:
+                    session.close()
+                    logger.info(f"Evict session of {server}")
+
+    def prewarm_sessions(self, port: int, task: str = "", timeout: float = 3):
+        """
+        Open keep-alive connections to all servers in self.server_list before
+        serving tasks, so the first tasks don't pay for TCP handshakes.
+        Every server gets as many concurrent requests as its pool size, and
+        servers that can't be reached are only logged.
+
+        :param port   : Port of the service on servers.
+        :param task   : A cheap task requested to open connections, default is "/".
+        :param timeout: Timeout of every warming request in seconds.
+        :return: None
+        """
+        def warm(session, url):
+            try:
+                session.get(url, timeout=timeout)
+            except requests.RequestException as e:
+                logger.info(f"Failed to prewarm connection to {url}: {e}")
+
+        futures = []
+        for server in self.server_list.serverList:
+            session = self.get_session(server)
+            url = f"http://{server.serverIP}:{port}/{task}"
+            # More concurrent requests than workers can't open more connections
+            for _ in range(min(self._pool_size(server), self.max_workers)):
+                futures.append(self.pool.submit(warm, session, url))
+        wait(futures)
+        logger.info(f"Prewarm sessions of {self.server_list.len()} servers on port [{port}]")
+
+    def close(self):
+        """
+        Shutdown the thread pool and close all pooled connections.
+        :return: None
+        """
+        # A server list outlives engines using it
+        self.server_list.remove_removal_listener(self.evict_sessions)
+        # Delayed retries and hedges run now and are skipped, so Futures
+        # waiting on them complete with the last attempt. Stop the queue even
+        # if unused, else a retry failing during shutdown would start a new one
+        self._closing = True
+        self.timers.stop()
+        self.pool.shutdown(wait=True)
+        if self.recorder is not None:
+            self.recorder.flush()
+        with self._sessions_lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+    def _task_started(self, server: Server):
+        """
+        Count a task in flight on server. Server in TaskInfo may be a temporary
+        instance, so count on the one in self.server_list which decision
+        functions read, if exists.
+        :return: The Server instance counted on, pass it to self._task_finished().
+        """
+        tracked = self.server_list.get_server(server.serverIP) or server
+        with self._outstanding_lock:
+            tracked.outstanding += 1
+        return tracked
+
+    def _task_finished(self, tracked: Server):
+        with self._outstanding_lock:
+            tracked.outstanding -= 1
+
+    def _get_breaker(self, server: Server):
+        """
+        Get the circuit breaker of a server, create one if not exists.
+        :return: A CircuitBreaker instance, None if breakers are disabled.
+        """
+        if not self.circuit_breaker:
+            return None
+        breaker = self.breakers.get(server.serverIP)
+        if breaker is None:
+            with self._breaker_lock:
+                breaker = self.breakers.get(server.serverIP)
+                if breaker is None:
+                    breaker = self.breakers[server.serverIP] = CircuitBreaker(
+                        server.serverIP, clock=self.clock, on_state_change=self._breaker_state_changed
+                    )
+        # Server instances in the list are replaced when it's updated
+        tracked = self.server_list.get_server(server.serverIP)
+        if tracked is not None and tracked.breaker is not breaker:
+            tracked.breaker = breaker
+        return breaker
+
+    def _breaker_state_changed(self, breaker: CircuitBreaker, old_state: str, new_state: str):
+        logger.warning(f"Circuit breaker of server {breaker.name} changes from [{old_state}] to [{new_state}]")
+        self.breaker_events.append((time.time(), breaker.name, old_state, new_state))
+
+    def breaker_states(self):
+        """
+        :return: A dict with <serverIP, circuit breaker state> pairs of servers
+                 tasks were offloaded to.
+        """
+        return {ip: breaker.state for ip, breaker in self.breakers.items()}
+
+    def _acquire_breaker(self, server: Server):
+        """
+        Check circuit breaker of server before sending a task there.
+        :return: The CircuitBreaker, pass it to self._record_outcome(); None if disabled.
+        :raise CircuitOpenError: If the breaker doesn't allow the task.
+        """
+        breaker = self._get_breaker(server)
+        if breaker is not None and not breaker.allow_request():
+            raise CircuitOpenError(server.serverIP)
+        return breaker
+
+    def _reroute_server(self, data: TaskInfo):
+        """
+        A breaker open past its reset timeout reports available, so decision
+        functions still choose its server, but it lets only half_open_calls
+        probe tasks through. Choose the next best server for a task it
+        rejected, instead of failing the task.
+        :return: A Server instance other than data.server, None if there is
+                 none or the server was given by the client.
+        """
+        if data.server.serverName == "UserSpecific":
+            return None
+        return self._choose_server_except(data.server.serverIP)
+
+    def _rerouted(self, data: TaskInfo, server: Server):
+        """
+        :return: data sent to server instead, see _reroute_server().
+        """
+        with self._stats_lock:
+            self.rerouted_tasks += 1
+        self.task_log.event("rerouted", "Circuit of {} is open, send task {} to {}", data.server, data.task, server,
+                            sampled=data.logged)
+        if data.trace is not None:
+            data.trace.server = server.serverIP
+        return data._replace(server=server)
+
+    @staticmethod
+    def _record_outcome(breaker: CircuitBreaker, status_code: int = None):
+        """
+        Feed outcome of a task into the circuit breaker of its server.
+        :param status_code: HTTP status code, None if the request failed.
+                            5xx counts as failure, 4xx is a fault of the task.
+        """
+        if breaker is None:
+            return
+        if status_code is None or status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def _local_available(self):
+        """
+        :return: False if circuit breaker of local device is open.
+        """
+        local = self.server_list.get_server("127.0.0.1")
+        return local is None or local.breaker is None or local.breaker.available()
+
+    def record_latency(self, server: Server, task: str, seconds: float):
+        """
+        Record end-to-end service time of a task finished on server.
+        :param server : Server the task ran on.
+        :param task   : The task str, its interface is got by interfaces.interface_name().
+        :param seconds: Time from sending the request to getting the whole response.
+        :return: None
+        """
+        tracked = self.server_list.get_server(server.serverIP) or server
+        key = (server.serverIP, interface_name(task))
+        now = self.clock()
+        with self._latency_lock:
+            if tracked.observed_latency is None:
+                tracked.observed_latency = LatencyEstimator(Config.OBSERVED_LATENCY_ALPHA)
+            tracked.observed_latency.update(seconds, now)
+            estimator = self.interface_latency.get(key)
+            if estimator is None:
+                estimator = self.interface_latency[key] = LatencyEstimator(Config.OBSERVED_LATENCY_ALPHA)
+            estimator.update(seconds, now)
+
+    def observed_latency(self, ip: str, interface: str = None):
+        """
+        :param ip       : Server ip address.
+        :param interface: Interface name, if None, get estimator of all tasks on server.
+        :return: A LatencyEstimator, None if no task finished there yet.
+        """
+        if interface is None:
+            server = self.server_list.get_server(ip)
+            return server.observed_latency if server is not None else None
+        return self.interface_latency.get((ip, interface))
+
+    def _cached_result(self, task: str, port: int, ip: str):
+        """
+        Look up the result cache for a task.
+        Tasks with a user specific ip are never served from cache.
+        :return: [response, serverIP] if cached, else None.
+        """
+        if self.result_cache is None or ip or task_spec(task).ttl <= 0:
+            return None
+        return self.result_cache.get((task, port))
+
+    def _cache_result(self, data: TaskInfo, response, body_size: int):
+        """
+        Store a response of a finished task in the result cache, if enabled
+        and the interface of this task declares a ttl. Errors are not cached.
+        """
+        if self.result_cache is None or response.status_code >= 400:
+            return
+        ttl = task_spec(data.task).ttl
+        if ttl > 0:
+            self.result_cache.put((data.task, data.port), (response, data.server.serverIP),
+                                  ttl, size=body_size)
+
+    def _coalesce_key(self, task: str, port: int, ip: str):
+        """
+        :return: Key of in-flight table for a task which can be coalesced,
+                 None if it can't, such as non-idempotent interfaces.
+        """
+        if ip or not task_spec(task).idempotent:
+            return None
+        return task, port
+
+    def _join_in_flight(self, table: dict, key):
+        """
+        :return: [Future, serverIP] of an identical task in flight, None if not found.
+        """
+        with self._in_flight_lock:
+            entry = table.get(key)
+            if entry is not None:
+                self.coalesced_tasks += 1
+            return entry
+
+    def _start_in_flight(self, table: dict, key, start):
+        """
+        Start a task and register it in table, unless an identical task was
+        registered after _join_in_flight(), then join that one.
+        :param start: A function submitting the task, returns [Future, serverIP].
+                      Called with the lock held, so it must not block.
+        :return: [Future, serverIP]
+        """
+        with self._in_flight_lock:
+            entry = table.get(key)
+            if entry is not None:
+                self.coalesced_tasks += 1
+                return entry
+            entry = table[key] = start()
+        entry[0].add_done_callback(lambda future: self._end_in_flight(table, key, future))
+        return entry
+
+    def _end_in_flight(self, table: dict, key, future):
+        with self._in_flight_lock:
+            entry = table.get(key)
+            if entry is not None and entry[0] is future:
+                del table[key]
+
+    def outstanding_tasks(self):
+        """
+        :return: A dict with <serverIP, tasks in flight> pairs of self.server_list.
+        """
+        return {server.serverIP: server.outstanding for server in self.server_list.serverList}
+
+    def local_limit(self):
+        """
+        Max requests on local device in a throughput period, more requests are offloaded.
+        :return: Limit learned by self.local_capacity, or self.expected_throughput.
+        """
+        if self.local_capacity is not None:
+            return self.local_capacity.current()
+        return self.expected_throughput
+
     def cal_throughput(self):
         """
         Calculate throughput in a time period:
             throughput = request_count_in_a_certain_time / default_throughput_period
 
-        All requests' timestamp is in self.req_time_lst, use bisection algorithm to
-        get the index that upper than start_time. Use length of self.req_time_lst minus
-        index get the request counts in this time period.
+        Requests on local device are recorded in self.throughput_counter, a ring of
+        buckets covering the last default_throughput_period seconds, so this is O(1).
 
-        :return: A float value of request processing per second.
+        :return: Request counts on local device in the last throughput period.
         """
-        cur_time = time.time()
-        # Time range to calculate throughput is
-        # [cur_time - self.default_throughput_period, cur_time)
-        # So start_time = cur_time - DEFAULT_THROUGHPUT_PERIOD
-        start_time = cur_time - self.default_throughput_period
-
-        # Use bisection algorithm to find items in range, get the first index that
-        # self.req_time_lst(index) > start_time
-        # bisect.bisect_right can only deal with sorted arrays, so sorted first.
-        #
-        # Something wrong here is that if there is an item equals to start_time,
-        # it will not be calculated. But it doesn't matters. It's to hard to
-        # produce two same timestamps.
-        #
-        # Equals to upper_bound in C++
-        # https://stackoverflow.com/questions/29471884/get-the-immediate-minimum-among-a-list-of-numbers-in-python
-        # https://docs.python.org/3.6/library/bisect.html
-        self.req_time_lst.sort()
-        req_st_index = bisect.bisect_right(self.req_time_lst, start_time)
-        throughput = len(self.req_time_lst) - req_st_index
-
-        return throughput
+        return self.throughput_counter.count()
 
     def _choose_server_according_to_func(self, func):
         """
@@ -104,25 +572,33 @@ class DecisionEngine:
         """
         chosen_server = func()
         if chosen_server is None:
-            logger.info(f"Failed to choose server using {self.decision_func}")
+            self.task_log.event("choose_failed", "Failed to choose server using {}", self.decision_func)
             return None
         else:
-            logger.info(
-                f"Successfully choose server {chosen_server} using {self.decision_func}"
-            )
+            self.task_log.event("chosen", "Successfully choose server {} using {}",
+                                chosen_server, self.decision_func)
             return chosen_server
 
     def _choose_server_except_localhost(self):
         """
         I want to choose a server expect 127.0.0.1 using self.decision_func,
-        so copy a new_server_list and remove 127.0.0.1,
+        so copy a new_server_list without 127.0.0.1,
         use the same decision func to get the server.
         :return: A Server instance.
         """
-        # Make a deepcopy of self.server_list object, so remove or add items on
-        # this new_server_list will not have a side effect on self.server_list.
-        new_server_list = copy.deepcopy(self.server_list)
-        new_server_list.remove_ip("127.0.0.1")
+        return self._choose_server_except("127.0.0.1")
+
+    def _choose_server_except(self, ip: str, server_list: ServerList = None):
+        """
+        Choose a server except given ip using self.decision_func.
+        :param server_list: Choose from this list, default is self.server_list.
+        :return: A Server instance, None if not found.
+        """
+        if server_list is None:
+            server_list = self.server_list
+        # Make a copy of server_list object without ip, so it will not
+        # have a side effect on self.server_list. Server instances are shared.
+        new_server_list = server_list.without_ip(ip)
         if new_server_list.len() == 0:
             return None
         else:
@@ -130,62 +606,713 @@ class DecisionEngine:
             chosen_server = func()
             return chosen_server
 
-    def choose_server(self):
+    def choose_server(self, deadline: float = None):
         """
         According self.decision_algorithm, this class get decision func (now this is a str)
         self.decision_func, find the best suitable server.
 
+        :param deadline: self.clock() when the task must be finished. If not
+                         None, only servers whose expected service time meets it
+                         are chosen from; if there is none, local device is chosen
+                         if it's in self.server_list.
         :return: Server (in server.py)
         """
+        if deadline is None:
+            return self._choose_server_in(self.server_list)
+
+        server_list = self.server_list.view(lambda server: self._meets_deadline(server, deadline))
+        if server_list.len() == 0:
+            if self.server_list.contains_ip("127.0.0.1") and self._local_available():
+                self.task_log.event("deadline_local",
+                                    "No server can meet the deadline, choose local device as execution location")
+                return Server("LocalDevice", "127.0.0.1")
+            self.task_log.event("deadline_unmet", "No server can meet the deadline")
+            return None
+        return self._choose_server_in(server_list)
+
+    def _no_server_error(self, task: str, deadline: float):
+        """
+        Error of a task with a deadline which no server was chosen for.
+        :return: DeadlineExceeded if choose_server() filtered out every server
+                 by the deadline, else NoServerAvailable.
+        """
+        servers = self.server_list.serverList
+        if servers and not any(self._meets_deadline(server, deadline) for server in servers):
+            return DeadlineExceeded(f"No server can finish task {task} before its deadline")
+        return NoServerAvailable(f"No server available for task {task}")
+
+    def _meets_deadline(self, server: Server, deadline: float):
+        """
+        :return: True if expected service time of server (see
+                 ServerList._expected_latency()) is within deadline.
+        """
+        now = self.clock()
+        latency = self.server_list._expected_latency(server, now)
+        return latency is not None and now + latency <= deadline
+
+    def _choose_server_in(self, server_list: ServerList):
+        """
+        Body of choose_server(), choose a server from server_list, which is
+        self.server_list or a view of it.
+        :return: A Server instance, None if not found.
+        """
         # func is a decision function in ServerList class.
-        func = self.server_list.map_decision_func().get(self.decision_func)
+        func = server_list.map_decision_func().get(self.decision_func)
         # If there is not a server returned by decision function, func() will return None.
 
-        if self.consider_throughout and self.server_list.contains_ip("127.0.0.1"):
+        if self.consider_throughout and server_list.contains_ip("127.0.0.1"):
             # Check if DecisionEngine can use local device to handle request.
             # In other word, check if 127.0.0.1 is in self.server_list
-            logger.info("Choose server consider throughput")
+            self.task_log.event("consider_throughput", "Choose server consider throughput")
 
             # Consider throughput on local device, if it's larger than default throughput,
             # choose server and offload requests.
-            if self.cal_throughput() > self.expected_throughput:
+            if not self._local_available():
+                self.task_log.event("local_open",
+                                    "Circuit breaker of local device is open, choose an server except local device")
+                return self._choose_server_except("127.0.0.1", server_list)
+            if self.cal_throughput() > self.local_limit():
                 # Choose another server expect local device
-                logger.info(
-                    "Current throughput is larger than expected throughput, "
-                    + "choose an server except local device"
-                )
-                return self._choose_server_except_localhost()
+                self.task_log.event("local_full",
+                                    "Current throughput is larger than expected throughput, "
+                                    "choose an server except local device")
+                return self._choose_server_except("127.0.0.1", server_list)
             else:
                 # Run this task on local device
-                logger.info(
-                    "Current throughput is not larger than expected throughput, "
-                    + "choose local device as execution location"
-                )
+                self.task_log.event("local",
+                                    "Current throughput is not larger than expected throughput, "
+                                    "choose local device as execution location")
                 return Server("LocalDevice", "127.0.0.1")
         else:
             # Not consider throughout on local device, using self.decision_algorithm to
             # choose server
             return self._choose_server_according_to_func(func)
 
-    def submit_task(self, task: str, port: int = 80, ip: str = None):
+    def submit_task(self, task: str, port: int = 80, ip: str = None, timeout: float = None):
         """
         Add (Server, task) tuple to task queue.
 
-        :param task: A task receive by this function. (now is a str)
-        :param port: This task run on server specific port, if not specified, use 80.
-        :param ip  : Server ip address where you want to run your task.
+        :param task   : A task receive by this function. (now is a str)
+        :param port   : This task run on server specific port, if not specified, use 80.
+        :param ip     : Server ip address where you want to run your task.
+        :param timeout: Seconds from now the task must be finished in, None for
+                        no deadline. Servers which can't meet the deadline are not
+                        chosen, the deadline is enforced on connecting and reading,
+                        and the remaining time is sent in Config.DEADLINE_HEADER.
+                        If it's exceeded, the Future raises DeadlineExceeded.
         :return: If chosen_server=self.choose_server is None, return None;
-                 else return [Future, Server.serverIP]
+                 else return [Future, Server.serverIP].
+                 If no server can meet the deadline, return [Future, None], the
+                 Future raises DeadlineExceeded.
+        :raise EngineOverloaded: If admission control is enabled and rejects the task.
         """
-        chosen_server = Server("UserSpecific", ip) if ip else self.choose_server()
-        if chosen_server is None:
-            logger.info(f"Failed to submit task, chosen server is None")
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        return self._submit_task(task, port, ip, lambda: self.choose_server(deadline), deadline)
+
+    def _submit_task(self, task: str, port: int, ip: str, choose, deadline: float = None):
+        """
+        Submit a task to the server returned by choose(), unless it's served
+        from cache or joins an identical task in flight.
+        :param choose  : A function returning a Server instance or None.
+        :param deadline: time.monotonic() when the task must be finished, or None.
+        :return: Same as submit_task().
+        """
+        if self.recorder is None:
+            return self._route_task(task, port, ip, choose, deadline)
+        arrival, st = time.time(), time.perf_counter()
+        try:
+            ret = self._route_task(task, port, ip, choose, deadline)
+        except Exception:
+            # Such as rejected by admission control
+            self.recorder.record(task, port, None, arrival, 0.0, 0)
+            raise
+        return self._record_task(task, port, arrival, st, ret)
+
+    def _record_task(self, task: str, port: int, arrival: float, st: float, ret):
+        """
+        Record a submitted task when its Future is done.
+        :param arrival: time.time() when the task was submitted.
+        :param st     : time.perf_counter() when the task was submitted.
+        :param ret    : What submit_task() returns for the task.
+        :return: ret
+        """
+        if ret is None:
+            self.recorder.record(task, port, None, arrival, 0.0, 0)
+            return ret
+        future, server_ip = ret
+
+        def done(f):
+            status = 0
+            if not f.cancelled() and f.exception() is None:
+                status = f.result().status_code
+            self.recorder.record(task, port, server_ip, arrival, time.perf_counter() - st, status)
+
+        future.add_done_callback(done)
+        return ret
+
+    def _route_task(self, task: str, port: int, ip: str, choose, deadline: float = None):
+        """
+        Body of _submit_task(), without recording.
+        """
+        logged = self.task_log.begin()
+        cached = self._cached_result(task, port, ip)
+        if cached is not None:
+            # Complete the Future here, without touching the thread pool
+            response, server_ip = cached
+            future = Future()
+            future.set_result(response)
+            self.task_log.event("cache_hit", "Get result of task {} from cache", task, sampled=logged)
+            return future, server_ip
+
+        # Share the Future of an identical task in flight
+        key = self._coalesce_key(task, port, ip)
+        if key is not None:
+            entry = self._join_in_flight(self.in_flight_tasks, key)
+            if entry is not None:
+                self.task_log.event("coalesced", "Coalesce task {} with an identical task in flight", task,
+                                    sampled=logged)
+                return tuple(entry)
+
+        # Cached and coalesced tasks above make no remote call, nothing to
+        # trace; they would be traces which never finish.
+        trace = self.tracer.start(task) if self.tracer is not None else None
+        # Only tasks queued for a worker are admitted, cached and coalesced
+        # ones above cost nothing
+        if self.admission is not None:
+            self.admission.admit()
+        # admit() took a queue slot for this task, which its first attempt
+        # takes over. Released if the task is not queued after all.
+        reserved = self.admission is not None
+        try:
+            chosen_server = Server("UserSpecific", ip) if ip else choose()
+            if chosen_server is None:
+                self.task_log.event("no_server", "Failed to submit task, chosen server is None", sampled=logged)
+                if deadline is None:
+                    return None
+                # Fail fast, instead of a task which will time out anyway
+                future = Future()
+                future.set_exception(self._no_server_error(task, deadline))
+                return future, None
+            if trace is not None:
+                trace.server = chosen_server.serverIP
+                trace.mark("route")
+            task_added = TaskInfo(chosen_server, task, port, deadline, trace, logged)
+            self.task_log.event("submitted", "Successfully submit task {}", task_added, sampled=logged)
+
+            def start():
+                nonlocal reserved
+                future = self._start_task(task_added, reserved)
+                reserved = False
+                if self.hedge_percentile is not None and not ip and task_spec(task).idempotent:
+                    future = self._hedge(task_added, future)
+                # A task sent to a user specific ip has nowhere to fail over
+                if not ip and task_spec(task).retries > 0:
+                    future = self._retry(task_added, future)
+                return [future, chosen_server.serverIP]
+
+            if key is None:
+                return tuple(start())
+            return tuple(self._start_in_flight(self.in_flight_tasks, key, start))
+        finally:
+            if reserved:
+                self.admission.dequeued()
+
+    @property
+    def timers(self):
+        """
+        A TimerQueue of this engine, its thread starts on first use.
+        """
+        if self._timers is None:
+            with self._timers_lock:
+                if self._timers is None:
+                    self._timers = TimerQueue(name="DecisionEngineTimers")
+        return self._timers
+
+    def _hedge_delay(self, data: TaskInfo):
+        """
+        Seconds to wait before hedging a task: hedge_percentile of observed
+        latency of its interface on its server, or of all tasks on its server.
+        :return: A float, None if there are not enough recent samples.
+        """
+        now = self.clock()
+        for estimator in (self.observed_latency(data.server.serverIP, interface_name(data.task)),
+                          self.observed_latency(data.server.serverIP)):
+            if estimator is not None and estimator.is_warm(Config.OBSERVED_LATENCY_MIN_SAMPLES,
+                                                           Config.OBSERVED_LATENCY_MAX_AGE, now):
+                return estimator.quantile(self.hedge_percentile / 100)
+        return None
+
+    def _hedge(self, data: TaskInfo, primary: Future):
+        """
+        Wrap primary Future of a task: if it's not done after self._hedge_delay(),
+        and hedge budget allows, send the task to the next best server too.
+        The first successful attempt completes the returned Future, and other
+        attempts are cancelled if not started yet, else their results are
+        discarded. If all attempts fail, the last exception is set.
+
+        :return: A Future of the response. Its server_ip attribute is set to
+                 the ip of the server which answered.
+        """
+        self.hedge_budget.record_request()
+        delay = self._hedge_delay(data)
+        if delay is None:
+            return primary
+
+        proxy = Future()
+        # Running Futures can't be cancelled by callers, so set_result() is safe
+        proxy.set_running_or_notify_cancel()
+        lock = threading.Lock()
+        # Attempts as [Future, Server], and attempts not finished yet
+        attempts = [[primary, data.server]]
+        state = {"pending": 1}
+
+        def on_done(future):
+            with lock:
+                if proxy.done():
+                    return
+                state["pending"] -= 1
+                server = next(server for f, server in attempts if f is future)
+                if not future.cancelled() and future.exception() is None:
+                    timer.cancel()
+                    proxy.server_ip = server.serverIP
+                    proxy.set_result(future.result())
+                    if future is not primary:
+                        with self._stats_lock:
+                            self.hedge_wins += 1
+                    losers = [f for f, s in attempts if f is not future]
+                elif state["pending"] == 0:
+                    timer.cancel()
+                    if future.cancelled():
+                        proxy.set_exception(CancelledError())
+                    else:
+                        proxy.set_exception(future.exception())
+                    return
+                else:
+                    return
+            for loser in losers:
+                loser.cancel()
+
+        def send_hedge():
+            if self._closing:
+                return
+            # Don't choose in the timer thread, which runs timers of every
+            # task, and decision functions may ping servers
+            try:
+                self.pool.submit(hedge_task)
+            except RuntimeError:
+                # The engine is closed
+                pass
+
+        def hedge_task():
+            if proxy.done() or not self.hedge_budget.try_acquire():
+                return
+            server = self._choose_server_except(data.server.serverIP)
+            if server is None:
+                return
+            with lock:
+                if proxy.done():
+                    return
+                try:
+                    hedge = self._start_task(data._replace(
+                        server=server, trace=Tracer.next_attempt(data.trace, server.serverIP)))
+                except RuntimeError:
+                    # The engine is closed, the primary attempt still
+                    # completes proxy
+                    return
+                attempts.append([hedge, server])
+                state["pending"] += 1
+                with self._stats_lock:
+                    self.hedged_tasks += 1
+            self.task_log.event("hedged", "Hedge task {} to {} after {:.3f} s", data.task, server, delay,
+                                sampled=data.logged)
+            hedge.add_done_callback(on_done)
+
+        try:
+            timer = self.timers.call_later(delay, send_hedge)
+        except RuntimeError:
+            # The engine is closed
+            return primary
+        primary.add_done_callback(on_done)
+        return proxy
+
+    @staticmethod
+    def _retry_backoff(attempt: int):
+        """
+        Exponential backoff with full jitter before a retry.
+        :param attempt: Retries of the task so far.
+        :return: Seconds to wait.
+        """
+        return random.uniform(0, min(Config.RETRY_BACKOFF_MAX, Config.RETRY_BACKOFF_BASE * 2 ** attempt))
+
+    def _retry_server(self, data: TaskInfo, attempt: int):
+        """
+        Choose the server to retry a failed task, if it can be retried.
+        :param data   : TaskInfo of the failed attempt.
+        :param attempt: Retries of the task so far.
+        :return: A Server instance other than data.server, None if the task
+                 can't be retried.
+        """
+        if attempt >= task_spec(data.task).retries:
+            return None
+        if data.deadline is not None and time.monotonic() >= data.deadline:
+            return None
+        if not self.retry_budget.try_acquire():
             return None
-        task_added = TaskInfo(chosen_server, task, port)
-        logger.info(f"Successfully submit task {task_added} to ThreadPool")
+        return self._choose_server_except(data.server.serverIP)
+
+    @staticmethod
+    def _is_failure(future):
+        """
+        :return: True if a finished attempt should be retried: an exception
+                 other than cancellation, or a 5xx response.
+        """
+        if future.cancelled():
+            return False
+        error = future.exception()
+        if error is not None:
+            return not isinstance(error, CancelledError)
+        return future.result().status_code >= 500
+
+    def _retry(self, data: TaskInfo, first: Future):
+        """
+        Wrap Future of the first attempt of a task: if it fails with an
+        exception or a 5xx response, send the task again to another server
+        chosen by self.decision_func, after a jittered exponential backoff.
+        Up to task_spec(task).retries retries, if retry budget allows.
+
+        :return: A Future of the response of the last attempt. Its server_ip
+                 attribute is set to the ip of the server which answered.
+        """
+        self.retry_budget.record_request()
+        proxy = Future()
+        proxy.set_running_or_notify_cancel()
+
+        def on_done(future, data: TaskInfo, attempt: int):
+            server_ip = getattr(future, "server_ip", data.server.serverIP)
+            if self._is_failure(future) and attempt < task_spec(data.task).retries:
+                # Don't choose here, callbacks may run in an event loop, and
+                # decision functions may ping servers
+                try:
+                    self.timers.call_later(self._retry_backoff(attempt),
+                                           lambda: resubmit(future, data, attempt))
+                    return
+                except RuntimeError:
+                    # The engine is closed
+                    pass
+            finish(future, server_ip)
+
+        def resubmit(future, data: TaskInfo, attempt: int):
+            if self._closing:
+                finish(future, data.server.serverIP)
+                return
+            try:
+                self.pool.submit(retry, future, data, attempt)
+            except RuntimeError:
+                # The engine is closed
+                finish(future, data.server.serverIP)
+
+        def retry(future, data: TaskInfo, attempt: int):
+            server = self._retry_server(data, attempt)
+            if server is None:
+                finish(future, data.server.serverIP)
+                return
+            with self._stats_lock:
+                self.retried_tasks += 1
+            self.task_log.event("retried", "Retry task {} on {} after failing on {}", data.task, server, data.server,
+                                sampled=data.logged)
+            retried = data._replace(server=server, trace=Tracer.next_attempt(data.trace, server.serverIP))
+            try:
+                attempt_future = self._start_task(retried)
+            except RuntimeError:
+                # The engine is closed
+                finish(future, data.server.serverIP)
+                return
+            attempt_future.add_done_callback(lambda f: on_done(f, retried, attempt + 1))
+
+        def finish(future, server_ip: str):
+            proxy.server_ip = server_ip
+            if future.cancelled():
+                proxy.set_exception(CancelledError())
+            elif future.exception() is not None:
+                proxy.set_exception(future.exception())
+            else:
+                proxy.set_result(future.result())
+
+        first.add_done_callback(lambda f: on_done(f, data, 0))
+        return proxy
+
+    def plan_batch(self, count: int, deadline: float = None):
+        """
+        Choose servers for a batch of tasks in one routing pass.
+
+        Local capacity is checked once: if throughput is considered, local device
+        takes tasks until expected throughput is reached, and the rest are
+        routed by the decision function. Every task assigned by the pass counts
+        as in flight while planning, so load-aware decision functions spread
+        the batch across servers instead of sending it all to one server.
+        Decision functions which don't read load choose once for the batch,
+        see Config.LOAD_INDEPENDENT_DECISION_FUNCS.
+
+        :param count   : Number of tasks in the batch.
+        :param deadline: self.clock() when tasks must be finished, servers are
+                         chosen from those meeting it like choose_server().
+        :return: A list of count Server instances (or None if not found).
+        """
+        plan = list()
+        server_list = self.server_list
+        if deadline is not None:
+            server_list = self.server_list.view(lambda server: self._meets_deadline(server, deadline))
+            if server_list.len() == 0:
+                # Same fallback as choose_server()
+                if self.server_list.contains_ip("127.0.0.1") and self._local_available():
+                    self.task_log.event("deadline_local",
+                                        "No server can meet the deadline, choose local device as execution location")
+                    return [Server("LocalDevice", "127.0.0.1")] * count
+                self.task_log.event("deadline_unmet", "No server can meet the deadline")
+                return [None] * count
+        if self.consider_throughout and server_list.contains_ip("127.0.0.1"):
+            local_budget = max(0, self.local_limit() - self.cal_throughput())
+            if not self._local_available():
+                local_budget = 0
+            plan.extend([Server("LocalDevice", "127.0.0.1")] * min(local_budget, count))
+            server_list = server_list.without_ip("127.0.0.1")
+        if len(plan) == count:
+            return plan
+
+        func = server_list.map_decision_func().get(self.decision_func)
+        if not server_list.len():
+            plan.extend([None] * (count - len(plan)))
+        elif self.decision_func in Config.LOAD_INDEPENDENT_DECISION_FUNCS:
+            # Such as pinging every server, once is enough
+            plan.extend([func()] * (count - len(plan)))
+        else:
+            # Decision functions run without the lock, which is only held for
+            # counting, so tasks submitted meanwhile don't wait for the batch.
+            planned = list()
+            try:
+                while len(plan) < count:
+                    chosen_server = func()
+                    plan.append(chosen_server)
+                    if chosen_server is not None:
+                        with self._outstanding_lock:
+                            chosen_server.outstanding += 1
+                        planned.append(chosen_server)
+            finally:
+                # Counted again when tasks really start
+                for server in planned:
+                    with self._outstanding_lock:
+                        server.outstanding -= 1
+        logger.info(f"Plan batch of {count} tasks using {self.decision_func}")
+        return plan
+
+    def submit_many(self, tasks, port: int = 80, ordered: bool = True, window: int = None,
+                    timeout: float = None):
+        """
+        Submit a batch of tasks, routed in one pass by self.plan_batch(), and
+        stream results back.
+
+        At most window tasks are in flight at a time, and every result is
+        dropped by this generator after it's yielded, so large batches don't
+        hold every response in memory at once.
+
+        :param tasks  : An iterable of task str.
+        :param port   : Port of all tasks.
+        :param ordered: If True, yield results in the order of tasks; else yield
+                        results as they complete.
+        :param window : Max tasks in flight, default is 2 * max_workers.
+        :param timeout: Seconds from now every task must be finished in, see submit_task().
+        :return: A generator of (index in tasks, Future, Server.serverIP). The
+                 Future is done when yielded; if no server was chosen for the
+                 task, Future and serverIP are None. A task rejected by
+                 admission control has a Future raising EngineOverloaded.
+        """
+        tasks = list(tasks)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        plan = self.plan_batch(len(tasks), deadline)
+        window = window or 2 * self.max_workers
+        to_submit = iter(enumerate(zip(tasks, plan)))
+        # Entries are [index, Future, serverIP]. Coalesced tasks may share a
+        # Future, so entries are not keyed by Future.
+        pending = deque()
+
+        def fill():
+            for index, (task, server) in to_submit:
+                try:
+                    ret = self._submit_task(task, port, None, lambda: server, deadline)
+                except EngineOverloaded as e:
+                    future = Future()
+                    future.set_exception(e)
+                    ret = (future, None)
+                pending.append([index, *(ret or (None, None))])
+                if len(pending) >= window:
+                    return
+
+        fill()
+        while pending:
+            if ordered:
+                entry = pending.popleft()
+                if entry[1] is not None:
+                    wait([entry[1]])
+                yield tuple(entry)
+            else:
+                not_done = {entry[1] for entry in pending if entry[1] is not None}
+                if not_done:
+                    wait(not_done, return_when=FIRST_COMPLETED)
+                for entry in [entry for entry in pending if entry[1] is None or entry[1].done()]:
+                    pending.remove(entry)
+                    yield tuple(entry)
+            fill()
+
+    def _start_task(self, data: TaskInfo, reserved: bool = False):
+        """
+        Start offloading a task without blocking.
+        The task counts as in flight on its server from now until its Future is
+        done, waiting for a worker included, so load-aware decision functions
+        see tasks routed just before, not only those already sending.
+        :param reserved: True if admission control counts the task as queued
+                         already, see AdmissionController.admit().
+        :return: A concurrent.futures.Future of the response.
+        """
+        tracked = self._task_started(data.server)
+        try:
+            future = self._start_attempt(data, reserved)
+        except BaseException:
+            self._task_finished(tracked)
+            raise
+        future.add_done_callback(lambda f: self._task_finished(tracked))
+        return future
+
+    def _start_attempt(self, data: TaskInfo, reserved: bool = False):
+        """
+        Body of _start_task(), without counting the task in flight.
+        :return: A concurrent.futures.Future of the response.
+        """
         # Don't return .results() here, only you call results() method
         # it will block.
-        return self.pool.submit(self.offload_task, task_added), chosen_server.serverIP
+        if self.admission is None and self.local_capacity is None and self.metrics is None:
+            return self._trace_future(data, self._submit_to_pool(data, self.offload_task, data))
+        if self.admission is not None and not reserved:
+            self.admission.enqueued()
+        future = self._submit_to_pool(data, self._run_queued_task, data, time.monotonic())
+        if self.admission is not None:
+            future.add_done_callback(self._cancelled_in_queue)
+        return self._trace_future(data, future)
+
+    def _trace_future(self, data: TaskInfo, future):
+        """
+        Finish the trace of a traced task when its Future is done, so every
+        outcome is traced, such as a task cancelled in queue.
+        :param future: A concurrent.futures.Future or an asyncio.Future.
+        :return: future
+        """
+        if data.trace is not None:
+            future.add_done_callback(lambda f: self._finish_trace(data.trace, f))
+        return future
+
+    def _finish_trace(self, trace: TaskTrace, future):
+        if future.cancelled():
+            self.tracer.finish(trace, error=CancelledError())
+        elif future.exception() is not None:
+            self.tracer.finish(trace, error=future.exception())
+        else:
+            self.tracer.finish(trace, future.result().status_code)
+
+    def _trace_headers(self, trace: TaskTrace, headers: dict):
+        """
+        :return: headers with the trace id of a traced task added.
+        """
+        if trace is None:
+            return headers
+        headers = dict(headers) if headers else dict()
+        headers[self.tracer.header] = trace.trace_id
+        return headers
+
+    def _submit_to_pool(self, data: TaskInfo, func, *args):
+        """
+        Submit func(*args) of a task to self.pool, through the priority
+        scheduler if enabled.
+        :return: A concurrent.futures.Future.
+        """
+        if self.scheduler is None:
+            return self.pool.submit(func, *args)
+        return self.scheduler.submit(task_spec(data.task).priority, func, *args)
+
+    def _cancelled_in_queue(self, future: Future):
+        # A task cancelled in queue never starts, so never reports its queue wait
+        if future.cancelled():
+            self.admission.dequeued()
+
+    def _run_queued_task(self, data: TaskInfo, enqueued: float):
+        """
+        Run a task queued by _start_task(), reporting its queue wait to
+        admission control and metrics, and its latency to local capacity
+        controller if it ran on local device.
+        """
+        wait = time.monotonic() - enqueued
+        if self.admission is not None:
+            self.admission.dequeued(wait)
+        try:
+            if self.metrics is None:
+                response = self.offload_task(data)
+            else:
+                self.metrics.queue_waited(task_spec(data.task).priority, wait)
+                with self._stats_lock:
+                    self.busy_workers += 1
+                try:
+                    response = self.offload_task(data)
+                finally:
+                    with self._stats_lock:
+                        self.busy_workers -= 1
+        except CircuitOpenError:
+            # Rejected without running, says nothing about load
+            raise
+        except Exception:
+            self._record_local_latency(data, time.monotonic() - enqueued, failed=True)
+            raise
+        self._record_local_latency(data, time.monotonic() - enqueued)
+        return response
+
+    def _record_local_latency(self, data: TaskInfo, latency: float, failed: bool = False):
+        """
+        Report latency of a task to the local capacity controller, if it ran
+        on local device.
+        :param failed: True if the task failed, such as timing out. Failures
+                       are the clearest sign of an overloaded local device, so
+                       they count as at least twice the latency target.
+        """
+        if self.local_capacity is None or data.server.serverIP != "127.0.0.1":
+            return
+        if failed:
+            latency = max(latency, 2 * self.local_capacity.target)
+        self.local_capacity.record(latency, self.cal_throughput())
+
+    @staticmethod
+    def _request_timeout(data: TaskInfo):
+        """
+        Timeouts and headers of the request of a task. A task with a deadline
+        waits for connecting and reading at most until the deadline, and sends
+        the remaining time in ms to the server in Config.DEADLINE_HEADER.
+        Read timeout applies to every read of the socket, a server sends its
+        response after running the task, so it bounds the run time too.
+        :return: (connect timeout, read timeout, headers)
+        :raise DeadlineExceeded: If the deadline is already passed.
+        """
+        if data.deadline is None:
+            return Config.CONNECT_TIMEOUT, Config.READ_TIMEOUT, None
+        remaining = data.deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Task {data.task} exceeded its deadline before being sent")
+        return (min(Config.CONNECT_TIMEOUT, remaining), remaining,
+                {Config.DEADLINE_HEADER: str(int(remaining * 1000))})
+
+    @staticmethod
+    def _check_deadline(data: TaskInfo, error: Exception):
+        """
+        Called with a timeout error of a task.
+        :raise DeadlineExceeded: If the deadline of the task is passed.
+        """
+        if data.deadline is not None and time.monotonic() >= data.deadline:
+            raise DeadlineExceeded(f"Task {data.task} on {data.server} exceeded its deadline") from error
 
     def offload_task(self, data: TaskInfo):
         """
@@ -196,28 +1323,503 @@ class DecisionEngine:
                  response of requests.get() method. So when you print this response,
                  you will get a HTTP response code.
         """
-        # Add current time to self.req_time_lst. For calculating throughput on
-        # this local device future.
-        # Notes that this operation is in a new thread.
-        # NECESSARILY NEED A LOCK HERE???
-        # I THINK NOT NECESSARY.
-        cur_time = time.time()
-        # Only tasks on local device will be added to request_time_list
+        trace = data.trace
+        if trace is not None:
+            trace.mark("queue")
+        # Only tasks on local device are counted for calculating throughput
+        # on this local device. SlidingWindowCounter takes its own lock, so
+        # it's safe to record from worker threads.
         if data.server == Server("temp", "127.0.0.1"):
-            self.req_time_lst.append(cur_time)
+            self.throughput_counter.record()
 
-        logger.info(f"Get task {data} and start offloading." +
-                    f" Current time is {cur_time:.2f}, add to req_time_lst")
+        self.task_log.event("offloading", "Get task {} and start offloading", data, sampled=data.logged)
 
-        # data is a TaskInfo(server: Server, task: str, port: int)
+        # data is a TaskInfo(server: Server, task: str, port: int, deadline: float)
         # data = self.task_queue.get()
         server = data.server
         task = data.task
         port = data.port
+        # Raises DeadlineExceeded if the task waited in queue past its deadline
+        connect_timeout, read_timeout, headers = self._request_timeout(data)
+        headers = self._trace_headers(trace, headers)
 
-        logger.info(f"Call remote server {server.serverIP}:{port} with task=\'{task}\'")
-        r = requests.get(f"http://{server.serverIP}:{port}/{task}")
+        self.task_log.event("call", "Call remote server {}:{} with task='{}'", server.serverIP, port, task,
+                            sampled=data.logged)
+        # The rerouted task counts in flight on its new server while it's sent
+        rerouted = None
+        try:
+            breaker = self._acquire_breaker(server)
+        except CircuitOpenError:
+            other = self._reroute_server(data)
+            if other is None:
+                raise
+            data, server = self._rerouted(data, other), other
+            breaker = self._acquire_breaker(server)
+            rerouted = self._task_started(server)
+        pooled = self._is_pooled(server)
+        session = self.get_session(server) if pooled else self._new_session(1)
+        try:
+            if trace is not None:
+                set_sending(trace)
+            st = time.perf_counter()
+            try:
+                r = session.get(f"http://{server.serverIP}:{port}/{task}",
+                                timeout=(connect_timeout, read_timeout), headers=headers)
+            except Exception as e:
+                self._record_outcome(breaker)
+                if self.metrics is not None:
+                    self.metrics.task_finished(server.serverIP, interface_name(task), failed=True)
+                if isinstance(e, requests.Timeout):
+                    self._check_deadline(data, e)
+                raise
+            # Only finished requests are observed, a refused connection is fast
+            # but says nothing about service time.
+            elapsed = time.perf_counter() - st
+            self.record_latency(server, task, elapsed)
+            if trace is not None:
+                # r.elapsed is the time until response headers arrived
+                trace.request_finished(st, st + elapsed, st + r.elapsed.total_seconds())
+        finally:
+            if rerouted is not None:
+                self._task_finished(rerouted)
+            if trace is not None:
+                set_sending(None)
+            if not pooled:
+                session.close()
+        self._record_outcome(breaker, r.status_code)
+        if self.metrics is not None:
+            self.metrics.task_finished(server.serverIP, interface_name(task), elapsed, r.status_code >= 500)
+        self._cache_result(data, r, len(r.content))
 
         # r.__repr__() is "<Response [200]>"
         # r.text is the real text
         return r
+
+
+class OffloadResponse(NamedTuple):
+    """
+    Response of a task offloaded by AsyncDecisionEngine.
+    Has the same fields routes read from requests.Response.
+    """
+
+    status_code: int
+    text: str
+    headers: dict
+
+
+class AsyncDecisionEngine(DecisionEngine):
+    """
+    A DecisionEngine running offloading tasks as coroutines on an event loop.
+
+    DecisionEngine holds a worker thread for the whole remote call, so in-flight
+    tasks are capped by max_workers. Here every in-flight task is a coroutine
+    waiting on a socket, and the limit is max_connections per server.
+
+    The event loop runs in a background thread owned by this engine. Choosing
+    servers is the same as DecisionEngine, and runs in the thread pool when
+    called from the event loop, because decision functions may ping servers.
+
+    Usage from sync code (such as Flask routes), same as DecisionEngine:
+
+        ret, server = de.submit_task(task, port=5000)
+        ret.result().text
+
+    Usage from coroutines:
+
+        ret, server = await de.submit_task_async(task, port=5000)
+        (await ret).text
+
+    Tasks here don't wait for worker threads, so the priority scheduler
+    doesn't apply. With admission control, at most max_in_flight tasks are
+    sent at once, others wait in the event loop for a slot, and admission
+    control bounds and sheds those as tasks waiting for a worker.
+    """
+
+    def __init__(
+            self,
+            *,
+            decision_algorithm: str,
+            server_list: ServerList,
+            max_workers: int = 20,
+            consider_throughput: bool = False,
+            max_connections: int = 1000,
+            max_in_flight: int = Config.ASYNC_MAX_IN_FLIGHT,
+            **kwargs,
+    ):
+        """
+        :param max_workers    : Threads used for choosing servers only.
+        :param max_connections: Max connections to a server if Server.pool_size
+                                is not configured.
+        :param max_in_flight  : Max tasks sent at once if admission_control is set.
+        :param kwargs         : Other keyword arguments of DecisionEngine.
+        """
+        self.max_connections = max_connections
+        # aiohttp.ClientSession of every server ip, only used in self.loop
+        self.async_sessions = dict()
+        # Like self.in_flight_tasks, for asyncio futures of submit_task_async()
+        self.in_flight_async_tasks = dict()
+
+        super().__init__(
+            decision_algorithm=decision_algorithm,
+            server_list=server_list,
+            max_workers=max_workers,
+            consider_throughput=consider_throughput,
+            **kwargs,
+        )
+        # Slots of tasks being sent, the workers of admission control here.
+        # None if admission control is disabled.
+        self.max_in_flight = max_in_flight
+        self._in_flight_slots = asyncio.Semaphore(max_in_flight) if self.admission is not None else None
+
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(
+            target=self.loop.run_forever, name="AsyncDecisionEngine", daemon=True
+        )
+        self._loop_thread.start()
+        logger.info(f"Initial AsyncDecisionEngine with [{max_connections}] connections per server")
+
+    def _new_metrics(self):
+        # Tasks are sent in self.loop, not by worker threads
+        return EngineMetrics(self, worker_pool=False)
+
+    def _get_async_session(self, server: Server):
+        """
+        Get the keep-alive aiohttp session of given server, create one if not exists.
+        Only called in self.loop, so there is no lock here.
+        """
+        session = self.async_sessions.get(server.serverIP)
+        if session is None:
+            pool_size = self._pool_size(server, default=self.max_connections)
+            session = self._new_async_session(pool_size)
+            self.async_sessions[server.serverIP] = session
+            logger.info(f"Create async session for {server} with pool size [{pool_size}]")
+        return session
+
+    def _new_async_session(self, pool_size: int):
+        # Time new connections of traced tasks
+        trace_configs = [aiohttp_trace_config()] if self.tracer is not None else None
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size),
+                                     trace_configs=trace_configs)
+
+    def evict_sessions(self, servers: list):
+        super().evict_sessions(servers)
+        # Close aiohttp sessions in the event loop
+        self.loop.call_soon_threadsafe(self._evict_async_sessions, servers)
+
+    def _evict_async_sessions(self, servers: list):
+        for server in servers:
+            session = self.async_sessions.pop(server.serverIP, None)
+            if session is not None:
+                self.loop.create_task(session.close())
+
+    def close(self):
+        """
+        Close all sessions, then stop the event loop and the thread pool.
+        :return: None
+        """
+        # Before the loop closes, evict_sessions() schedules calls on it
+        self.server_list.remove_removal_listener(self.evict_sessions)
+
+        async def close_sessions():
+            for session in self.async_sessions.values():
+                await session.close()
+            self.async_sessions.clear()
+
+        asyncio.run_coroutine_threadsafe(close_sessions(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._loop_thread.join()
+        self.loop.close()
+        super().close()
+
+    def _start_attempt(self, data: TaskInfo, reserved: bool = False):
+        """
+        Thread-safe bridge for sync code: submit_task() chooses server in calling
+        thread, then offload_task_async() runs in self.loop.
+        :return: A concurrent.futures.Future of the OffloadResponse.
+        """
+        return self._trace_future(data, asyncio.run_coroutine_threadsafe(
+            self.offload_task_async(data, time.monotonic(), reserved), self.loop))
+
+    def _start_task_async(self, data: TaskInfo, submitted: float = None, reserved: bool = False):
+        """
+        Same as _start_task(), called in self.loop.
+        :return: An asyncio.Task of the OffloadResponse.
+        """
+        tracked = self._task_started(data.server)
+        task_future = self.loop.create_task(self.offload_task_async(data, submitted, reserved))
+        task_future.add_done_callback(lambda f: self._task_finished(tracked))
+        return self._trace_future(data, task_future)
+
+    async def submit_task_async(self, task: str, port: int = 80, ip: str = None, timeout: float = None):
+        """
+        Same as submit_task(), but called in coroutines running in self.loop.
+
+        :return: If chosen_server is None, return None;
+                 else return [asyncio.Future, Server.serverIP]
+        """
+        if self.recorder is None:
+            return await self._route_task_async(task, port, ip, timeout)
+        arrival, st = time.time(), time.perf_counter()
+        ret = await self._route_task_async(task, port, ip, timeout)
+        return self._record_task(task, port, arrival, st, ret)
+
+    async def _route_task_async(self, task: str, port: int, ip: str, timeout: float):
+        """
+        Body of submit_task_async(), without recording.
+        """
+        logged = self.task_log.begin()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        cached = self._cached_result(task, port, ip)
+        if cached is not None:
+            response, server_ip = cached
+            future = self.loop.create_future()
+            future.set_result(response)
+            return future, server_ip
+
+        # asyncio futures of in-flight tasks are kept apart from the
+        # concurrent futures of submit_task()
+        key = self._coalesce_key(task, port, ip)
+        if key is not None:
+            entry = self._join_in_flight(self.in_flight_async_tasks, key)
+            if entry is not None:
+                return tuple(entry)
+
+        # See _route_task()
+        trace = self.tracer.start(task) if self.tracer is not None else None
+        if self.admission is not None:
+            self.admission.admit()
+        reserved = self.admission is not None
+        try:
+            if ip:
+                chosen_server = Server("UserSpecific", ip)
+            else:
+                chosen_server = await self.loop.run_in_executor(self.pool, self._choose_server_logged, logged,
+                                                                deadline)
+            if chosen_server is None:
+                self.task_log.event("no_server", "Failed to submit task, chosen server is None", sampled=logged)
+                if deadline is None:
+                    return None
+                future = self.loop.create_future()
+                future.set_exception(self._no_server_error(task, deadline))
+                return future, None
+            if trace is not None:
+                trace.server = chosen_server.serverIP
+                trace.mark("route")
+            task_added = TaskInfo(chosen_server, task, port, deadline, trace, logged)
+            self.task_log.event("submitted", "Successfully submit task {} to event loop", task_added, sampled=logged)
+
+            def start():
+                nonlocal reserved
+                hedged = self.hedge_percentile is not None and not ip and task_spec(task).idempotent
+                if not ip and task_spec(task).retries > 0:
+                    # Every attempt is traced on its own
+                    future = self.loop.create_task(self._offload_with_retry_async(
+                        task_added, time.monotonic(), reserved, hedged))
+                else:
+                    future = self._start_task_async(task_added, time.monotonic(), reserved)
+                    if hedged:
+                        future = self.loop.create_task(self._offload_with_hedge_async(task_added, future))
+                reserved = False
+                return [future, chosen_server.serverIP]
+
+            if key is None:
+                return tuple(start())
+            return tuple(self._start_in_flight(self.in_flight_async_tasks, key, start))
+        finally:
+            if reserved:
+                self.admission.dequeued()
+
+    def _choose_server_logged(self, logged: bool, deadline: float = None):
+        """
+        choose_server() in a pool thread, logging routing lines of the task
+        if it was sampled in the event loop thread.
+        """
+        self.task_log.begin(logged)
+        return self.choose_server(deadline)
+
+    async def _offload_with_retry_async(self, data: TaskInfo, submitted: float = None, reserved: bool = False,
+                                        hedged: bool = False):
+        """
+        Same as offload_task_async(), and retry a failed task on another
+        server like DecisionEngine._retry().
+        :param hedged: True to hedge the first attempt, see _offload_with_hedge_async().
+        :return: OffloadResponse of the last attempt.
+        """
+        self.retry_budget.record_request()
+        attempt = 0
+        while True:
+            if attempt == 0:
+                attempt_future = self._start_task_async(data, submitted, reserved)
+                if hedged:
+                    attempt_future = self._offload_with_hedge_async(data, attempt_future)
+            else:
+                attempt_future = self._start_task_async(data)
+            try:
+                response = await attempt_future
+                if response.status_code < 500:
+                    return response
+                error = None
+            except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError, DeadlineExceeded) as e:
+                error = e
+
+            if attempt < task_spec(data.task).retries:
+                await asyncio.sleep(self._retry_backoff(attempt))
+            server = await self.loop.run_in_executor(self.pool, self._retry_server, data, attempt)
+            if server is None:
+                if error is not None:
+                    raise error
+                return response
+            with self._stats_lock:
+                self.retried_tasks += 1
+            self.task_log.event("retried", "Retry task {} on {} after failing on {}", data.task, server, data.server,
+                                sampled=data.logged)
+            data = data._replace(server=server, trace=Tracer.next_attempt(data.trace, server.serverIP))
+            attempt += 1
+
+    async def _offload_with_hedge_async(self, data: TaskInfo, primary: asyncio.Task):
+        """
+        Same as DecisionEngine._hedge() in self.loop: if primary is not done
+        after self._hedge_delay(), and hedge budget allows, send the task to
+        the next best server too. The first successful attempt wins and the
+        other one is cancelled. If both fail, the last exception is raised.
+        :param primary: asyncio.Task of the first attempt, see _start_task_async().
+        :return: OffloadResponse of the winning attempt.
+        """
+        self.hedge_budget.record_request()
+        delay = self._hedge_delay(data)
+        attempts = [primary]
+        try:
+            if delay is None:
+                return await primary
+            # Unlike asyncio.wait_for(), primary isn't cancelled on timeout
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if done or self._closing or not self.hedge_budget.try_acquire():
+                return await primary
+            server = await self.loop.run_in_executor(self.pool, self._choose_server_except, data.server.serverIP)
+            if server is None or primary.done():
+                return await primary
+            hedge = self._start_task_async(data._replace(
+                server=server, trace=Tracer.next_attempt(data.trace, server.serverIP)))
+            attempts.append(hedge)
+            with self._stats_lock:
+                self.hedged_tasks += 1
+            self.task_log.event("hedged", "Hedge task {} to {} after {:.3f} s", data.task, server, delay,
+                                sampled=data.logged)
+
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if not finished.cancelled() and finished.exception() is None:
+                        if finished is hedge:
+                            with self._stats_lock:
+                                self.hedge_wins += 1
+                        return finished.result()
+            # Both attempts failed
+            return await finished
+        finally:
+            # The loser, or both if the task is cancelled
+            for attempt in attempts:
+                attempt.cancel()
+
+    async def offload_task_async(self, data: TaskInfo, submitted: float = None, reserved: bool = False):
+        """
+        Send task to remote server in self.loop.
+
+        :param submitted: time.monotonic() when the task was handed to the
+                          event loop. Tasks wait there for the loop instead of
+                          a worker thread, the wait is reported to metrics.
+        :param reserved : True if admission control counts the task as waiting
+                          already, see AdmissionController.admit().
+        :return: An OffloadResponse with status_code and text of the response.
+        """
+        if self._in_flight_slots is None:
+            return await self._send_task_async(data, submitted)
+        # Wait for a slot like tasks of DecisionEngine wait for a worker
+        if not reserved:
+            self.admission.enqueued()
+        st = time.monotonic()
+        try:
+            await self._in_flight_slots.acquire()
+        except asyncio.CancelledError:
+            self.admission.dequeued()
+            raise
+        self.admission.dequeued(time.monotonic() - st)
+        try:
+            return await self._send_task_async(data, submitted)
+        finally:
+            self._in_flight_slots.release()
+
+    async def _send_task_async(self, data: TaskInfo, submitted: float = None):
+        """
+        Body of offload_task_async(), once the task may be sent.
+        """
+        if self.metrics is not None and submitted is not None:
+            self.metrics.queue_waited(task_spec(data.task).priority, time.monotonic() - submitted)
+        trace = data.trace
+        if trace is not None:
+            trace.mark("queue")
+        if data.server == Server("temp", "127.0.0.1"):
+            self.throughput_counter.record()
+
+        server = data.server
+        self.task_log.event("call", "Call remote server {}:{} with task='{}'", server.serverIP, data.port, data.task,
+                            sampled=data.logged)
+        connect_timeout, read_timeout, headers = self._request_timeout(data)
+        headers = self._trace_headers(trace, headers)
+        # A deadline bounds the whole request, else only socket reads
+        if data.deadline is None:
+            timeout = aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+        else:
+            timeout = aiohttp.ClientTimeout(total=read_timeout, connect=connect_timeout)
+        rerouted = None
+        try:
+            breaker = self._acquire_breaker(server)
+        except CircuitOpenError:
+            # Decision functions may ping, not in the event loop
+            other = await self.loop.run_in_executor(self.pool, self._reroute_server, data)
+            if other is None:
+                raise
+            data, server = self._rerouted(data, other), other
+            breaker = self._acquire_breaker(server)
+            rerouted = self._task_started(server)
+        # See DecisionEngine._is_pooled()
+        pooled = self._is_pooled(server)
+        session = self._get_async_session(server) if pooled else self._new_async_session(1)
+        try:
+            st = time.perf_counter()
+            try:
+                async with session.get(f"http://{server.serverIP}:{data.port}/{data.task}",
+                                       timeout=timeout, headers=headers, trace_request_ctx=trace) as r:
+                    text = await r.text()
+            except asyncio.CancelledError:
+                # Such as a hedged task which lost, says nothing about the server
+                if breaker is not None:
+                    breaker.release()
+                raise
+            except Exception as e:
+                self._record_outcome(breaker)
+                if self.metrics is not None:
+                    self.metrics.task_finished(server.serverIP, interface_name(data.task), failed=True)
+                self._record_local_latency(data, time.perf_counter() - st, failed=True)
+                if isinstance(e, asyncio.TimeoutError):
+                    self._check_deadline(data, e)
+                raise
+            elapsed = time.perf_counter() - st
+            self.record_latency(server, data.task, elapsed)
+            if trace is not None:
+                # Time of response headers is set by aiohttp_trace_config()
+                trace.request_finished(st, st + elapsed)
+        finally:
+            if rerouted is not None:
+                self._task_finished(rerouted)
+            if not pooled:
+                self.loop.create_task(session.close())
+        self._record_outcome(breaker, r.status)
+        if self.metrics is not None:
+            self.metrics.task_finished(server.serverIP, interface_name(data.task), elapsed, r.status >= 500)
+        # Tasks here don't wait for a worker, latency is the request only
+        self._record_local_latency(data, elapsed)
+        response = OffloadResponse(r.status, text, dict(r.headers))
+        self._cache_result(data, response, len(text))
+        return response
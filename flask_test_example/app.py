@@ -1,10 +1,14 @@
 from flask import Flask, jsonify
 from time import sleep
+import os
 import random
 
 
 app = Flask(__name__)
 
+# Max seconds a task sleeps, lower it to run load tests faster
+TASK_MAX_SLEEP = float(os.environ.get("TASK_MAX_SLEEP", 10))
+
 
 @app.route("/hello")
 def hello_world():
@@ -13,7 +17,7 @@ def hello_world():
 
 @app.route("/offloading/<num>")
 def get_double(num):
-    sleep(random.randint(0, 10))
+    sleep(random.uniform(0, TASK_MAX_SLEEP))
     return f"{float(num)**2}"
 
 
@@ -0,0 +1,174 @@
+# This is the async front-end of application servers.
+# Flask routes park a worker thread on ret.result() while the engine offloads
+# the task in another thread, so every slow request holds two threads. Here
+# offloading routes are coroutines served by aiohttp on the event loop of an
+# AsyncDecisionEngine, awaiting their task there: a slow request holds a
+# socket, not a thread, and thousands of them can wait on one edge device.
+#
+# Only offloading routes need an async version. Every other path (server
+# lists, breakers, metrics...) is passed to the Flask app in a thread, and
+# exceptions of async routes are answered by the Flask app's error handlers,
+# so both modes answer the same way.
+
+import asyncio
+import threading
+
+from aiohttp import web
+from loguru import logger
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+# Hop-by-hop and length headers are set by aiohttp again
+_SKIPPED_HEADERS = {"content-length", "transfer-encoding", "connection"}
+
+
+class AsyncFrontend:
+    """
+    Usage:
+        app = Flask(__name__)
+        frontend = AsyncFrontend(app)
+
+        @frontend.route("/square/{num}")
+        async def square(request):
+            ret, server = await de.submit_task_async(task, port=5000)
+            return {"data": (await ret).text, "server": server}
+
+        frontend.run(de, host="0.0.0.0", port=8899)
+
+    Routes return a dict sent as JSON, or an aiohttp.web.Response.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        # (path, coroutine function) of async routes
+        self.routes = list()
+        self.runner = None
+        self.loop = None
+
+    def route(self, path: str):
+        """
+        Register an async GET route, path is in aiohttp syntax such as "/square/{num}".
+        """
+        def decorator(func):
+            self.routes.append((path, func))
+            return func
+
+        return decorator
+
+    def make_app(self):
+        """
+        :return: An aiohttp.web.Application of async routes, other paths go to the Flask app.
+        """
+        app = web.Application(middlewares=[self._error_middleware])
+        for path, func in self.routes:
+            app.router.add_get(path, self._json_handler(func))
+        app.router.add_route("*", "/{tail:.*}", self._call_flask)
+        return app
+
+    @staticmethod
+    def _json_handler(func):
+        async def handler(request):
+            response = await func(request)
+            if isinstance(response, web.StreamResponse):
+                return response
+            return web.json_response(response)
+
+        return handler
+
+    @web.middleware
+    async def _error_middleware(self, request, handler):
+        try:
+            return await handler(request)
+        except web.HTTPException:
+            raise
+        except Exception as e:
+            # Fast, the Flask handlers only build a JSON body
+            response = self._flask_error(request, e)
+            if response is None:
+                raise
+            return response
+
+    def _flask_error(self, request, error: Exception):
+        """
+        :return: The response of the Flask app's handler of error, None if it has none.
+        """
+        app = self.flask_app
+        with app.test_request_context(request.path, query_string=request.query_string):
+            try:
+                rv = app.handle_user_exception(error)
+            except Exception:
+                return None
+            return self._to_aiohttp(app.make_response(rv))
+
+    async def _call_flask(self, request):
+        body = await request.read()
+        environ = self._environ(request, body)
+        return await asyncio.get_running_loop().run_in_executor(None, self._run_flask, environ)
+
+    @staticmethod
+    def _environ(request, body: bytes):
+        builder = EnvironBuilder(path=request.path, method=request.method, query_string=request.query_string,
+                                 headers=list(request.headers.items()), data=body)
+        try:
+            environ = builder.get_environ()
+        finally:
+            builder.close()
+        environ["REMOTE_ADDR"] = request.remote or ""
+        return environ
+
+    def _run_flask(self, environ):
+        app_iter, status, headers = run_wsgi_app(self.flask_app.wsgi_app, environ, buffered=True)
+        try:
+            body = b"".join(app_iter)
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+        return web.Response(status=int(status.split(" ", 1)[0]), body=body,
+                            headers=[(key, value) for key, value in headers
+                                     if key.lower() not in _SKIPPED_HEADERS])
+
+    @staticmethod
+    def _to_aiohttp(response):
+        """
+        Convert a Flask Response.
+        """
+        return web.Response(status=response.status_code, body=response.get_data(),
+                            headers=[(key, value) for key, value in response.headers.items()
+                                     if key.lower() not in _SKIPPED_HEADERS])
+
+    def start(self, engine, host: str = "0.0.0.0", port: int = 8899):
+        """
+        Start serving on the event loop of engine, without blocking.
+        :param engine: An AsyncDecisionEngine, async routes run on its loop.
+        :return: self
+        """
+        loop = getattr(engine, "loop", None)
+        if loop is None:
+            raise TypeError("AsyncFrontend needs an AsyncDecisionEngine")
+        self.loop = loop
+        self.runner = web.AppRunner(self.make_app())
+
+        async def start():
+            await self.runner.setup()
+            await web.TCPSite(self.runner, host, port).start()
+
+        asyncio.run_coroutine_threadsafe(start(), loop).result()
+        logger.info(f"Async front-end serving on {host}:{port}")
+        return self
+
+    def stop(self):
+        if self.runner is not None:
+            asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+            self.runner = None
+
+    def run(self, engine, host: str = "0.0.0.0", port: int = 8899):
+        """
+        Serve until interrupted, like Flask.run().
+        """
+        self.start(engine, host, port)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            engine.close()
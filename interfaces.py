@@ -1,4 +1,6 @@
 import abc
+import functools
+from typing import NamedTuple
 
 from loguru import logger
 
@@ -6,6 +8,101 @@ from loguru import logger
 from config import Config, FlaskTestConfig, SmartContractConfig
 
 
+class InterfaceSpec(NamedTuple):
+    """
+    Offloading properties of an interface, declared by @offload_interface.
+    """
+
+    # Interface name, DecisionEngine keeps per-interface statistics by it
+    name: str
+    # Seconds a successful result can be served from DecisionEngine's result
+    # cache. 0 means never cached, only set it for pure interfaces.
+    ttl: float = 0
+    # True if calling this interface twice has the same effect as once.
+    # Identical in-flight tasks of idempotent interfaces share one remote call.
+    # Plain str tasks are not idempotent, as nothing is known about them.
+    idempotent: bool = False
+    # Times a failed task (connection error or 5xx) is sent again to another
+    # server. 0 means never retried, only set it for idempotent interfaces.
+    retries: int = 0
+    # Priority class of tasks in DecisionEngine's scheduler, one of
+    # Config.PRIORITY_WEIGHTS, such as "high" for cheap health calls.
+    priority: str = "normal"
+
+
+class Task(str):
+    """
+    A task str returned by an interface method, carrying the InterfaceSpec of
+    the interface which created it. DecisionEngine reads the spec; everything
+    else uses it as a plain str.
+    """
+
+    spec: InterfaceSpec
+
+    def __new__(cls, value: str, spec: InterfaceSpec):
+        instance = super().__new__(cls, value)
+        instance.spec = spec
+        return instance
+
+
+def offload_interface(name: str = None, *, ttl: float = 0, idempotent: bool = False, retries: int = 0,
+                      priority: str = "normal"):
+    """
+    Decorator for interface methods returning a task str, wrap returned str into
+    a Task with the InterfaceSpec declared here.
+
+    Example:
+        @staticmethod
+        @offload_interface()
+        def hello_world():
+            return "hello"
+
+    :param name      : Interface name, default is qualified name of the method,
+                       such as "FlaskTestInterfaces.hello_world".
+    :param ttl       : Seconds results of this interface can be cached, see InterfaceSpec.
+    :param idempotent: Whether identical in-flight tasks can be coalesced, see InterfaceSpec.
+    :param retries   : Times a failed task is retried on another server, see InterfaceSpec.
+    :param priority  : Priority class of tasks, see InterfaceSpec.
+    """
+    if priority not in Config.PRIORITY_WEIGHTS:
+        raise ValueError(f"Unknown priority class {priority}")
+
+    def decorator(func):
+        spec = InterfaceSpec(name=name or func.__qualname__, ttl=ttl, idempotent=idempotent,
+                             retries=retries, priority=priority)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return Task(func(*args, **kwargs), spec)
+
+        wrapper.spec = spec
+        return wrapper
+
+    return decorator
+
+
+def task_spec(task: str):
+    """
+    Get InterfaceSpec of a task. A plain str not created by an interface method
+    gets a default spec, named by the first segment of its path, such as
+    "offloading" for "offloading/10", so arguments in path don't create new
+    interfaces.
+    :param task: A task str, such as FlaskTestInterfaces.get_double(10).
+    :return: An InterfaceSpec instance.
+    """
+    spec = getattr(task, "spec", None)
+    if spec is not None:
+        return spec
+    return InterfaceSpec(name=task.split("?", 1)[0].split("/", 1)[0])
+
+
+def interface_name(task: str):
+    """
+    :return: Interface name str of a task, see task_spec().
+    """
+    return task_spec(task).name
+
+
 class BaseInterfaces(abc.ABC):
 
     @abc.abstractmethod
@@ -24,14 +121,18 @@ class FlaskTestInterfaces(BaseInterfaces):
             print(method)
 
     @staticmethod
+    @offload_interface(ttl=60, idempotent=True, retries=2, priority="high")
     def hello_world():
         return f"hello"
 
     @staticmethod
+    @offload_interface(ttl=60, idempotent=True, retries=2)
     def get_double(num):
         return f"offloading/{num}"
 
+    # Server list changes, but not often
     @staticmethod
+    @offload_interface(ttl=5, idempotent=True, retries=2, priority="high")
     def get_server():
         return f"getserverlists"
 
@@ -48,18 +149,25 @@ class BDInterfaces(BaseInterfaces):
             print(method)
 
     @staticmethod
+    @offload_interface(ttl=1, idempotent=True, retries=2, priority="high")
     def ping_pong():
         return BDInterfaces.url_prefix + "SCManager?action=ping"
 
     @staticmethod
+    @offload_interface(idempotent=True, retries=2)
     def list_CProcess():
         return BDInterfaces.url_prefix + "SCManager?action=listContractProcess"
 
     @staticmethod
+    @offload_interface(idempotent=True, retries=2)
     def hello_world():
         return BDInterfaces.url_prefix
 
+    # A contract may change its state, so identical calls are not coalesced,
+    # and failed calls are not retried: it may have run before failing.
+    # Contracts may run long, so they don't hold up health calls.
     @staticmethod
+    @offload_interface(idempotent=False, priority="low")
     def execute_contract(*, contractID: str, operation: str, arg: str = None, request_id: str = None):
         if arg:
             return BDInterfaces.url_prefix + f"SCManager?action=executeContract&contractID={contractID}&" \
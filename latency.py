@@ -0,0 +1,105 @@
+# This is a decaying estimator of observed service time.
+# DecisionEngine records end-to-end time of every offloaded task into one
+# estimator per server and one per (server, interface), decision functions
+# and the engine read them to route on how fast servers really answer.
+
+import functools
+import math
+import time
+
+
+@functools.lru_cache(maxsize=64)
+def normal_quantile(q: float):
+    """
+    Inverse CDF of the standard normal distribution, by bisection on math.erf
+    (statistics.NormalDist needs Python 3.8).
+    """
+    if not 0 < q < 1:
+        raise ValueError("q must be in (0, 1)")
+    lo, hi = -10.0, 10.0
+    for _ in range(64):
+        mid = (lo + hi) / 2
+        if 0.5 * (1 + math.erf(mid / math.sqrt(2))) < q:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+def percentile(values: list, q: float):
+    """
+    Nearest-rank percentile of sorted values, such as latency samples of a
+    benchmark run.
+    :param q: A float in [0, 100], such as 95 for the 95th percentile.
+    :return: The smallest value with at least q% of values not above it, None if empty.
+    """
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+class LatencyEstimator:
+    """
+    Exponentially weighted moving average and variance of latency samples.
+
+    Every sample moves the mean by alpha of its difference, so old samples
+    decay geometrically and the estimator follows servers getting slower or
+    faster. The variance uses the same weights:
+        diff = sample - mean
+        mean = mean + alpha * diff
+        var  = (1 - alpha) * (var + alpha * diff ** 2)
+    """
+
+    __slots__ = ("alpha", "mean", "var", "count", "updated")
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        # Seconds, valid when count > 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+        # time.monotonic() of the last sample
+        self.updated = None
+
+    def __repr__(self):
+        return f"LatencyEstimator(mean={self.mean:.4f}, std={self.std():.4f}, count={self.count})"
+
+    def update(self, sample: float, now: float = None):
+        """
+        Add a latency sample in seconds.
+        """
+        if self.count == 0:
+            self.mean = sample
+            self.var = 0.0
+        else:
+            diff = sample - self.mean
+            incr = self.alpha * diff
+            self.mean += incr
+            self.var = (1 - self.alpha) * (self.var + diff * incr)
+        self.count += 1
+        self.updated = time.monotonic() if now is None else now
+
+    def std(self):
+        return math.sqrt(self.var)
+
+    def quantile(self, q: float):
+        """
+        Estimate a latency quantile assuming samples are normally distributed
+        around the mean.
+        :param q: A float in (0, 1), such as 0.95 for the 95th percentile.
+        :return: Seconds, never less than the mean for q >= 0.5.
+        """
+        return self.mean + normal_quantile(q) * self.std()
+
+    def is_warm(self, min_samples: int, max_age: float, now: float = None):
+        """
+        :param min_samples: Samples needed before the estimate is trusted.
+        :param max_age    : Seconds after the last sample the estimate is stale.
+        :return: True if the estimate can be used for routing.
+        """
+        if self.count < min_samples:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now - self.updated <= max_age
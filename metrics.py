@@ -0,0 +1,264 @@
+# This is a small metrics library in Prometheus text exposition format.
+# DecisionEngine(metrics=True) keeps counters and fixed-bucket latency
+# histograms of offloaded tasks here, and application servers serve them on
+# /metrics. Recording a sample is a dict lookup, a bisect and a few additions
+# under a lock, so it stays in microseconds on the request path; gauges such
+# as pool utilisation are read by callbacks only when metrics are scraped.
+
+import bisect
+import threading
+
+from config import Config
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = ""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, names, values):
+        yield f"{name}_total{_format_labels(names, values)} {_format_value(self.value)}"
+
+
+class Histogram:
+    """
+    Counts of samples in fixed buckets, bounds are upper bounds of buckets.
+    Samples above the last bound go to the +Inf bucket.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # Count of every bucket, not cumulative, the last one is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name: str, names, values):
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(list(self.bounds) + [float("inf")], counts):
+            cumulative += bucket_count
+            le = f'le="{_format_value(float(bound))}"'
+            yield f"{name}_bucket{_format_labels(names, values, le)} {cumulative}"
+        yield f"{name}_sum{_format_labels(names, values)} {_format_value(total)}"
+        yield f"{name}_count{_format_labels(names, values)} {count}"
+
+
+class MetricFamily:
+    """
+    A metric with label names, and one child Counter or Histogram for every
+    combination of label values.
+
+    Usage:
+        family = registry.counter("offload_tasks", "Offloaded tasks", ("server",))
+        family.labels("127.0.0.1").inc()
+    """
+
+    def __init__(self, name: str, help_text: str, metric_type: str, label_names, factory):
+        self.name = name
+        self.help = help_text
+        self.type = metric_type
+        self.label_names = tuple(label_names)
+        self.factory = factory
+        self.children = dict()
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        :param values: Label values in order of self.label_names.
+        :return: The child metric of these label values, created if not exists.
+        """
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.children[values] = self.factory()
+        return child
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        for values, child in list(self.children.items()):
+            yield from child.samples(self.name, self.label_names, values)
+
+
+class CallbackFamily:
+    """
+    A gauge or counter whose values are read by a callback on every scrape,
+    for values already kept somewhere else, such as counters of the engine.
+    The callback returns a dict with <tuple of label values, value> pairs.
+    """
+
+    def __init__(self, name: str, help_text: str, metric_type: str, label_names, func):
+        self.name = name
+        self.help = help_text
+        self.type = metric_type
+        self.label_names = tuple(label_names)
+        self.func = func
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        suffix = "_total" if self.type == "counter" else ""
+        for values, value in self.func().items():
+            yield f"{self.name}{suffix}{_format_labels(self.label_names, values)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = ""):
+        """
+        :param prefix: Prefix of all metric names, such as "offloading_".
+        """
+        self.prefix = prefix
+        self.families = list()
+
+    def _add(self, family):
+        self.families.append(family)
+        return family
+
+    def counter(self, name: str, help_text: str, label_names=()):
+        return self._add(MetricFamily(self.prefix + name, help_text, "counter", label_names, Counter))
+
+    def histogram(self, name: str, help_text: str, label_names=(), buckets=Config.METRICS_LATENCY_BUCKETS):
+        bounds = tuple(sorted(buckets))
+        return self._add(MetricFamily(self.prefix + name, help_text, "histogram", label_names,
+                                      lambda: Histogram(bounds)))
+
+    def gauge(self, name: str, help_text: str, func, label_names=()):
+        """
+        :param func: A function returning a dict with <tuple of label values, value>
+                     pairs, such as {(): 3} for a gauge without labels.
+        """
+        return self._add(CallbackFamily(self.prefix + name, help_text, "gauge", label_names, func))
+
+    def counter_func(self, name: str, help_text: str, func, label_names=()):
+        """
+        Same as gauge(), for a value which only grows.
+        """
+        return self._add(CallbackFamily(self.prefix + name, help_text, "counter", label_names, func))
+
+    def render(self):
+        """
+        :return: All metrics in Prometheus text exposition format.
+        """
+        lines = list()
+        for family in self.families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+class EngineMetrics:
+    """
+    Metrics of a DecisionEngine. The engine records every finished task with
+    task_finished() and every queue wait with queue_waited(); everything else
+    is read from the engine when metrics are scraped.
+    """
+
+    def __init__(self, engine, worker_pool: bool = True):
+        """
+        :param worker_pool: False if tasks are not sent by worker threads, such
+                            as by AsyncDecisionEngine, so there are no workers
+                            to report. Queue wait is then the wait for the
+                            event loop.
+        """
+        registry = self.registry = MetricsRegistry(prefix="offloading_")
+        self.tasks = registry.counter(
+            "tasks", "Finished tasks, location is local or remote", ("server", "interface", "location"))
+        self.errors = registry.counter(
+            "errors", "Failed tasks, exceptions and 5xx responses", ("server", "interface"))
+        self.latency = registry.histogram(
+            "task_latency_seconds", "Time from sending a task to getting the whole response",
+            ("server", "interface"))
+        self.queue_wait = registry.histogram(
+            "queue_wait_seconds", "Time tasks waited for a worker thread or the event loop", ("priority",))
+
+        if worker_pool:
+            registry.gauge("pool_workers", "Worker threads of the engine", lambda: {(): engine.max_workers})
+            registry.gauge("pool_busy_workers", "Worker threads running a task", lambda: {(): engine.busy_workers})
+        registry.gauge("outstanding_tasks", "Tasks in flight on every server",
+                       lambda: {(ip,): count for ip, count in engine.outstanding_tasks().items()}, ("server",))
+        registry.gauge("local_throughput", "Requests on local device in the last throughput period",
+                       lambda: {(): engine.cal_throughput()})
+        registry.gauge("local_limit", "Max requests on local device in a throughput period",
+                       lambda: {(): engine.local_limit()})
+        registry.gauge("breaker_state", "1 for the current circuit breaker state of every server",
+                       lambda: {(ip, state): 1 for ip, state in engine.breaker_states().items()},
+                       ("server", "state"))
+        registry.counter_func("extra_requests", "Hedged and retried tasks",
+                              lambda: {("hedge",): engine.hedged_tasks, ("retry",): engine.retried_tasks},
+                              ("kind",))
+        registry.counter_func("task_events", "Per-task log events, counted whether they're logged or not",
+                              lambda: {(name,): count for name, count in engine.task_log.snapshot().items()},
+                              ("event",))
+        registry.counter_func("coalesced_tasks", "Tasks which joined an identical task in flight",
+                              lambda: {(): engine.coalesced_tasks})
+        if engine.result_cache is not None:
+            cache = engine.result_cache
+            registry.counter_func("cache_lookups", "Result cache lookups",
+                                  lambda: {("hit",): cache.hits, ("miss",): cache.misses}, ("result",))
+        if engine.admission is not None:
+            admission = engine.admission
+            registry.counter_func("admission_rejected", "Tasks rejected by admission control",
+                                  lambda: {(): admission.rejected})
+            registry.gauge("queued_tasks", "Tasks waiting for a worker thread", lambda: {(): admission.queued})
+        if engine.scheduler is not None:
+            scheduler = engine.scheduler
+            registry.gauge("priority_queue_depth", "Tasks waiting for a worker thread in every priority class",
+                           lambda: {(name,): scheduler.depth(name) for name in scheduler.classes}, ("priority",))
+
+    def task_finished(self, server_ip: str, interface: str, seconds: float = None, failed: bool = False):
+        """
+        Record a finished task.
+        :param seconds: Time of the request, None if it failed without a response.
+        :param failed : True for an exception or a 5xx response.
+        """
+        location = "local" if server_ip == "127.0.0.1" else "remote"
+        self.tasks.labels(server_ip, interface, location).inc()
+        if failed:
+            self.errors.labels(server_ip, interface).inc()
+        if seconds is not None:
+            self.latency.labels(server_ip, interface).observe(seconds)
+
+    def queue_waited(self, priority: str, seconds: float):
+        self.queue_wait.labels(priority).observe(seconds)
+
+    def render(self):
+        return self.registry.render()
@@ -0,0 +1,163 @@
+# This is a background health prober for servers in a ServerList.
+# Purpose of this module is to take ping off the critical path of requests:
+# a daemon thread pings every server on its own schedule, keeps a smoothed
+# latency on every Server, and precomputes a ranking of reachable servers.
+# ServerList.select_min_ping_server() then reads the best server from it.
+
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from config import Config
+from server import Server, ServerList
+
+
+class HealthProber:
+    """
+    Usage:
+        prober = HealthProber(server_list).start()
+        ...
+        prober.stop()
+
+    Interval between probing rounds is adaptive: when reachability of any
+    server changes, the next round comes after min_interval to confirm it
+    quickly; every stable round doubles the interval up to max_interval.
+    Every interval is scaled by a random factor in [1 - jitter, 1 + jitter],
+    so probers of different devices don't ping servers at the same time.
+    """
+
+    def __init__(
+            self,
+            server_list: ServerList,
+            *,
+            interval: float = Config.PROBE_INTERVAL,
+            min_interval: float = Config.PROBE_MIN_INTERVAL,
+            max_interval: float = Config.PROBE_MAX_INTERVAL,
+            jitter: float = Config.PROBE_JITTER,
+            alpha: float = Config.PROBE_EWMA_ALPHA,
+    ):
+        """
+        :param server_list : ServerList to probe, its select_min_ping_server()
+                             reads results of this prober.
+        :param interval    : Seconds between the first rounds.
+        :param min_interval: Seconds before next round after reachability changes.
+        :param max_interval: Max seconds between rounds when servers are stable.
+        :param jitter      : Fraction of random variation of intervals.
+        :param alpha       : Weight of the newest sample in smoothed latency.
+        """
+        self.server_list = server_list
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.alpha = alpha
+
+        # Seconds to wait before next round
+        self.cur_interval = interval
+        # Reachable servers sorted by smoothed latency, None before the first
+        # round finishes. Replaced as a whole, so readers need no lock.
+        self.ranking = None
+        self.rounds = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pool = None
+
+    def start(self):
+        """
+        Attach this prober to self.server_list and start probing in a daemon thread.
+        :return: This prober.
+        """
+        self.server_list.prober = self
+        self._pool = ThreadPoolExecutor(max_workers=max(1, self.server_list.len()))
+        self._thread = threading.Thread(target=self._run, name="HealthProber", daemon=True)
+        self._thread.start()
+        logger.info(f"Start health prober of {self.server_list.len()} servers")
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        if self.server_list.prober is self:
+            self.server_list.prober = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.probe_once()
+            except Exception as e:
+                # Never let the prober thread die silently
+                logger.exception(f"Health prober round failed: {e}")
+            wait = self.cur_interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            self._stop_event.wait(wait)
+
+    def _update(self, server: Server, available: bool):
+        """
+        Update reachability and smoothed latency of server with its newest sample.
+        :return: True if reachability of server changed.
+        """
+        changed = server.reachable is not None and server.reachable != available
+        server.reachable = available
+        if available:
+            delay = server.availability[-1].delay
+            if server.smoothed_delay is None:
+                server.smoothed_delay = delay
+            else:
+                server.smoothed_delay = self.alpha * delay + (1 - self.alpha) * server.smoothed_delay
+        return changed
+
+    def probe_once(self):
+        """
+        Ping all servers concurrently, update them and rebuild self.ranking.
+        :return: None
+        """
+        servers = list(self.server_list.serverList)
+        results = list(self._pool.map(lambda server: server.test_availability(), servers))
+        self.apply_round(servers, results)
+
+    def apply_round(self, servers: list, results: list):
+        """
+        Update servers with results of a probing round, rebuild self.ranking
+        and adapt interval. Newest samples are already in Server.availability.
+        simulator.py calls this with modelled results.
+        :param servers: Probed Server instances.
+        :param results: True or False for every server, reachable or not.
+        :return: None
+        """
+        changed = False
+        for server, available in zip(servers, results):
+            changed = self._update(server, available) or changed
+
+        self.ranking = sorted(
+            (server for server in servers if server.reachable and server.smoothed_delay is not None),
+            key=lambda server: server.smoothed_delay,
+        )
+        self.rounds += 1
+
+        if changed:
+            self.cur_interval = self.min_interval
+        else:
+            self.cur_interval = min(self.cur_interval * 2, self.max_interval)
+
+    def best_server(self, server_list: ServerList = None):
+        """
+        Get the reachable server with minimum smoothed latency, without pinging.
+        :param server_list: Only servers in this list are returned, default is
+                            self.server_list. It can be a view of self.server_list,
+                            such as ServerList.without_ip().
+        :return: A Server instance, None if there is no reachable server.
+        """
+        if server_list is None:
+            server_list = self.server_list
+        # Servers in ranking may have left the list since last round, so check
+        # membership. The first ranked server is a member almost every time.
+        # Servers with an open circuit breaker are skipped too.
+        for server in self.ranking or ():
+            if server in server_list.serverList and (server.breaker is None or server.breaker.available()):
+                return server
+        return None
@@ -0,0 +1,205 @@
+# This is recording of offloaded traffic into a compact binary trace.
+# DecisionEngine(recorder=TraceRecorder("traffic.trace")) appends one record
+# per submitted task: when it arrived, its interface and task str, the server
+# chosen, end-to-end latency and the status code. replay.py sends a recorded
+# trace again, at its original or a scaled rate, to any server set.
+#
+# Records are packed with struct into an in-memory buffer under a lock, and
+# the buffer is appended to the file when it's full or
+# Config.RECORD_FLUSH_INTERVAL seconds old, so recording a task costs a few
+# microseconds and no system call on most tasks. A background thread flushes
+# the buffer while no task is recorded, and the buffer is flushed at exit.
+#
+# File layout, little endian. The file is append-only and read sequentially,
+# so it can be memory-mapped as is (see read_records()):
+#
+#     header: MAGIC, 8 bytes
+#     frames: a kind byte, then
+#         b"S": string id (uint32), length (uint16), utf-8 bytes.
+#               Defines a string, later frames refer to it by id.
+#         b"R": arrival (float64, time.time()), interface, task and server
+#               string ids (uint32), port (uint16), latency in seconds
+#               (float32), status code (uint16, 0 if no response).
+#
+# Interfaces, server ips and repeated tasks are stored once and referred to by
+# id. Ids may be defined again later (ids restart when a recorder reopens a
+# file or its string table fills up), a definition holds until the next one.
+
+import atexit
+import mmap
+import struct
+import threading
+import time
+from typing import NamedTuple
+
+from config import Config
+from interfaces import interface_name
+
+MAGIC = b"OFFLTRC1"
+
+_STRING = struct.Struct("<cIH")
+_RECORD = struct.Struct("<cdIIIHfH")
+
+
+class TaskRecord(NamedTuple):
+    # time.time() when the task was submitted
+    arrival: float
+    interface: str
+    task: str
+    # Ip of the chosen server, None if no server was chosen
+    server: str
+    port: int
+    # Seconds from submitting to the result, 0 if no server was chosen
+    latency: float
+    # HTTP status code of the response, 0 if the task failed without one
+    status: int
+
+
+class TraceRecorder:
+    """
+    Usage:
+        recorder = TraceRecorder("traffic.trace")
+        de = DecisionEngine(..., recorder=recorder)
+        ...
+        recorder.close()
+
+    Appends to path if it's a trace already.
+    """
+
+    def __init__(self, path: str, *, buffer_size: int = Config.RECORD_BUFFER_SIZE,
+                 flush_interval: float = Config.RECORD_FLUSH_INTERVAL):
+        """
+        :param buffer_size   : Bytes buffered before appending them to the file.
+        :param flush_interval: Max seconds a record stays in the buffer.
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+            self._file.flush()
+        else:
+            with open(path, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    self._file.close()
+                    raise ValueError(f"{path} is not a trace file")
+        self._buffer = bytearray()
+        self._flushed = time.monotonic()
+        # str -> id of strings defined in this file. "" is id 0, never defined.
+        self._ids = dict()
+        self._next_id = 1
+        self.records = 0
+        self._lock = threading.Lock()
+        # Flushes records of idle periods, which no later record would flush
+        self._closed = threading.Event()
+        threading.Thread(target=self._flush_periodically, name="TraceRecorder", daemon=True).start()
+        # Application servers never close their recorder
+        atexit.register(self.close)
+
+    def _string_id(self, value: str):
+        # Called with self._lock held
+        if not value:
+            return 0
+        string_id = self._ids.get(value)
+        if string_id is None:
+            string_id = self._ids[value] = self._next_id
+            self._next_id += 1
+            data = value.encode("utf-8")[:0xFFFF]
+            self._buffer += _STRING.pack(b"S", string_id, len(data))
+            self._buffer += data
+        return string_id
+
+    def record(self, task: str, port: int, server_ip: str, arrival: float, latency: float, status: int):
+        """
+        Record a finished task, see TaskRecord for fields.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._file.closed:
+                return
+            # Mostly unique tasks, such as square/<num>, would grow the table
+            # forever. Start it over before resolving any id of this record,
+            # so its ids all come from one table; strings used again are just
+            # defined again.
+            if len(self._ids) + 3 > Config.RECORD_STRING_TABLE_SIZE:
+                self._ids.clear()
+                self._next_id = 1
+            interface_id = self._string_id(interface_name(task))
+            task_id = self._string_id(task)
+            server_id = self._string_id(server_ip)
+            self._buffer += _RECORD.pack(b"R", arrival, interface_id, task_id, server_id,
+                                         port & 0xFFFF, latency, status & 0xFFFF)
+            self.records += 1
+            if len(self._buffer) >= self.buffer_size or now - self._flushed >= self.flush_interval:
+                self._flush(now)
+
+    def _flush(self, now: float):
+        # Called with self._lock held. Only whole frames are written, so a
+        # reader never sees a string id before its definition.
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._file.flush()
+            self._buffer.clear()
+        self._flushed = now
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                if self._file.closed:
+                    return
+                now = time.monotonic()
+                if now - self._flushed >= self.flush_interval:
+                    self._flush(now)
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._flush(time.monotonic())
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if not self._file.closed:
+                self._flush(time.monotonic())
+                self._file.close()
+        atexit.unregister(self.close)
+
+
+def read_records(path: str):
+    """
+    Read a trace written by TraceRecorder, memory-mapped.
+    A frame cut short at the end, such as by a crash while writing, is ignored.
+    :return: A generator of TaskRecord, in order of finishing.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        f.seek(0, 2)
+        if f.tell() == len(MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            strings = {0: ""}
+            offset = len(MAGIC)
+            end = len(data)
+            while offset < end:
+                kind = data[offset:offset + 1]
+                if kind == b"S":
+                    if offset + _STRING.size > end:
+                        break
+                    _, string_id, length = _STRING.unpack_from(data, offset)
+                    offset += _STRING.size
+                    if offset + length > end:
+                        break
+                    strings[string_id] = data[offset:offset + length].decode("utf-8", "replace")
+                    offset += length
+                elif kind == b"R":
+                    if offset + _RECORD.size > end:
+                        break
+                    _, arrival, interface_id, task_id, server_id, port, latency, status = \
+                        _RECORD.unpack_from(data, offset)
+                    offset += _RECORD.size
+                    yield TaskRecord(arrival, strings[interface_id], strings[task_id],
+                                     strings[server_id] or None, port, latency, status)
+                else:
+                    raise ValueError(f"Bad frame {kind!r} at byte {offset} of {path}")
@@ -0,0 +1,157 @@
+# Replay of traffic recorded by recording.TraceRecorder.
+#
+# Tasks of a trace are submitted again to a DecisionEngine in front of any
+# server set, keeping the gaps between their original arrivals, divided by
+# --speed. Like benchmarks/loadgen.py it's open loop: a task is submitted on
+# schedule whether or not earlier ones finished, so latency is comparable with
+# the recorded one. Reports latency and status codes of the replay next to the
+# recorded ones.
+#
+# Run on root folder:
+#
+#     python3 replay.py traffic.trace --servers 127.0.0.1,192.168.56.2 [--port 5000]
+#         [--algorithm least_outstanding] [--speed 2] [--limit 10000] [--json results.json]
+#     python3 replay.py traffic.trace --dump
+
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+
+from loguru import logger
+
+from config import Config
+from engine import DecisionEngine
+from latency import percentile
+from recording import read_records
+from server import ServerList
+
+
+def summarize(latencies: list, statuses: list):
+    latencies = sorted(latencies)
+    return {
+        "tasks": len(statuses),
+        "statuses": {str(status): count for status, count in sorted(Counter(statuses).items())},
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def replay(records: list, de: DecisionEngine, *, port: int = None, speed: float = 1.0, timeout: float = 60):
+    """
+    Submit records to de at their recorded pace.
+    :param port   : Port of every task, default is the recorded one.
+    :param speed  : 2 replays twice as fast as recorded.
+    :param timeout: Seconds to wait for every task.
+    :return: (list of latencies of successful tasks, list of status codes,
+              0 for tasks failed without a response).
+    """
+    records = sorted(records, key=lambda record: record.arrival)
+    if not records:
+        return list(), list()
+    first = records[0].arrival
+    start = time.perf_counter()
+    # [scheduled time, Future or None, time.perf_counter() when it's done]
+    submitted = list()
+    for record in records:
+        scheduled = start + (record.arrival - first) / speed
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            ret = de.submit_task(record.task, port=port or record.port)
+        except Exception as e:
+            logger.warning(f"Failed to submit task {record.task}: {e}")
+            ret = None
+        entry = [scheduled, ret[0] if ret is not None else None, None]
+        if entry[1] is not None:
+            entry[1].add_done_callback(lambda f, entry=entry: entry.__setitem__(2, time.perf_counter()))
+        submitted.append(entry)
+
+    latencies, statuses = list(), list()
+    for entry in submitted:
+        scheduled, future = entry[0], entry[1]
+        if future is None:
+            statuses.append(0)
+            continue
+        try:
+            response = future.result(timeout=timeout)
+        except Exception:
+            statuses.append(0)
+            continue
+        statuses.append(response.status_code)
+        if response.status_code < 500:
+            # The callback may still be running right after result() returns
+            done = entry[2] if entry[2] is not None else time.perf_counter()
+            latencies.append(done - scheduled)
+    return latencies, statuses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay traffic recorded by recording.TraceRecorder")
+    parser.add_argument("trace", help="Trace file")
+    parser.add_argument("--dump", action="store_true", help="Print records as JSON lines and exit")
+    parser.add_argument("--servers", help="Comma separated server ips, 127.0.0.1 is local device")
+    parser.add_argument("--port", type=int, help="Port of every task, default is the recorded one")
+    parser.add_argument("--algorithm", default="default", help="A key of Config.decision_algorithm")
+    parser.add_argument("--speed", type=float, default=1.0, help="2 replays twice as fast as recorded")
+    parser.add_argument("--limit", type=int, help="Replay the first N tasks only")
+    parser.add_argument("--workers", type=int, default=20, help="Worker threads of the engine")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args(argv)
+
+    records = list()
+    for record in read_records(args.trace):
+        if args.limit is not None and len(records) >= args.limit:
+            break
+        records.append(record)
+
+    if args.dump:
+        for record in records:
+            print(json.dumps(record._asdict()))
+        return 0
+    if not args.servers:
+        parser.error("--servers is required unless --dump")
+    if args.algorithm not in Config.decision_algorithm:
+        parser.error(f"--algorithm must be one of {', '.join(Config.decision_algorithm)}")
+
+    # Logging on every decision would slow submitting down
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    server_list = ServerList.specify_server_list({
+        ("LocalDevice" if ip == "127.0.0.1" else f"server{i}"): ip
+        for i, ip in enumerate(args.servers.split(","))
+    })
+    de = DecisionEngine(decision_algorithm=args.algorithm, server_list=server_list, max_workers=args.workers)
+    try:
+        st = time.perf_counter()
+        latencies, statuses = replay(records, de, port=args.port, speed=args.speed)
+        elapsed = time.perf_counter() - st
+    finally:
+        de.close()
+
+    recorded = summarize([record.latency for record in records if 0 < record.status < 500],
+                         [record.status for record in records])
+    replayed = summarize(latencies, statuses)
+    span = records[-1].arrival - records[0].arrival if records else 0.0
+    print(f"{'':<10} {'tasks':>8} {'p50 (s)':>9} {'p95 (s)':>9} {'p99 (s)':>9}  statuses")
+    for name, summary in (("recorded", recorded), ("replayed", replayed)):
+        def seconds(value):
+            return f"{value:9.3f}" if value is not None else f"{'-':>9}"
+
+        print(f"{name:<10} {summary['tasks']:>8} {seconds(summary['p50'])} {seconds(summary['p95'])} "
+              f"{seconds(summary['p99'])}  {summary['statuses']}")
+    print(f"Recorded span {span:.1f} s, replayed in {elapsed:.1f} s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"trace": args.trace, "servers": args.servers, "algorithm": args.algorithm,
+                       "speed": args.speed, "recorded": recorded, "replayed": replayed}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+# This is a priority scheduler in front of DecisionEngine's thread pool.
+# ThreadPoolExecutor runs work in FIFO order, so a cheap health call waits
+# behind every slow call queued before it. The scheduler keeps one queue per
+# priority class (declared by interfaces, see interfaces.InterfaceSpec), and
+# every worker picks the next task by priority when it becomes free.
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import Config
+
+
+class ClassStats:
+    __slots__ = ("submitted", "started", "wait_sum", "wait_max")
+
+    def __init__(self):
+        self.submitted = 0
+        self.started = 0
+        # Seconds started tasks waited in queue
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+
+
+class PriorityScheduler:
+    """
+    Usage:
+        scheduler = PriorityScheduler(pool, mode="weighted")
+        future = scheduler.submit("high", func, *args)
+
+    For every task, a runner is submitted to the pool. Runners don't carry a
+    task; a runner started by a free worker pops the next task from the
+    priority queues and runs it. So the pool stays FIFO, while tasks start in
+    priority order.
+
+    Modes:
+        strict  : Always the highest non-empty class. Low classes may starve.
+        weighted: Smooth weighted round robin between non-empty classes, every
+                  class gets a share of workers by its weight.
+    """
+
+    MODES = ("strict", "weighted")
+
+    def __init__(self, executor: ThreadPoolExecutor, *, mode: str = Config.SCHEDULER_MODE,
+                 weights: dict = None):
+        """
+        :param executor: Thread pool running tasks.
+        :param mode    : "strict" or "weighted".
+        :param weights : A dict with <class name, weight> pairs, ordered from
+                         the highest class to the lowest, default is Config.PRIORITY_WEIGHTS.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}")
+        self.executor = executor
+        self.mode = mode
+        self.weights = dict(weights or Config.PRIORITY_WEIGHTS)
+        # Class names from the highest to the lowest
+        self.classes = list(self.weights)
+
+        # Queued tasks of every class, items are (Future, func, args, enqueue time)
+        self._queues = {name: deque() for name in self.classes}
+        # Current credits of every class in weighted mode
+        self._credits = {name: 0 for name in self.classes}
+        self._stats = {name: ClassStats() for name in self.classes}
+        self._lock = threading.Lock()
+
+    def submit(self, priority: str, func, *args):
+        """
+        Queue func(*args) in class priority.
+        :return: A concurrent.futures.Future of the result.
+        :raise ValueError: If priority is not a class of this scheduler.
+        """
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority class {priority}")
+        future = Future()
+        with self._lock:
+            self._queues[priority].append((future, func, args, time.monotonic()))
+            self._stats[priority].submitted += 1
+        self.executor.submit(self._run_next)
+        return future
+
+    def _pop(self):
+        """
+        Must be called with self._lock held.
+        :return: (class name, queued item) of the next task, None if all queues are empty.
+        """
+        ready = [name for name in self.classes if self._queues[name]]
+        if not ready:
+            return None
+        if self.mode == "strict":
+            name = ready[0]
+        else:
+            total = 0
+            for ready_name in ready:
+                self._credits[ready_name] += self.weights[ready_name]
+                total += self.weights[ready_name]
+            # Ties go to the higher class, it comes first in ready
+            name = max(ready, key=lambda ready_name: self._credits[ready_name])
+            self._credits[name] -= total
+        return name, self._queues[name].popleft()
+
+    def _run_next(self):
+        with self._lock:
+            popped = self._pop()
+            if popped is None:
+                return
+            name, (future, func, args, enqueued) = popped
+            stats = self._stats[name]
+            wait = time.monotonic() - enqueued
+            stats.started += 1
+            stats.wait_sum += wait
+            stats.wait_max = max(stats.wait_max, wait)
+
+        # Cancelled while queued
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def depth(self, priority: str):
+        """
+        :return: Tasks of class priority waiting for a worker.
+        """
+        return len(self._queues[priority])
+
+    def stats(self):
+        """
+        :return: A dict with <class name, dict of queue depth, submitted and
+                 started tasks, mean and max queue wait in seconds> pairs.
+        """
+        with self._lock:
+            return {
+                name: {
+                    "depth": len(self._queues[name]),
+                    "submitted": stats.submitted,
+                    "started": stats.started,
+                    "mean_wait": stats.wait_sum / stats.started if stats.started else 0.0,
+                    "max_wait": stats.wait_max,
+                }
+                for name, stats in self._stats.items()
+            }
@@ -2,7 +2,9 @@
 
 from typing import NamedTuple
 from concurrent.futures import ThreadPoolExecutor
+from array import array
 import random
+import copy
 import json
 import time
 
@@ -11,11 +13,12 @@ from ping3 import ping
 import requests
 
 import config
+from latency import LatencyEstimator
 
 
 class ServerInfo(NamedTuple):
     """
-    This is a NamedTuple in server.availability list
+    This is a NamedTuple of a sample in server.availability
     """
     available: bool
     # A delay between host and remove server tested by ping command
@@ -25,19 +28,150 @@ class ServerInfo(NamedTuple):
     timestamp: float
 
 
-class Server:
+class AvailabilityHistory:
+    """
+    Fixed-capacity ring of availability samples of a server.
+
+    Samples are kept in three arrays (available, delay, timestamp) instead of
+    a list of ServerInfo objects, and the oldest sample is overwritten when the
+    ring is full, so memory per server is flat whatever the uptime.
+
+    Running sums of delays and losses are updated on every append, so latest(),
+    mean_delay() and loss_rate() are O(1).
+
+    Indexing and iteration return ServerInfo from oldest to newest, like the
+    list it replaces, so history[-1] is the newest sample.
+    """
+
+    __slots__ = ("capacity", "_available", "_delay", "_timestamp",
+                 "_next", "_size", "_delay_sum", "_available_cnt")
+
+    def __init__(self, capacity: int = config.Config.AVAILABILITY_HISTORY_SIZE):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._available = array("b", bytes(capacity))
+        self._delay = array("d", bytes(8 * capacity))
+        self._timestamp = array("d", bytes(8 * capacity))
+        # Slot written by next append()
+        self._next = 0
+        self._size = 0
+        # Sum of delays of available samples, and count of available samples
+        self._delay_sum = 0.0
+        self._available_cnt = 0
+
+    def append(self, info: ServerInfo):
+        """
+        Add a sample, overwrite the oldest one if full.
+        :param info: A ServerInfo(available, delay, timestamp).
+        :return: None
+        """
+        i = self._next
+        if self._size == self.capacity and self._available[i]:
+            # Evict the oldest sample from running sums
+            self._delay_sum -= self._delay[i]
+            self._available_cnt -= 1
+        available = bool(info.available)
+        delay = float(info.delay) if available else 0.0
+        self._available[i] = available
+        self._delay[i] = delay
+        self._timestamp[i] = info.timestamp
+        if available:
+            self._delay_sum += delay
+            self._available_cnt += 1
+        self._next = (i + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("availability history index out of range")
+        i = (self._next - self._size + index) % self.capacity
+        return ServerInfo(bool(self._available[i]), self._delay[i], self._timestamp[i])
+
+    def __iter__(self):
+        for index in range(self._size):
+            yield self[index]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def latest(self):
+        """
+        :return: The newest ServerInfo, None if there is no sample.
+        """
+        return self[-1] if self._size else None
 
-    def __init__(self, name, ip):
+    def mean_delay(self):
+        """
+        :return: Mean delay in ms of available samples in the ring,
+                 None if no sample is available.
+        """
+        if self._available_cnt == 0:
+            return None
+        return self._delay_sum / self._available_cnt
+
+    def loss_rate(self):
+        """
+        :return: Fraction of unavailable samples in the ring, None if there is no sample.
+        """
+        if self._size == 0:
+            return None
+        return 1 - self._available_cnt / self._size
+
+
+class Server:
+    # Servers are created for every comparison (such as Server("temp", ip)),
+    # __slots__ keeps them small and availability history is allocated on
+    # first access only.
+    __slots__ = ("serverName", "serverIP", "pool_size", "reachable",
+                 "smoothed_delay", "outstanding", "observed_latency", "breaker",
+                 "_availability")
+
+    def __init__(self, name, ip, pool_size: int = None):
         self.serverName: str = name
         self.serverIP: str = ip
+        # Max keep-alive connections DecisionEngine holds to this server.
+        # If None, DecisionEngine uses its max_workers.
+        self.pool_size: int = pool_size
+
+        # Updated by prober.HealthProber: reachability in the last probing round
+        # and smoothed ping delay in ms. None before probed.
+        self.reachable: bool = None
+        self.smoothed_delay: float = None
+
+        # Tasks DecisionEngine has submitted to this server and not finished yet.
+        # Updated by DecisionEngine under its lock, read by decision functions.
+        self.outstanding: int = 0
 
-        # self.availability use a list to represents the history
-        # of this server can connect or not.
-        # items are NamedTuple: ServerInfo
-        self.availability: list = list()
+        # Observed end-to-end service time of tasks offloaded to this server,
+        # recorded by DecisionEngine. None before the first task finishes.
+        self.observed_latency: LatencyEstimator = None
+
+        # A breaker.CircuitBreaker fed by DecisionEngine with outcomes of tasks
+        # offloaded to this server. None if the engine doesn't use breakers.
+        self.breaker = None
+
+        # History of this server can connect or not, see AvailabilityHistory.
+        self._availability = None
 
         # logger.info(f"Create {self.__repr__()}")
 
+    @property
+    def availability(self):
+        """
+        Bounded history of availability samples, items are NamedTuple: ServerInfo.
+        :return: An AvailabilityHistory instance.
+        """
+        if self._availability is None:
+            self._availability = AvailabilityHistory()
+        return self._availability
+
     def __repr__(self):
         return f"Server({self.serverName}, {self.serverIP})"
 
@@ -55,7 +189,7 @@ class Server:
     def test_availability(self):
         """
         Using ping command to test availability of this server,
-        then add results to self.availability: list.
+        then add results to self.availability.
 
         :return: Bool Type: True if test success, else False.
         """
@@ -79,6 +213,12 @@ class Server:
 
 
 class ServerList:
+    # A prober.HealthProber attached by HealthProber.start(). If not None,
+    # select_min_ping_server() reads its results instead of pinging.
+    prober = None
+    # Time source of decision functions, such as circuit breakers and
+    # observed latency. simulator.py replaces it with virtual time.
+    clock = time.monotonic
 
     def __init__(self, cfg: str = "default"):
         """
@@ -89,6 +229,8 @@ class ServerList:
         """
         # self.serverList is a list contains Server instances.
         self.serverList = list()
+        # Functions called with a list of Server when servers leave self.serverList
+        self.removal_listeners = list()
         # read_cnt = self.read_server_list_from_config()
         self.read_server_list_from_config(cfg)
         logger.info(f"Successfully create a {self.__class__.__name__} instance using [config]")
@@ -116,7 +258,8 @@ class ServerList:
         """
         logger.info(f"Update current server list using given list {lst}")
         # Remove old unavailable servers
-        self.serverList = [server for server in self.serverList if server.test_availability()]
+        removed = [server for server in self.serverList if not server.test_availability()]
+        self.serverList = [server for server in self.serverList if server not in removed]
         for item in lst:
             server = Server(server_name, item)
             # if this server is available, add it to self.serverList
@@ -124,6 +267,8 @@ class ServerList:
                 self.serverList.append(server)
         # Remove repeated items in self.serverList
         self.serverList = list(set(self.serverList))
+        # A server removed as unavailable may come back with the new list
+        self._notify_removed([server for server in removed if server not in self.serverList])
         logger.info(f"Successfully update server list, current count is {self.len()}")
 
     def len(self):
@@ -142,6 +287,25 @@ class ServerList:
         """
         return Server("temp", ip) in self.serverList
 
+    def get_server(self, ip: str):
+        """
+        :param ip: An ip address in self.serverList.
+        :return: The Server instance in self.serverList with given ip, None if not found.
+        """
+        for server in self.serverList:
+            if server.serverIP == ip:
+                return server
+        return None
+
+    def get_pool_size(self, ip: str):
+        """
+        :param ip: An ip address in self.serverList.
+        :return: Server.pool_size of the server with given ip, None if not found
+                 or not configured.
+        """
+        server = self.get_server(ip)
+        return server.pool_size if server is not None else None
+
     def add_ip(self, ip):
         """
         Add single ip by construct a list, and use self.update_server_list_using_list()
@@ -159,6 +323,67 @@ class ServerList:
         """
         del_server = Server("deleted", ip)
         self.serverList.remove(del_server)
+        self._notify_removed([del_server])
+
+    def add_removal_listener(self, func):
+        """
+        Register a function called when servers leave self.serverList,
+        such as DecisionEngine evicting its connections to these servers.
+        :param func: A function accepting a list of Server instances.
+        :return: None
+        """
+        self.removal_listeners.append(func)
+
+    def remove_removal_listener(self, func):
+        """
+        Unregister a function of add_removal_listener(), such as when its
+        DecisionEngine closes. Does nothing if func is not registered.
+        :param func: A function passed to add_removal_listener().
+        :return: None
+        """
+        if func in self.removal_listeners:
+            self.removal_listeners.remove(func)
+
+    def _notify_removed(self, servers: list):
+        if not servers:
+            return
+        for func in self.removal_listeners:
+            func(servers)
+
+    def routable_servers(self, now: float = None):
+        """
+        Servers decision functions choose from: servers whose circuit breaker
+        is open are skipped, until the breaker lets probe tasks through.
+        :return: A list of Server instances in self.serverList.
+        """
+        if now is None:
+            now = self.clock()
+        return [server for server in self.serverList
+                if server.breaker is None or server.breaker.available(now)]
+
+    def without_ip(self, ip: str):
+        """
+        Return a shallow copy of this instance without the server of given ip.
+
+        Server instances are shared with this instance, so anything recorded
+        on them (such as availability) is kept. Removal listeners are not
+        copied, the returned instance is a view for choosing servers only.
+        :param ip: An ip address to be excluded.
+        :return: A new instance of this class.
+        """
+        return self.view(lambda server: server.serverIP != ip)
+
+    def view(self, predicate):
+        """
+        Return a shallow copy of this instance with only servers satisfying
+        predicate, shared with this instance like without_ip().
+        :param predicate: A function accepting a Server, returns True to keep it.
+        :return: A new instance of this class.
+        """
+        instance = copy.copy(self)
+        instance.serverList = [server for server in self.serverList if predicate(server)]
+        instance.removal_listeners = list()
+        return instance
 
     def print_all_servers(self):
         """
@@ -184,10 +409,20 @@ class ServerList:
         """
         If choose_server algorithm is "minimum ping delay",
         use this function to select server.
+
+        If a HealthProber is attached to this instance, read the best server it
+        precomputed in background, no ping on the critical path of requests.
+        Else ping all servers here.
         :return: If found, return a Server instance, else None.
         """
+        if self.prober is not None and self.prober.ranking is not None:
+            return self.prober.best_server(self)
+
+        servers = self.routable_servers()
+        if not servers:
+            return None
         # a thread pool to submit tasks for ping command
-        pool = ThreadPoolExecutor(max_workers=len(self.serverList))
+        pool = ThreadPoolExecutor(max_workers=len(servers))
         # store all futures returned by pool.submit() method
         futures = []
 
@@ -197,26 +432,99 @@ class ServerList:
         # just return None, let calling function deal with None.
         min_ping_server: Server = None
 
-        for server in self.serverList:
+        for server in servers:
             future = pool.submit(server.test_availability)
             futures.append(future)
         # wait all thread get the result
         [future.result() for future in futures]
-
-        for server in self.serverList:
-            this_delay = server.availability[0].delay
-            if isinstance(this_delay, float):
-                if this_delay < min_ping:
-                    min_ping = this_delay
-                    min_ping_server = server
+        pool.shutdown(wait=False)
+
+        for server in servers:
+            # The newest sample is the last one, delay of an unreachable
+            # server is 0.0, so check availability and not the delay
+            latest = server.availability[-1]
+            if latest.available and latest.delay < min_ping:
+                min_ping = latest.delay
+                min_ping_server = server
         return min_ping_server
 
     def select_random_server(self):
         """
         Using random.choice() method to select and return a random Server.
-        :return: A random Server instance in self.ServerList.
+        :return: A random Server instance in self.ServerList, None if no
+                 server is routable.
+        """
+        servers = self.routable_servers()
+        return random.choice(servers) if servers else None
+
+    def select_least_outstanding_server(self):
+        """
+        Select the server with fewest tasks in flight (Server.outstanding),
+        random one among ties, so slow servers get less new work.
+        :return: A Server instance, None if no server is routable.
+        """
+        servers = self.routable_servers()
+        if not servers:
+            return None
+        min_outstanding = min(server.outstanding for server in servers)
+        return random.choice([server for server in servers
+                              if server.outstanding == min_outstanding])
+
+    def select_power_of_two_choices_server(self):
+        """
+        Pick two random servers and select the one with fewer tasks in flight.
+        Close to least outstanding in tail latency, but O(1) and doesn't send
+        a burst of tasks to the same least loaded server.
+        :return: A Server instance, None if no server is routable.
+        """
+        servers = self.routable_servers()
+        if len(servers) < 2:
+            return servers[0] if servers else None
+        first, second = random.sample(servers, 2)
+        return first if first.outstanding <= second.outstanding else second
+
+    def _expected_latency(self, server: Server, now: float = None):
+        """
+        Expected service time of server in seconds, used by
+        select_min_observed_latency_server().
+
+        If the server has enough recent observed samples, use their mean.
+        Otherwise it's cold, fall back to its ping delay from the latest probe
+        (never ping here). A cold server never probed gets 0, so it is tried.
+        :return: A float, or None if the server is known unreachable.
+        """
+        if now is None:
+            now = self.clock()
+        cfg = config.Config
+        observed = server.observed_latency
+        if observed is not None and observed.is_warm(cfg.OBSERVED_LATENCY_MIN_SAMPLES,
+                                                     cfg.OBSERVED_LATENCY_MAX_AGE, now):
+            return observed.mean
+        if server.reachable is False:
+            return None
+        if server.smoothed_delay is not None:
+            return server.smoothed_delay / 1000
+        latest = server.availability.latest()
+        if latest is not None:
+            return latest.delay / 1000 if latest.available else None
+        return 0.0
+
+    def select_min_observed_latency_server(self):
+        """
+        Select the server with minimum observed service time of offloaded
+        tasks, cold servers are ranked by ping delay instead.
+        See _expected_latency().
+        :return: If found, return a Server instance, else None.
         """
-        return random.choice(self.serverList)
+        now = self.clock()
+        min_latency = None
+        min_latency_server = None
+        for server in self.routable_servers(now):
+            latency = self._expected_latency(server, now)
+            if latency is not None and (min_latency is None or latency < min_latency):
+                min_latency = latency
+                min_latency_server = server
+        return min_latency_server
 
     def map_decision_func(self):
         """
@@ -231,6 +539,9 @@ class ServerList:
         d = {
             "select_random_server": self.select_random_server,
             "select_min_ping_server": self.select_min_ping_server,
+            "select_least_outstanding_server": self.select_least_outstanding_server,
+            "select_power_of_two_choices_server": self.select_power_of_two_choices_server,
+            "select_min_observed_latency_server": self.select_min_observed_latency_server,
         }
         return d
 
@@ -262,6 +573,7 @@ class ServerList:
         """
         instance = cls.__new__(cls)
         instance.serverList = list()
+        instance.removal_listeners = list()
         for serverName, serverIP in server_list.items():
             instance.serverList.append(Server(serverName, serverIP))
         # Remove duplicated serverIP
@@ -310,6 +622,7 @@ class FlaskTestServerList(ServerList):
 
         instance = cls.__new__(cls)
         instance.serverList = list()
+        instance.removal_listeners = list()
         instance.update_server_list_using_list(lst=response_servers,
                                                server_name="AddedFromRemote")
         # Remove duplicated serverIP
@@ -0,0 +1,403 @@
+# This is a discrete-event simulator of task offloading.
+# It drives the real DecisionEngine.choose_server() and ServerList decision
+# functions against modelled servers in virtual time, so decision algorithms
+# can be compared on hours of traffic in seconds, without remote servers.
+#
+# Servers are modelled with a service time distribution, a number of tasks
+# they run at a time (more wait in a FIFO queue), a network round trip, a
+# failure rate and outages. The engine is fed outcomes of tasks like
+# DecisionEngine.offload_task() does: tasks in flight, observed latency,
+# circuit breakers, local throughput and local capacity. A HealthProber
+# ranks servers with modelled pings for minimum_ping_delay.
+#
+# Workload (arrivals, service times, network delays, failures) is drawn from
+# its own random streams, so every decision algorithm sees the same tasks for
+# the same seed. Every service time is drawn by inverse CDF from one uniform
+# number of the task, so a task is equally "hard" on whatever server runs it.
+#
+# Run on root folder:
+#
+#     python3 simulator.py [--rate 20] [--duration 3600] [--seed 1] [--json results.json]
+
+import argparse
+import heapq
+import itertools
+import json
+import math
+import random
+import sys
+import time
+from collections import Counter, deque
+
+from loguru import logger
+
+from breaker import CircuitOpenError
+from config import Config
+from engine import DecisionEngine
+from latency import percentile
+from prober import HealthProber
+from server import ServerInfo, ServerList
+
+
+def constant(seconds: float):
+    """
+    Service time or network delay distributions, functions mapping a uniform
+    number u in [0, 1) to seconds.
+    """
+    return lambda u: seconds
+
+
+def uniform(low: float, high: float):
+    return lambda u: low + (high - low) * u
+
+
+def exponential(mean: float):
+    return lambda u: -mean * math.log(1 - u)
+
+
+def pareto(minimum: float, alpha: float):
+    """
+    Heavy tailed, most tasks take about minimum, a few take much longer.
+    Mean is minimum * alpha / (alpha - 1) for alpha > 1.
+    """
+    return lambda u: minimum / (1 - u) ** (1 / alpha)
+
+
+class SimServer:
+    """
+    A modelled server.
+
+    Usage:
+        SimServer("192.168.56.2", service=exponential(0.1), capacity=8,
+                  network_delay=constant(0.002), failure_rate=0.01, outages=[(600, 900)])
+    """
+
+    def __init__(self, ip: str, *, name: str = None, service=exponential(0.1), capacity: int = 4,
+                 network_delay=constant(0.0), failure_rate: float = 0.0, outages=()):
+        """
+        :param ip           : Server ip, 127.0.0.1 is local device.
+        :param service      : Service time distribution of a task, see exponential().
+        :param capacity     : Tasks run at a time, more wait in a FIFO queue.
+        :param network_delay: Round trip time distribution of a request.
+        :param failure_rate : Fraction of requests failing after a round trip,
+                              like a 5xx response.
+        :param outages      : (start, end) virtual seconds the server is down.
+                              Requests sent then fail after a round trip, like a
+                              refused connection; tasks already queued finish.
+        """
+        self.ip = ip
+        self.name = name or ("LocalDevice" if ip == "127.0.0.1" else ip)
+        self.service = service
+        self.capacity = capacity
+        self.network_delay = network_delay
+        self.failure_rate = failure_rate
+        self.outages = list(outages)
+        self.reset()
+
+    def __repr__(self):
+        return f"SimServer({self.name}, {self.ip})"
+
+    def reset(self):
+        # Tasks running, and tasks waiting for a slot
+        self.busy = 0
+        self.queue = deque()
+
+    def is_up(self, now: float):
+        return not any(start <= now < end for start, end in self.outages)
+
+
+class SimTask:
+    __slots__ = ("index", "task", "arrival", "u_service", "u_network", "u_failure",
+                 "server", "tracked", "breaker", "finished", "ok", "error")
+
+    def __init__(self, index: int, arrival: float, rng: random.Random):
+        self.index = index
+        self.task = f"offloading/{index}"
+        self.arrival = arrival
+        # Always drawn in this order, whatever server runs the task
+        self.u_service = rng.random()
+        self.u_network = rng.random()
+        self.u_failure = rng.random()
+        self.server = None
+        self.tracked = None
+        self.breaker = None
+        self.finished = None
+        self.ok = False
+        # Why the task failed: "no_server", "circuit_open", "down" or "failed"
+        self.error = None
+
+
+class SimResult:
+    """
+    Outcome of a simulation run.
+    """
+
+    def __init__(self, algorithm: str, tasks: list, duration: float, wall_time: float):
+        self.algorithm = algorithm
+        self.tasks = tasks
+        # Virtual seconds of arrivals, and real seconds the run took
+        self.duration = duration
+        self.wall_time = wall_time
+
+    def percentile(self, q: float):
+        """
+        Nearest-rank percentile of latency of successful tasks, None if none succeeded.
+        """
+        return percentile(self._latencies(), q)
+
+    def _latencies(self):
+        return sorted(task.finished - task.arrival for task in self.tasks if task.ok)
+
+    def summary(self):
+        ok = [task for task in self.tasks if task.ok]
+        servers = Counter(task.server.serverIP for task in ok)
+        local = servers.get("127.0.0.1", 0)
+        latencies = self._latencies()
+        return {
+            "algorithm": self.algorithm,
+            "tasks": len(self.tasks),
+            "ok": len(ok),
+            "errors": dict(Counter(task.error for task in self.tasks if not task.ok)),
+            "throughput": len(ok) / self.duration if self.duration else 0.0,
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "local": local,
+            "offloaded": len(ok) - local,
+            "servers": dict(servers),
+            "wall_time": self.wall_time,
+        }
+
+
+class Simulation:
+    """
+    Usage:
+        sim = Simulation([SimServer("127.0.0.1", ...), SimServer("192.168.56.2", ...)],
+                         consider_throughput=True)
+        for algorithm in Config.decision_algorithm:
+            print(sim.run(algorithm, rate=20, duration=3600, seed=1).summary())
+
+    Every run builds a new ServerList and DecisionEngine on virtual time, with
+    engine_kwargs such as circuit_breaker=True.
+    """
+
+    def __init__(self, servers: list, *, consider_throughput: bool = False, **engine_kwargs):
+        self.servers = servers
+        self.consider_throughput = consider_throughput
+        self.engine_kwargs = engine_kwargs
+        # Virtual time in seconds
+        self.now = 0.0
+        self._events = list()
+        self._seq = itertools.count()
+
+    def clock(self):
+        return self.now
+
+    def _schedule(self, delay: float, func, *args):
+        heapq.heappush(self._events, (self.now + delay, next(self._seq), func, args))
+
+    def run(self, algorithm: str, *, rate: float, duration: float, seed: int = 0,
+            poisson: bool = True, timeout: float = None):
+        """
+        Simulate tasks arriving at rate per second for duration virtual seconds.
+        :param algorithm: A key of Config.decision_algorithm.
+        :param seed     : Seed of the workload, and of the random module used by
+                          decision functions.
+        :param poisson  : Poisson arrivals if True, else evenly spaced.
+        :param timeout  : Deadline of every task in seconds, see DecisionEngine.choose_server().
+        :return: A SimResult; tasks still running at the end are finished first.
+        """
+        # Decisions are logged at info level, far slower than simulating them
+        for name in ("engine", "server", "prober"):
+            logger.disable(name)
+        try:
+            return self._run(algorithm, rate, duration, seed, poisson, timeout)
+        finally:
+            for name in ("engine", "server", "prober"):
+                logger.enable(name)
+
+    def _run(self, algorithm: str, rate: float, duration: float, seed: int, poisson: bool, timeout: float):
+        started = time.perf_counter()
+        self.now = 0.0
+        self._events = list()
+        self._seq = itertools.count()
+        for model in self.servers:
+            model.reset()
+        self._models = {model.ip: model for model in self.servers}
+        workload = random.Random(seed)
+        self._probe_rng = random.Random(seed + 1)
+        random.seed(seed)
+
+        server_list = ServerList.specify_server_list({model.name: model.ip for model in self.servers})
+        # Same order in every process, set order depends on hash randomization
+        server_list.serverList.sort(key=lambda server: server.serverIP)
+        server_list.clock = self.clock
+        self._prober = HealthProber(server_list)
+        server_list.prober = self._prober
+        self.engine = DecisionEngine(decision_algorithm=algorithm, server_list=server_list, max_workers=1,
+                                     consider_throughput=self.consider_throughput, clock=self.clock,
+                                     **self.engine_kwargs)
+        tasks = list()
+
+        def arrive():
+            task = SimTask(len(tasks), self.now, workload)
+            tasks.append(task)
+            self._start(task, timeout)
+            gap = workload.expovariate(rate) if poisson else 1 / rate
+            if self.now + gap < duration:
+                self._schedule(gap, arrive)
+
+        try:
+            self._probe()
+            self._schedule(0.0, arrive)
+            while self._events:
+                when, _, func, args = heapq.heappop(self._events)
+                # Probing goes on forever, stop when only probes are left
+                if func == self._probe and not self._events:
+                    break
+                self.now = when
+                func(*args)
+        finally:
+            self.engine.close()
+        return SimResult(algorithm, tasks, duration, time.perf_counter() - started)
+
+    def _probe(self):
+        """
+        A probing round of the HealthProber with modelled pings.
+        """
+        prober = self._prober
+        servers = list(prober.server_list.serverList)
+        results = list()
+        for server in servers:
+            model = self._models[server.serverIP]
+            up = model.is_up(self.now)
+            delay = model.network_delay(self._probe_rng.random()) * 1000
+            server.availability.append(ServerInfo(up, delay if up else 0, self.now))
+            results.append(up)
+        prober.apply_round(servers, results)
+        wait = prober.cur_interval * self._probe_rng.uniform(1 - prober.jitter, 1 + prober.jitter)
+        self._schedule(wait, self._probe)
+
+    def _start(self, task: SimTask, timeout: float):
+        engine = self.engine
+        deadline = self.now + timeout if timeout is not None else None
+        server = engine.choose_server(deadline)
+        if server is None:
+            self._finish(task, error="no_server")
+            return
+        task.server = server
+        model = self._models[server.serverIP]
+        if server.serverIP == "127.0.0.1":
+            engine.throughput_counter.record()
+        try:
+            task.breaker = engine._acquire_breaker(server)
+        except CircuitOpenError:
+            self._finish(task, error="circuit_open")
+            return
+        task.tracked = engine._task_started(server)
+
+        round_trip = model.network_delay(task.u_network)
+        if not model.is_up(self.now):
+            self._schedule(round_trip, self._finish, task, "down")
+        elif task.u_failure < model.failure_rate:
+            self._schedule(round_trip, self._finish, task, "failed")
+        else:
+            self._schedule(round_trip / 2, self._receive, task, model, round_trip)
+
+    def _receive(self, task: SimTask, model: SimServer, round_trip: float):
+        if model.busy < model.capacity:
+            self._serve(task, model, round_trip)
+        else:
+            model.queue.append((task, round_trip))
+
+    def _serve(self, task: SimTask, model: SimServer, round_trip: float):
+        model.busy += 1
+        self._schedule(model.service(task.u_service), self._served, task, model, round_trip)
+
+    def _served(self, task: SimTask, model: SimServer, round_trip: float):
+        model.busy -= 1
+        if model.queue:
+            queued, queued_round_trip = model.queue.popleft()
+            self._serve(queued, model, queued_round_trip)
+        self._schedule(round_trip / 2, self._finish, task)
+
+    def _finish(self, task: SimTask, error: str = None):
+        """
+        Feed outcome of a task into the engine, like DecisionEngine.offload_task().
+        """
+        engine = self.engine
+        task.finished = self.now
+        task.ok = error is None
+        task.error = error
+        if task.tracked is not None:
+            engine._task_finished(task.tracked)
+        if task.server is None or error == "circuit_open":
+            return
+        latency = self.now - task.arrival
+        if task.ok:
+            engine.record_latency(task.server, task.task, latency)
+            engine._record_outcome(task.breaker, 200)
+        elif error == "failed":
+            engine._record_outcome(task.breaker, 500)
+        else:
+            engine._record_outcome(task.breaker)
+        if engine.local_capacity is not None and task.server.serverIP == "127.0.0.1":
+            engine.local_capacity.record(latency, engine.cal_throughput())
+
+
+def default_servers():
+    """
+    Servers like the experiments in docs/: local device and two VMs, one of
+    them heavy tailed, flaky and down for five minutes.
+    """
+    return [
+        SimServer("127.0.0.1", service=exponential(0.2), capacity=4),
+        SimServer("192.168.56.2", service=exponential(0.1), capacity=8, network_delay=uniform(0.001, 0.005)),
+        SimServer("192.168.56.3", service=pareto(0.05, 1.5), capacity=8, network_delay=uniform(0.002, 0.01),
+                  failure_rate=0.01, outages=[(600, 900)]),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Discrete-event simulator of decision algorithms")
+    parser.add_argument("--algorithms", default=",".join(Config.decision_algorithm),
+                        help="Comma separated keys of Config.decision_algorithm")
+    parser.add_argument("--rate", type=float, default=20, help="Tasks per virtual second")
+    parser.add_argument("--duration", type=float, default=3600, help="Virtual seconds of arrivals")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--even", action="store_true", help="Evenly spaced arrivals instead of Poisson")
+    parser.add_argument("--timeout", type=float, help="Deadline of every task in seconds")
+    parser.add_argument("--consider-throughput", action="store_true",
+                        help="Run tasks on local device until its throughput limit")
+    parser.add_argument("--circuit-breaker", action="store_true")
+    parser.add_argument("--json", help="Write summaries to this file")
+    args = parser.parse_args(argv)
+
+    sim = Simulation(default_servers(), consider_throughput=args.consider_throughput,
+                     circuit_breaker=args.circuit_breaker)
+    summaries = list()
+    print(f"{'algorithm':<26} {'tasks':>8} {'failed':>7} {'mean (s)':>9} {'p50 (s)':>8} "
+          f"{'p95 (s)':>8} {'p99 (s)':>8} {'local':>6} {'wall (s)':>9}")
+    for algorithm in args.algorithms.split(","):
+        summary = sim.run(algorithm, rate=args.rate, duration=args.duration, seed=args.seed,
+                          poisson=not args.even, timeout=args.timeout).summary()
+        summaries.append(summary)
+
+        def seconds(value):
+            return f"{value:8.3f}" if value is not None else f"{'-':>8}"
+
+        print(f"{algorithm:<26} {summary['tasks']:>8} {summary['tasks'] - summary['ok']:>7} "
+              f"{seconds(summary['mean']):>9} {seconds(summary['p50'])} {seconds(summary['p95'])} "
+              f"{seconds(summary['p99'])} {summary['local'] / max(1, summary['ok']):>6.0%} "
+              f"{summary['wall_time']:>9.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rate": args.rate, "duration": args.duration, "seed": args.seed,
+                       "results": summaries}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# This is logging of the request hot path.
+# Every offloaded task used to log several formatted lines, on the request
+# thread and in the worker, which at thousands of tasks per second costs more
+# CPU than routing them. Here:
+#
+#   - configure_logging() writes log sinks from a background thread
+#     (loguru's enqueue), so a slow terminal or disk doesn't block requests.
+#   - TaskLog samples tasks: a task is picked (or not) once when it's
+#     submitted, and all of its lines, from routing in the request thread to
+#     offloading in a worker, are logged or skipped together.
+#   - Messages are loguru brace-style templates formatted by loguru, which
+#     returns before formatting if no sink takes the level.
+#   - Every event is counted whether it's logged or not, so TaskLog.counts
+#     (and /metrics) stay exact at any sample rate.
+
+import random
+import sys
+import threading
+from collections import Counter
+
+from loguru import logger
+
+from config import Config
+
+
+def configure_logging(sink=sys.stderr, *, level: str = Config.LOG_LEVEL, enqueue: bool = True, **kwargs):
+    """
+    Replace loguru sinks with one sink written from a background thread.
+    :param sink   : Anything loguru.logger.add() takes, such as a file path.
+    :param level  : Min level logged, messages below it are not even formatted.
+    :param enqueue: Put messages in a queue written by a background thread.
+    :param kwargs : Other keyword arguments of loguru.logger.add().
+    :return: Id of the sink, see loguru.logger.remove().
+    """
+    logger.remove()
+    return logger.add(sink, level=level, enqueue=enqueue, **kwargs)
+
+
+class TaskLog:
+    """
+    Sampled per-task logs of a DecisionEngine.
+
+    Usage:
+        task_log = TaskLog(sample_rate=0.01)
+        sampled = task_log.begin()
+        ...
+        task_log.event("submitted", "Successfully submit task {}", task_info, sampled=sampled)
+
+    Lines of routing decisions don't know their task, they're logged if the
+    task being routed in this thread was sampled, see begin().
+    """
+
+    def __init__(self, sample_rate: float = Config.LOG_SAMPLE_RATE):
+        """
+        :param sample_rate: Fraction of tasks logged, such as 0.01 for 1%.
+        """
+        self.sample_rate = sample_rate
+        # Event name -> count, of every task whether it's sampled or not
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # depth=1 attributes lines to the caller of event(), not to it. Sinks
+        # are shared with loguru.logger, so sinks added later apply here too.
+        self._logger = logger.opt(depth=1)
+
+    def begin(self, sampled: bool = None):
+        """
+        Pick a task being submitted in this thread, routing lines until the
+        next begin() follow this pick.
+        :param sampled: The pick made in another thread, default is a new pick.
+        :return: True if lines of the task are logged.
+        """
+        if sampled is None:
+            sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        self._local.sampled = sampled
+        return sampled
+
+    def event(self, name: str, message: str, *args, sampled: bool = None, level: str = "INFO"):
+        """
+        Count an event, and log it if its task is sampled.
+        :param message: A loguru template such as "Call {}:{}", formatted with
+                        args only if it's logged.
+        :param sampled: Whether the task is sampled, default is the pick of
+                        the last begin() in this thread (True if none).
+        """
+        with self._lock:
+            self.counts[name] += 1
+        if sampled is None:
+            sampled = getattr(self._local, "sampled", True)
+        if sampled:
+            self._logger.log(level, message, *args)
+
+    def snapshot(self):
+        """
+        :return: A dict of event name -> count.
+        """
+        with self._lock:
+            return dict(self.counts)
@@ -0,0 +1,17 @@
+# A settable clock for unittests of components taking a clock, such as
+# breaker.CircuitBreaker, so tests control time instead of sleeping.
+
+
+class FakeClock:
+    """
+    Usage:
+        clock = FakeClock()
+        breaker = CircuitBreaker(..., clock=clock)
+        clock.now += 10
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,82 @@
+# A local stand-in for flask_test_example/app.py used by unittests,
+# so engine tests can offload tasks without remote servers.
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, without TCP_NODELAY every
+    # response would wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        stub = self.server
+        with stub.lock:
+            stub.requests += 1
+            stub.headers.append(dict(self.headers))
+        if stub.delay:
+            time.sleep(stub.delay)
+
+        path = self.path.lstrip("/")
+        status = stub.status
+        if path.startswith("offloading/"):
+            body = f"{float(path.split('/')[1]) ** 2}"
+        elif path == "getserverlists":
+            body = json.dumps({"data": ["127.0.0.1"]})
+        else:
+            body = "world"
+
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Usage:
+        stub = StubServer().start()
+        ... request http://127.0.0.1:{stub.port}/offloading/10 ...
+        stub.stop()
+    """
+    daemon_threads = True
+    # Many concurrent connections are opened by front-end tests, default is 5
+    request_queue_size = 256
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), StubHandler)
+        self.lock = threading.Lock()
+        # Accepted TCP connections, and handled requests
+        self.connections = 0
+        self.requests = 0
+        # Headers of every handled request
+        self.headers = list()
+        # Seconds to sleep before every response, and status code of responses
+        self.delay = 0
+        self.status = 200
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
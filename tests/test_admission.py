@@ -0,0 +1,62 @@
+import unittest
+
+from admission import AdmissionController, EngineOverloaded
+from tests.fake_clock import FakeClock
+
+
+class AdmissionControllerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.controller = AdmissionController(max_queue=3, target=0.1, interval=1, clock=self.clock)
+
+    def test_bounded_queue(self):
+        controller = self.controller
+        # Admitted tasks count as queued right away
+        for _ in range(3):
+            controller.admit()
+        self.assertEqual(controller.queued, 3)
+        with self.assertRaises(EngineOverloaded) as cm:
+            controller.admit()
+        self.assertEqual(cm.exception.retry_after, 1)
+        controller.dequeued(0.01)
+        controller.admit()
+        self.assertEqual((controller.admitted, controller.rejected), (4, 1))
+
+    def test_shed_on_standing_queue(self):
+        controller = self.controller
+        controller.enqueued()
+        controller.enqueued()
+        # Queue wait above target, but not for a whole interval yet
+        controller.dequeued(0.5)
+        self.clock.now = 0.5
+        controller.dequeued(0.5)
+        controller.enqueued()
+        controller.admit()
+
+        self.clock.now = 1
+        controller.enqueued()
+        controller.dequeued(0.5)
+        self.assertTrue(controller.shedding)
+        self.assertRaises(EngineOverloaded, controller.admit)
+
+        # A task started within target stops shedding
+        controller.dequeued(0.01)
+        controller.enqueued()
+        controller.admit()
+        self.assertFalse(controller.shedding)
+
+    def test_stop_shedding_on_empty_queue(self):
+        controller = self.controller
+        controller.enqueued()
+        controller.enqueued()
+        controller.dequeued(0.5)
+        self.clock.now = 1
+        controller.dequeued(0.5)
+        self.assertTrue(controller.shedding)
+        # Queue is empty, nothing left to drain
+        controller.admit()
+        self.assertFalse(controller.shedding)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import unittest
 
-from server import Server, ServerList
+from server import Server, ServerList, ServerInfo, AvailabilityHistory
+from latency import LatencyEstimator
+from breaker import CircuitBreaker
 
 
 class ServerTestCases(unittest.TestCase):
@@ -43,6 +45,46 @@ class ServerTestCases(unittest.TestCase):
         print(server2.availability)
 
 
+class AvailabilityHistoryTestCases(unittest.TestCase):
+
+    def test_ring(self):
+        history = AvailabilityHistory(capacity=4)
+        self.assertIsNone(history.latest())
+        self.assertIsNone(history.mean_delay())
+        self.assertIsNone(history.loss_rate())
+
+        samples = [ServerInfo(True, 1.0, 1), ServerInfo(False, 0, 2), ServerInfo(True, 3.0, 3)]
+        for info in samples:
+            history.append(info)
+        self.assertEqual(list(history), samples)
+        self.assertEqual(history[-1], samples[-1])
+        self.assertEqual(history.latest(), samples[-1])
+        self.assertAlmostEqual(history.mean_delay(), 2.0)
+        self.assertAlmostEqual(history.loss_rate(), 1 / 3)
+
+        # Overwrite the oldest samples
+        history.append(ServerInfo(True, 5.0, 4))
+        history.append(ServerInfo(True, 7.0, 5))
+        history.append(ServerInfo(True, 9.0, 6))
+        self.assertEqual(len(history), 4)
+        self.assertEqual([info.timestamp for info in history], [3, 4, 5, 6])
+        self.assertAlmostEqual(history.mean_delay(), 6.0)
+        self.assertAlmostEqual(history.loss_rate(), 0.0)
+        with self.assertRaises(IndexError):
+            history[4]
+
+    def test_memory_is_flat(self):
+        server = Server("s1", "127.0.0.1")
+        for i in range(1000):
+            server.availability.append(ServerInfo(i % 2 == 0, 1.0, i))
+        self.assertEqual(len(server.availability), server.availability.capacity)
+        self.assertEqual(len(server.availability._delay), server.availability.capacity)
+        self.assertAlmostEqual(server.availability.loss_rate(), 0.5)
+        # Server is built on __slots__
+        with self.assertRaises(AttributeError):
+            server.other_field = 1
+
+
 class ServerListTestCases(unittest.TestCase):
 
     def test_server_list_initialization(self):
@@ -93,6 +135,59 @@ class ServerListTestCases(unittest.TestCase):
         # self.assertEqual("vagrant-ubuntu", chosen_server.serverName)
         # self.assertEqual("192.168.56.2", chosen_server.serverIP)
 
+    def test_select_by_outstanding(self):
+        server_list = ServerList.specify_server_list({
+            "busy": "10.0.0.1",
+            "idle": "10.0.0.2",
+        })
+        server_list.get_server("10.0.0.1").outstanding = 5
+        for _ in range(10):
+            self.assertEqual(server_list.select_least_outstanding_server().serverIP, "10.0.0.2")
+            self.assertEqual(server_list.select_power_of_two_choices_server().serverIP, "10.0.0.2")
+
+        self.assertIsNone(ServerList.specify_server_list({}).select_least_outstanding_server())
+        self.assertIsNone(ServerList.specify_server_list({}).select_power_of_two_choices_server())
+
+    def test_select_min_observed_latency(self):
+        server_list = ServerList.specify_server_list({
+            "fast": "10.0.0.1",
+            "slow": "10.0.0.2",
+            "cold": "10.0.0.3",
+        })
+        fast = server_list.get_server("10.0.0.1")
+        slow = server_list.get_server("10.0.0.2")
+        cold = server_list.get_server("10.0.0.3")
+        for server, latency in ((fast, 0.1), (slow, 2.0)):
+            server.observed_latency = LatencyEstimator()
+            for _ in range(5):
+                server.observed_latency.update(latency)
+
+        # A cold server known unreachable is skipped
+        cold.reachable = False
+        self.assertEqual(server_list.select_min_observed_latency_server(), fast)
+        # A cold server is ranked by ping delay, 500 ms here
+        cold.reachable = True
+        cold.smoothed_delay = 500.0
+        self.assertEqual(server_list.select_min_observed_latency_server(), fast)
+        cold.smoothed_delay = 50.0
+        self.assertEqual(server_list.select_min_observed_latency_server(), cold)
+
+    def test_skip_open_breaker(self):
+        server_list = ServerList.specify_server_list({
+            "a": "10.0.0.1",
+            "b": "10.0.0.2",
+        })
+        broken = server_list.get_server("10.0.0.1")
+        broken.breaker = CircuitBreaker("10.0.0.1", failure_threshold=1)
+        broken.breaker.record_failure()
+        self.assertEqual(server_list.routable_servers(), [server_list.get_server("10.0.0.2")])
+        for _ in range(10):
+            self.assertEqual(server_list.select_random_server().serverIP, "10.0.0.2")
+            self.assertEqual(server_list.select_power_of_two_choices_server().serverIP, "10.0.0.2")
+            self.assertEqual(server_list.select_least_outstanding_server().serverIP, "10.0.0.2")
+        server_list.get_server("10.0.0.2").breaker = broken.breaker
+        self.assertIsNone(server_list.select_random_server())
+
     def test_specify_server_list(self):
         d = {
             "AWS": "95.69.98.253",
@@ -0,0 +1,77 @@
+import unittest
+
+from breaker import CircuitBreaker
+from tests.fake_clock import FakeClock
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.changes = list()
+        self.breaker = CircuitBreaker(
+            "10.0.0.1", failure_threshold=3, reset_timeout=5, half_open_calls=2,
+            clock=self.clock,
+            on_state_change=lambda breaker, old, new: self.changes.append((old, new)),
+        )
+
+    def test_open_after_consecutive_failures(self):
+        breaker = self.breaker
+        breaker.record_failure()
+        breaker.record_failure()
+        # A success resets consecutive failures
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.available())
+        self.assertFalse(breaker.allow_request())
+        self.assertEqual(self.changes, [("closed", "open")])
+
+    def test_half_open_probes(self):
+        breaker = self.breaker
+        for _ in range(3):
+            breaker.record_failure()
+        self.clock.now = 5
+        self.assertTrue(breaker.available())
+        # Only half_open_calls probes at a time
+        self.assertTrue(breaker.allow_request())
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.available())
+        self.assertFalse(breaker.allow_request())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.changes, [("closed", "open"), ("open", "half_open"), ("half_open", "closed")])
+
+    def test_reopen_on_probe_failure(self):
+        breaker = self.breaker
+        for _ in range(3):
+            breaker.record_failure()
+        self.clock.now = 5
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        # Open for another reset_timeout
+        self.clock.now = 9
+        self.assertFalse(breaker.allow_request())
+        self.clock.now = 10
+        self.assertTrue(breaker.allow_request())
+
+    def test_release_cancelled_probe(self):
+        breaker = self.breaker
+        for _ in range(3):
+            breaker.record_failure()
+        self.clock.now = 5
+        breaker.allow_request()
+        breaker.allow_request()
+        breaker.release()
+        self.assertTrue(breaker.allow_request())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+
+from budget import RequestBudget
+
+
+class RequestBudgetTestCase(unittest.TestCase):
+    def test_ratio(self):
+        budget = RequestBudget(ratio=0.1, min_per_period=1)
+        # Quiet engine still gets min_per_period extra requests
+        self.assertTrue(budget.try_acquire())
+        self.assertFalse(budget.try_acquire())
+
+        for _ in range(50):
+            budget.record_request()
+        # 10% of 50 requests, one already used
+        allowed = sum(budget.try_acquire() for _ in range(10))
+        self.assertEqual(allowed, 4)
+        self.assertEqual(budget.denied, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from cache import ResultCache
+from tests.fake_clock import FakeClock
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = ResultCache(clock=clock)
+        cache.put("a", 1, ttl=10)
+        cache.put("b", 2, ttl=0)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+
+        clock.now = 10
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_lru_eviction(self):
+        cache = ResultCache(max_entries=2)
+        cache.put("a", 1, ttl=10)
+        cache.put("b", 2, ttl=10)
+        # "a" is most recently used now
+        cache.get("a")
+        cache.put("c", 3, ttl=10)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_max_bytes(self):
+        cache = ResultCache(max_bytes=10)
+        cache.put("a", "x" * 6, ttl=10, size=6)
+        cache.put("b", "x" * 6, ttl=10, size=6)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 6)
+        # Larger than the whole cache, never stored
+        cache.put("c", "x" * 11, ttl=10, size=11)
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.get("b"), "x" * 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from capacity import LocalCapacityController
+from tests.fake_clock import FakeClock
+
+
+class LocalCapacityControllerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.controller = LocalCapacityController(
+            initial=10, target=0.5, min_limit=2, max_limit=12, increase=1, decrease=0.5,
+            period=1, clock=self.clock,
+        )
+
+    def run_period(self, latency, demand):
+        self.clock.now += 1
+        self.controller.record(latency, demand)
+
+    def test_additive_increase(self):
+        # Fast, but limit not used up
+        self.run_period(0.1, demand=3)
+        self.assertEqual(self.controller.current(), 10)
+        for _ in range(5):
+            self.run_period(0.1, demand=self.controller.current())
+        self.assertEqual(self.controller.current(), 12)
+        self.assertEqual(self.controller.increases, 2)
+
+    def test_multiplicative_decrease(self):
+        self.run_period(2.0, demand=10)
+        self.assertEqual(self.controller.current(), 5)
+        # Samples before the decrease are dropped
+        self.run_period(0.1, demand=5)
+        self.assertEqual(self.controller.current(), 6)
+        for _ in range(3):
+            self.run_period(2.0, demand=6)
+        self.assertEqual(self.controller.current(), 2)
+
+    def test_adjust_once_per_period(self):
+        for _ in range(10):
+            self.controller.record(2.0, demand=10)
+        self.assertEqual(self.controller.current(), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
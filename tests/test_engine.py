@@ -1,9 +1,27 @@
 import unittest
+import asyncio
+import os
+import tempfile
+import threading
 import time
+from concurrent.futures import Future
 
-from engine import DecisionEngine
+import requests
+from loguru import logger
+
+from admission import EngineOverloaded
+from breaker import CircuitOpenError
+from budget import RequestBudget
+from capacity import LocalCapacityController
+from engine import DecisionEngine, AsyncDecisionEngine, DeadlineExceeded, NoServerAvailable, TaskInfo
 from server import ServerList, Server
 from config import Config
+from interfaces import FlaskTestInterfaces, BDInterfaces
+from recording import TraceRecorder, read_records
+from replay import replay
+from throughput import SlidingWindowCounter
+from tracing import RingSink, Tracer
+from tests.stub_server import StubServer
 
 
 class EngineTestCase(unittest.TestCase):
@@ -47,7 +65,7 @@ class EngineTestCase(unittest.TestCase):
 
         # throughput larger than expected throughput
         for i in range(20):
-            de.req_time_lst.append(time.time())
+            de.throughput_counter.record()
         chosen_server = de.choose_server()
         print(chosen_server)
         self.assertFalse(chosen_server == Server("temp", "127.0.0.1"))
@@ -55,7 +73,7 @@ class EngineTestCase(unittest.TestCase):
         # throughput not larger than expected throughput
         time.sleep(3)
         for i in range(5):
-            de.req_time_lst.append(time.time())
+            de.throughput_counter.record()
         chosen_server = de.choose_server()
         print(chosen_server)
         self.assertTrue(chosen_server == Server("temp", "127.0.0.1"))
@@ -64,7 +82,7 @@ class EngineTestCase(unittest.TestCase):
         time.sleep(3)
         for i in range(20):
             time.sleep(0.2)
-            de.req_time_lst.append(time.time())
+            de.throughput_counter.record()
         chosen_server = de.choose_server()
         print(chosen_server)
         self.assertTrue(chosen_server == Server("temp", "127.0.0.1"))
@@ -93,15 +111,885 @@ class EngineTestCase(unittest.TestCase):
 
         for i in range(20):
             time.sleep(0.1)
-            de.req_time_lst.append(time.time())
+            de.throughput_counter.record()
 
-        self.assertEqual(de.cal_throughput(), de.default_throughput_period / 0.1)
+        # Requests are counted in buckets, so allow one bucket of error
+        self.assertAlmostEqual(de.cal_throughput(), de.default_throughput_period / 0.1, delta=1)
 
         for i in range(20):
             time.sleep(0.2)
-            de.req_time_lst.append(time.time())
+            de.throughput_counter.record()
+
+        self.assertAlmostEqual(de.cal_throughput(), de.default_throughput_period / 0.2, delta=1)
+
+
+class SessionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubServer().start()
+        self.server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_reuse_connection(self):
+        de = DecisionEngine(decision_algorithm="default", server_list=self.server_list)
+        for i in range(10):
+            ret, server = de.submit_task(f"offloading/{i}", port=self.stub.port)
+            self.assertEqual(f"{float(i) ** 2}", ret.result().text)
+        self.assertEqual(self.stub.requests, 10)
+        self.assertEqual(self.stub.connections, 1)
+        de.close()
+
+    def test_pool_size(self):
+        self.server_list.serverList[0].pool_size = 3
+        de = DecisionEngine(decision_algorithm="default", server_list=self.server_list)
+        adapter = de.get_session(Server("LocalDevice", "127.0.0.1")).get_adapter("http://127.0.0.1")
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+        de = DecisionEngine(decision_algorithm="default", server_list=self.server_list,
+                            max_workers=5)
+        adapter = de.get_session(Server("other", "127.0.0.2")).get_adapter("http://127.0.0.2")
+        self.assertEqual(adapter._pool_maxsize, 5)
+
+    def test_prewarm_and_evict(self):
+        self.server_list.serverList[0].pool_size = 4
+        # Slow responses, so warming requests can't share a connection
+        self.stub.delay = 0.2
+        de = DecisionEngine(decision_algorithm="default", server_list=self.server_list,
+                            prewarm_port=self.stub.port)
+        self.assertEqual(self.stub.connections, 4)
+        self.assertIn("127.0.0.1", de.sessions)
+
+        self.server_list.remove_ip("127.0.0.1")
+        self.assertNotIn("127.0.0.1", de.sessions)
+
+    def test_close_unregisters_listener(self):
+        de = DecisionEngine(decision_algorithm="default", server_list=self.server_list)
+        self.assertIn(de.evict_sessions, self.server_list.removal_listeners)
+        de.close()
+        self.assertNotIn(de.evict_sessions, self.server_list.removal_listeners)
+
+    def test_user_specific_servers_not_pooled(self):
+        server_list = ServerList.specify_server_list({"other": "127.0.0.2"})
+        for cls in (DecisionEngine, AsyncDecisionEngine):
+            de = cls(decision_algorithm="default", server_list=server_list)
+            try:
+                for i in range(3):
+                    ret, server = de.submit_task(f"offloading/{i}", port=self.stub.port, ip="127.0.0.1")
+                    self.assertEqual(ret.result().status_code, 200)
+                self.assertNotIn("127.0.0.1", de.sessions)
+                self.assertNotIn("127.0.0.1", getattr(de, "async_sessions", {}))
+            finally:
+                de.close()
+
+
+class OutstandingTestCase(unittest.TestCase):
+    def test_count_tasks_in_flight(self):
+        stub = StubServer().start()
+        stub.delay = 0.3
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        de = DecisionEngine(decision_algorithm="least_outstanding", server_list=server_list)
+        try:
+            rets = [de.submit_task(f"offloading/{i}", port=stub.port) for i in range(5)]
+            time.sleep(0.15)
+            self.assertEqual(de.outstanding_tasks(), {"127.0.0.1": 5})
+            for ret, server in rets:
+                ret.result()
+            self.assertEqual(de.outstanding_tasks(), {"127.0.0.1": 0})
+        finally:
+            de.close()
+            stub.stop()
+
+    def test_count_queued_tasks(self):
+        stub = StubServer().start()
+        stub.delay = 0.2
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        for cls in (DecisionEngine, AsyncDecisionEngine):
+            de = cls(decision_algorithm="least_outstanding", server_list=server_list, max_workers=1)
+            try:
+                # Counted when routed, while waiting for the only worker too
+                rets = [de.submit_task(f"offloading/{i}", port=stub.port) for i in range(3)]
+                self.assertEqual(de.outstanding_tasks(), {"127.0.0.1": 3})
+                for ret, server in rets:
+                    ret.result()
+                # Released by done callbacks, which may run right after result() returns
+                time.sleep(0.05)
+                self.assertEqual(de.outstanding_tasks(), {"127.0.0.1": 0})
+            finally:
+                de.close()
+        stub.stop()
+
+
+class ObservedLatencyTestCase(unittest.TestCase):
+    def test_record_latency(self):
+        stub = StubServer().start()
+        stub.delay = 0.1
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        de = DecisionEngine(decision_algorithm="minimum_observed_latency", server_list=server_list)
+        try:
+            for i in range(3):
+                ret, server = de.submit_task(FlaskTestInterfaces.get_double(i), port=stub.port)
+                ret.result()
+            ret, server = de.submit_task(FlaskTestInterfaces.hello_world(), port=stub.port)
+            ret.result()
+
+            per_server = de.observed_latency("127.0.0.1")
+            self.assertEqual(per_server.count, 4)
+            self.assertGreaterEqual(per_server.mean, 0.1)
+            self.assertEqual(de.observed_latency("127.0.0.1", "FlaskTestInterfaces.get_double").count, 3)
+            self.assertEqual(de.observed_latency("127.0.0.1", "FlaskTestInterfaces.hello_world").count, 1)
+        finally:
+            de.close()
+            stub.stop()
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubServer().start()
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        self.de = DecisionEngine(decision_algorithm="default", server_list=server_list,
+                                 result_cache=True)
+
+    def tearDown(self):
+        self.de.close()
+        self.stub.stop()
+
+    def test_cache_hit(self):
+        task = FlaskTestInterfaces.get_double(7)
+        ret, server = self.de.submit_task(task, port=self.stub.port)
+        self.assertEqual(ret.result().text, "49.0")
+
+        # Same task is served from cache, the Future is already done
+        ret, server = self.de.submit_task(FlaskTestInterfaces.get_double(7), port=self.stub.port)
+        self.assertTrue(ret.done())
+        self.assertEqual(ret.result().text, "49.0")
+        self.assertEqual(server, "127.0.0.1")
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual(self.de.result_cache.stats()["hits"], 1)
+
+    def test_not_cached(self):
+        # Plain str tasks declare no ttl
+        for _ in range(2):
+            self.de.submit_task("offloading/7", port=self.stub.port)[0].result()
+        # Errors are not cached
+        self.stub.status = 500
+        for _ in range(2):
+            self.de.submit_task(FlaskTestInterfaces.get_double(8), port=self.stub.port)[0].result()
+        self.assertEqual(self.stub.requests, 4)
+
+
+class CoalesceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubServer().start()
+        self.stub.delay = 0.3
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        self.de = DecisionEngine(decision_algorithm="default", server_list=server_list)
+
+    def tearDown(self):
+        self.de.close()
+        self.stub.stop()
+
+    def test_coalesce_identical_tasks(self):
+        rets = [self.de.submit_task(FlaskTestInterfaces.get_double(7), port=self.stub.port)
+                for _ in range(10)]
+        self.assertTrue(all(ret is rets[0][0] for ret, server in rets))
+        self.assertEqual([ret.result().text for ret, server in rets], ["49.0"] * 10)
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual(self.de.coalesced_tasks, 9)
+        self.assertEqual(self.de.in_flight_tasks, dict())
+
+        # Finished tasks are not shared
+        self.de.submit_task(FlaskTestInterfaces.get_double(7), port=self.stub.port)[0].result()
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_not_coalesced(self):
+        # Non-idempotent interfaces and plain str tasks
+        tasks = [BDInterfaces.execute_contract(contractID="c", operation="o")] * 3 + ["offloading/7"] * 3
+        rets = [self.de.submit_task(task, port=self.stub.port) for task in tasks]
+        [ret.result() for ret, server in rets]
+        self.assertEqual(self.stub.requests, 6)
+        self.assertEqual(self.de.coalesced_tasks, 0)
+
+
+class BatchTestCase(unittest.TestCase):
+    def test_plan_batch(self):
+        server_list = ServerList.specify_server_list({
+            "LocalDevice": "127.0.0.1",
+            "s1": "10.0.0.1",
+            "s2": "10.0.0.2",
+        })
+        de = DecisionEngine(decision_algorithm="least_outstanding", server_list=server_list,
+                            consider_throughput=True)
+        plan = de.plan_batch(Config.EXPECTED_THROUGHPUT + 10)
+        ips = [server.serverIP for server in plan]
+        self.assertEqual(ips.count("127.0.0.1"), Config.EXPECTED_THROUGHPUT)
+        # The rest is spread evenly by least outstanding
+        self.assertEqual(ips.count("10.0.0.1"), 5)
+        self.assertEqual(ips.count("10.0.0.2"), 5)
+        # Planning doesn't leave tasks counted in flight
+        self.assertEqual(set(de.outstanding_tasks().values()), {0})
+
+    def test_plan_batch_chooses_once(self):
+        server_list = ServerList.specify_server_list({"s1": "10.0.0.1", "s2": "10.0.0.2"})
+        calls = list()
+
+        def select():
+            calls.append(1)
+            return server_list.get_server("10.0.0.2")
+
+        server_list.select_min_observed_latency_server = select
+        de = DecisionEngine(decision_algorithm="minimum_observed_latency", server_list=server_list)
+        plan = de.plan_batch(20)
+        self.assertEqual([server.serverIP for server in plan], ["10.0.0.2"] * 20)
+        self.assertEqual(len(calls), 1)
+
+    def test_submit_many(self):
+        stub = StubServer().start()
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        de = DecisionEngine(decision_algorithm="default", server_list=server_list, max_workers=4)
+        try:
+            tasks = [f"offloading/{i}" for i in range(50)]
+            results = list(de.submit_many(tasks, port=stub.port, window=8))
+            self.assertEqual([index for index, ret, server in results], list(range(50)))
+            self.assertEqual([ret.result().text for index, ret, server in results],
+                             [f"{float(i) ** 2}" for i in range(50)])
+
+            results = list(de.submit_many(tasks, port=stub.port, ordered=False))
+            self.assertEqual(sorted(index for index, ret, server in results), list(range(50)))
+            for index, ret, server in results:
+                self.assertEqual(ret.result().text, f"{float(index) ** 2}")
+        finally:
+            de.close()
+            stub.stop()
+
+
+class HedgeTestCase(unittest.TestCase):
+    def setUp(self):
+        # Two servers on the same port, 127.0.0.1 is slow
+        self.slow = StubServer().start()
+        self.fast = StubServer(host="127.0.0.2", port=self.slow.port).start()
+        server_list = ServerList.specify_server_list({"slow": "127.0.0.1", "fast": "127.0.0.2"})
+        self.de = DecisionEngine(decision_algorithm="minimum_observed_latency",
+                                 server_list=server_list, hedge_percentile=95)
+        # Until now 127.0.0.1 looked faster, so it's chosen first
+        for _ in range(5):
+            self.de.record_latency(Server("slow", "127.0.0.1"), FlaskTestInterfaces.get_double(1), 0.05)
+            self.de.record_latency(Server("fast", "127.0.0.2"), FlaskTestInterfaces.get_double(1), 0.1)
+
+    def tearDown(self):
+        self.de.close()
+        self.slow.stop()
+        self.fast.stop()
+
+    def test_hedge_slow_task(self):
+        self.slow.delay = 1
+        st = time.time()
+        ret, server = self.de.submit_task(FlaskTestInterfaces.get_double(3), port=self.slow.port)
+        self.assertEqual(server, "127.0.0.1")
+        self.assertEqual(ret.result().text, "9.0")
+        self.assertLess(time.time() - st, 0.8)
+        self.assertEqual(ret.server_ip, "127.0.0.2")
+        self.assertEqual(self.de.hedged_tasks, 1)
+        self.assertEqual(self.de.hedge_wins, 1)
+
+    def test_choose_hedge_server_in_pool(self):
+        threads = list()
+        choose = self.de._choose_server_except
+
+        def choose_server_except(*args):
+            threads.append(threading.current_thread().name)
+            return choose(*args)
+
+        self.de._choose_server_except = choose_server_except
+        self.slow.delay = 1
+        ret, server = self.de.submit_task(FlaskTestInterfaces.get_double(3), port=self.slow.port)
+        self.assertEqual(ret.result().text, "9.0")
+        self.assertEqual(len(threads), 1)
+        # Not in the timer thread, which would delay timers of every task
+        self.assertNotEqual(threads[0], "DecisionEngineTimers")
+
+    def test_no_hedge(self):
+        # Fast enough primary
+        ret, server = self.de.submit_task(FlaskTestInterfaces.get_double(3), port=self.slow.port)
+        self.assertEqual(ret.result().text, "9.0")
+        # Non-idempotent interfaces are never hedged
+        self.slow.delay = 0.5
+        task = BDInterfaces.execute_contract(contractID="c", operation="o")
+        ret, server = self.de.submit_task(task, port=self.slow.port)
+        ret.result()
+        self.assertEqual(self.de.hedged_tasks, 0)
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def setUp(self):
+        # Two servers on the same port, 127.0.0.1 fails
+        self.bad = StubServer().start()
+        self.good = StubServer(host="127.0.0.2", port=self.bad.port).start()
+        self.bad.status = 500
+        server_list = ServerList.specify_server_list({"bad": "127.0.0.1", "good": "127.0.0.2"})
+        self.de = DecisionEngine(decision_algorithm="default", server_list=server_list,
+                                 circuit_breaker=True)
+
+    def tearDown(self):
+        self.de.close()
+        self.bad.stop()
+        self.good.stop()
+
+    def test_skip_open_server(self):
+        threshold = Config.BREAKER_FAILURE_THRESHOLD
+        for _ in range(threshold):
+            ret, server = self.de.submit_task("offloading/2", port=self.bad.port, ip="127.0.0.1")
+            self.assertEqual(ret.result().status_code, 500)
+        self.assertEqual(self.de.breaker_states()["127.0.0.1"], "open")
+        self.assertEqual(self.de.breaker_events[-1][1:], ("127.0.0.1", "closed", "open"))
+
+        # Decision functions skip the open server
+        for _ in range(10):
+            ret, server = self.de.submit_task("offloading/2", port=self.bad.port)
+            self.assertEqual(server, "127.0.0.2")
+            self.assertEqual(ret.result().status_code, 200)
+        # Tasks sent to it explicitly fail fast
+        ret, server = self.de.submit_task("offloading/2", port=self.bad.port, ip="127.0.0.1")
+        self.assertRaises(CircuitOpenError, ret.result)
+        self.assertEqual(self.bad.requests, threshold)
+
+    def test_probe_and_close(self):
+        breaker = self.de._get_breaker(Server("bad", "127.0.0.1"))
+        breaker.reset_timeout = 0.2
+        for _ in range(Config.BREAKER_FAILURE_THRESHOLD):
+            breaker.record_failure()
+        self.bad.status = 200
+        time.sleep(0.2)
+        # The recovered server gets a probe task and closes
+        self.assertTrue(self.de.server_list.get_server("127.0.0.1").breaker.available())
+        ret, server = self.de.submit_task("offloading/2", port=self.bad.port, ip="127.0.0.1")
+        self.assertEqual(ret.result().status_code, 200)
+        self.assertEqual(self.de.breaker_states()["127.0.0.1"], "closed")
+
+    def test_reroute_when_probes_taken(self):
+        bad = self.de.server_list.get_server("127.0.0.1")
+        breaker = self.de._get_breaker(bad)
+        breaker.reset_timeout = 0.2
+        for _ in range(Config.BREAKER_FAILURE_THRESHOLD):
+            breaker.record_failure()
+        time.sleep(0.2)
+        # Probe tasks of other requests are in flight
+        for _ in range(breaker.half_open_calls):
+            self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        # A task a decision function sent there goes to the next best server
+        ret, server = self.de._submit_task("offloading/2", self.bad.port, None, lambda: bad, None)
+        self.assertEqual(ret.result().status_code, 200)
+        self.assertEqual((self.good.requests, self.bad.requests), (1, 0))
+        self.assertEqual(self.de.rerouted_tasks, 1)
+        # A task the client sent there has nowhere else to go
+        ret, server = self.de.submit_task("offloading/2", port=self.bad.port, ip="127.0.0.1")
+        self.assertRaises(CircuitOpenError, ret.result)
+
+
+class RetryTestCase(unittest.TestCase):
+    def setUp(self):
+        # Two servers on the same port, 127.0.0.1 fails
+        self.bad = StubServer().start()
+        self.good = StubServer(host="127.0.0.2", port=self.bad.port).start()
+        self.bad.status = 503
+        server_list = ServerList.specify_server_list({"bad": "127.0.0.1", "good": "127.0.0.2"})
+        self.de = DecisionEngine(decision_algorithm="default", server_list=server_list)
+        self.bad_server = server_list.get_server("127.0.0.1")
+
+    def tearDown(self):
+        self.de.close()
+        self.bad.stop()
+        self.good.stop()
+
+    def submit_to_bad(self, task):
+        return self.de._submit_task(task, self.bad.port, None, lambda: self.bad_server)
+
+    def test_failover(self):
+        ret, server = self.submit_to_bad(FlaskTestInterfaces.get_double(3))
+        self.assertEqual(server, "127.0.0.1")
+        self.assertEqual(ret.result().status_code, 200)
+        self.assertEqual(ret.result().text, "9.0")
+        self.assertEqual(ret.server_ip, "127.0.0.2")
+        self.assertEqual(self.de.retried_tasks, 1)
+
+    def test_failover_on_connection_error(self):
+        self.bad.stop()
+        ret, server = self.submit_to_bad(FlaskTestInterfaces.get_double(3))
+        self.assertEqual(ret.result().text, "9.0")
+        self.assertEqual(ret.server_ip, "127.0.0.2")
+        self.good.stop()
+        self.assertRaises(requests.ConnectionError, self.submit_to_bad(FlaskTestInterfaces.get_double(4))[0].result)
+
+    def test_not_retried(self):
+        # Interfaces not declaring retries
+        task = BDInterfaces.execute_contract(contractID="c", operation="o")
+        ret, server = self.submit_to_bad(task)
+        self.assertEqual(ret.result().status_code, 503)
+        # Retry budget used up
+        self.de.retry_budget = RequestBudget(0, min_per_period=0)
+        ret, server = self.submit_to_bad(FlaskTestInterfaces.get_double(3))
+        self.assertEqual(ret.result().status_code, 503)
+        self.assertEqual(self.de.retried_tasks, 0)
+        self.assertEqual(self.good.requests, 0)
+
+    def test_close_during_backoff(self):
+        # Closing the engine doesn't wait out a long backoff, the task
+        # completes with the response of its last attempt
+        waiting = threading.Event()
+        self.de._retry_backoff = lambda attempt: (waiting.set(), 60)[1]
+        ret, server = self.submit_to_bad(FlaskTestInterfaces.get_double(3))
+        self.assertTrue(waiting.wait(5))
+        st = time.monotonic()
+        self.de.close()
+        self.assertEqual(ret.result(timeout=5).status_code, 503)
+        self.assertLess(time.monotonic() - st, 5)
+        self.assertEqual(ret.server_ip, "127.0.0.1")
+        self.assertEqual(self.good.requests, 0)
+        # An attempt failing after close isn't retried, its own error is set
+        failed = Future()
+        failed.set_exception(requests.ConnectionError())
+        retried = self.de._retry(TaskInfo(self.bad_server, FlaskTestInterfaces.get_double(3), self.bad.port), failed)
+        self.assertRaises(requests.ConnectionError, retried.result, timeout=5)
+
+
+class DeadlineTestCase(unittest.TestCase):
+    def setUp(self):
+        # Two servers on the same port, 127.0.0.2 looks slow
+        self.fast = StubServer(host="127.0.0.3").start()
+        self.slow = StubServer(host="127.0.0.2", port=self.fast.port).start()
+        server_list = ServerList.specify_server_list({"slow": "127.0.0.2", "fast": "127.0.0.3"})
+        self.de = DecisionEngine(decision_algorithm="default", server_list=server_list)
+        for _ in range(5):
+            self.de.record_latency(Server("slow", "127.0.0.2"), "offloading/1", 2.0)
+
+    def tearDown(self):
+        self.de.close()
+        self.fast.stop()
+        self.slow.stop()
+
+    def test_deadline_aware_selection(self):
+        for _ in range(10):
+            ret, server = self.de.submit_task("offloading/3", port=self.fast.port, timeout=1)
+            self.assertEqual(server, "127.0.0.3")
+            self.assertEqual(ret.result().text, "9.0")
+        # Remaining deadline is sent to the server
+        remaining = int(self.fast.headers[-1][Config.DEADLINE_HEADER])
+        self.assertTrue(0 < remaining <= 1000)
+        # No deadline, any server
+        servers = {self.de.submit_task("offloading/3", port=self.fast.port)[1] for _ in range(30)}
+        self.assertEqual(servers, {"127.0.0.2", "127.0.0.3"})
+
+    def test_fail_fast(self):
+        for _ in range(5):
+            self.de.record_latency(Server("fast", "127.0.0.3"), "offloading/1", 2.0)
+        ret, server = self.de.submit_task("offloading/3", port=self.fast.port, timeout=1)
+        self.assertIsNone(server)
+        self.assertRaises(DeadlineExceeded, ret.result)
+        # Local device runs tasks no server can finish in time
+        self.de.server_list.serverList.append(Server("LocalDevice", "127.0.0.1"))
+        self.assertEqual(self.de.choose_server(time.monotonic() + 1).serverIP, "127.0.0.1")
+
+    def test_submit_many_with_deadline(self):
+        results = list(self.de.submit_many([f"offloading/{i}" for i in range(10)], port=self.fast.port,
+                                           timeout=1))
+        self.assertEqual({server for index, ret, server in results}, {"127.0.0.3"})
+        self.assertEqual(self.slow.requests, 0)
+
+        # No server can meet the deadline, tasks fail fast
+        for _ in range(5):
+            self.de.record_latency(Server("fast", "127.0.0.3"), "offloading/1", 5.0)
+        for index, ret, server in self.de.submit_many(["offloading/3"], port=self.fast.port, timeout=1):
+            self.assertIsNone(server)
+            self.assertRaises(DeadlineExceeded, ret.result)
+        # Local device runs them instead, if it's in the server list
+        self.de.server_list.serverList.append(Server("LocalDevice", "127.0.0.1"))
+        self.assertEqual([server.serverIP for server in self.de.plan_batch(3, time.monotonic() + 1)],
+                         ["127.0.0.1"] * 3)
+
+    def test_no_server_is_not_deadline(self):
+        # Servers would meet the deadline, but there is no server to choose
+        self.de.server_list.serverList.clear()
+        for cls in (DecisionEngine, AsyncDecisionEngine):
+            de = cls(decision_algorithm="default", server_list=self.de.server_list)
+            try:
+                ret, server = de.submit_task("offloading/3", port=self.fast.port, timeout=1)
+                self.assertIsNone(server)
+                self.assertRaises(NoServerAvailable, ret.result)
+            finally:
+                de.close()
+
+    def test_enforce_deadline(self):
+        self.fast.delay = 1
+        st = time.time()
+        ret, server = self.de.submit_task("offloading/3", port=self.fast.port, ip="127.0.0.3", timeout=0.3)
+        self.assertRaises(DeadlineExceeded, ret.result)
+        self.assertLess(time.time() - st, 0.8)
+
+        # A task which waited in queue past its deadline is not sent
+        task = TaskInfo(Server("fast", "127.0.0.3"), "offloading/3", self.fast.port, time.monotonic())
+        requests_before = self.fast.requests
+        self.assertRaises(DeadlineExceeded, self.de.offload_task, task)
+        self.assertEqual(self.fast.requests, requests_before)
+
+
+class AdmissionTestCase(unittest.TestCase):
+    def test_reject_over_capacity(self):
+        stub = StubServer().start()
+        stub.delay = 0.3
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        de = DecisionEngine(decision_algorithm="default", server_list=server_list, max_workers=1,
+                            admission_control=True)
+        de.admission.max_queue = 2
+        try:
+            running, server = de.submit_task("offloading/1", port=stub.port)
+            time.sleep(0.1)
+            # One task running, two waiting for the worker
+            queued = [de.submit_task(f"offloading/{i}", port=stub.port)[0] for i in range(2, 4)]
+            self.assertRaises(EngineOverloaded, de.submit_task, "offloading/4", port=stub.port)
+            self.assertEqual(de.admission.rejected, 1)
+            for ret in [running, *queued]:
+                self.assertEqual(ret.result().status_code, 200)
+            self.assertEqual(de.admission.queued, 0)
+            de.submit_task("offloading/5", port=stub.port)[0].result()
+        finally:
+            de.close()
+            stub.stop()
+
+    def test_release_slot_of_unrouted_task(self):
+        de = DecisionEngine(decision_algorithm="default", server_list=ServerList.specify_server_list({}),
+                            admission_control=True)
+        try:
+            self.assertIsNone(de.submit_task("offloading/1", port=80))
+            self.assertEqual(de.admission.queued, 0)
+        finally:
+            de.close()
+
+
+class PrioritySchedulerTestCase(unittest.TestCase):
+    def test_health_call_first(self):
+        stub = StubServer().start()
+        stub.delay = 0.1
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        de = DecisionEngine(decision_algorithm="default", server_list=server_list, max_workers=1,
+                            priority_scheduler="strict")
+        try:
+            contracts = [de.submit_task(BDInterfaces.execute_contract(contractID=str(i), operation="o"),
+                                        port=stub.port)[0] for i in range(5)]
+            ping, server = de.submit_task(BDInterfaces.ping_pong(), port=stub.port)
+            ping.result()
+            # One contract was running, the others still wait
+            self.assertLessEqual(sum(future.done() for future in contracts), 2)
+            for future in contracts:
+                future.result()
+            stats = de.scheduler.stats()
+            self.assertEqual(stats["high"]["started"], 1)
+            self.assertEqual(stats["low"]["started"], 5)
+        finally:
+            de.close()
+            stub.stop()
+
+
+class LocalCapacityTestCase(unittest.TestCase):
+    def test_learn_local_limit(self):
+        stub = StubServer().start()
+        stub.delay = 0.1
+        server_list = ServerList.specify_server_list({"LocalDevice": "127.0.0.1", "remote": "127.0.0.2"})
+        de = DecisionEngine(decision_algorithm="default", server_list=server_list,
+                            consider_throughput=True)
+        de.local_capacity = LocalCapacityController(initial=10, target=0.05, min_limit=2, decrease=0.5,
+                                                    period=0)
+        try:
+            for _ in range(3):
+                ret, server = de.submit_task("offloading/2", port=stub.port)
+                self.assertEqual(server, "127.0.0.1")
+                ret.result()
+            # Local tasks missed the latency target
+            self.assertEqual(de.local_limit(), 2)
+            self.assertEqual(de.choose_server().serverIP, "127.0.0.2")
+        finally:
+            de.close()
+            stub.stop()
+
+        # Static limit from config
+        de = DecisionEngine(decision_algorithm="default", server_list=server_list, adaptive_capacity=False)
+        self.assertIsNone(de.local_capacity)
+        self.assertEqual(de.local_limit(), Config.EXPECTED_THROUGHPUT)
+
+    def test_failed_local_tasks_lower_limit(self):
+        # Nothing listens on this port, local tasks fail fast
+        stub = StubServer()
+        port = stub.port
+        stub.server_close()
+        server_list = ServerList.specify_server_list({"LocalDevice": "127.0.0.1"})
+        for engine_cls in (DecisionEngine, AsyncDecisionEngine):
+            de = engine_cls(decision_algorithm="default", server_list=server_list)
+            de.local_capacity = LocalCapacityController(initial=10, target=10, min_limit=2, decrease=0.5,
+                                                        period=0)
+            try:
+                ret, server = de.submit_task("offloading/2", port=port)
+                with self.assertRaises(Exception):
+                    ret.result()
+                # A failure counts as missing the target, however fast it was
+                self.assertEqual(de.local_limit(), 5)
+            finally:
+                de.close()
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_task_metrics(self):
+        stub = StubServer().start()
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        de = DecisionEngine(decision_algorithm="default", server_list=server_list, metrics=True)
+        try:
+            for i in range(3):
+                ret, _ = de.submit_task(f"offloading/{i}", port=stub.port)
+                ret.result()
+            lines = de.metrics.render().splitlines()
+        finally:
+            de.close()
+            stub.stop()
+        self.assertIn('offloading_tasks_total{server="127.0.0.1",interface="offloading",location="local"} 3', lines)
+        self.assertIn('offloading_task_latency_seconds_count{server="127.0.0.1",interface="offloading"} 3', lines)
+        self.assertIn('offloading_queue_wait_seconds_count{priority="normal"} 3', lines)
+        self.assertIn("offloading_pool_workers 20", lines)
+
+        # Off by default
+        de = DecisionEngine(decision_algorithm="default", server_list=server_list)
+        self.assertIsNone(de.metrics)
+        de.close()
+
+    def test_async_task_metrics(self):
+        stub = StubServer().start()
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        de = AsyncDecisionEngine(decision_algorithm="default", server_list=server_list, metrics=True)
+        try:
+            for i in range(3):
+                ret, _ = de.submit_task(f"offloading/{i}", port=stub.port)
+                ret.result()
+
+            async def run():
+                ret, _ = await de.submit_task_async("offloading/3", port=stub.port)
+                await ret
+
+            asyncio.run_coroutine_threadsafe(run(), de.loop).result()
+            lines = de.metrics.render().splitlines()
+        finally:
+            de.close()
+            stub.stop()
+        # Wait for the event loop, both from threads and from coroutines
+        self.assertIn('offloading_queue_wait_seconds_count{priority="normal"} 4', lines)
+        # Worker threads don't send tasks here
+        self.assertFalse([line for line in lines if "pool_busy_workers" in line])
+
+
+class TracingTestCase(unittest.TestCase):
+    def test_trace_phases(self):
+        stub = StubServer().start()
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        for engine_cls in (DecisionEngine, AsyncDecisionEngine):
+            ring = RingSink()
+            de = engine_cls(decision_algorithm="default", server_list=server_list,
+                            tracer=Tracer(sample_rate=1, sinks=[ring]))
+            try:
+                for i in range(2):
+                    ret, _ = de.submit_task(f"offloading/{i}", port=stub.port)
+                    ret.result()
+            finally:
+                de.close()
+
+            traces = ring.traces()
+            self.assertEqual(len(traces), 2)
+            # Only the first task opens a connection
+            self.assertEqual(list(traces[0].phases), ["route", "queue", "connect", "remote", "read"])
+            self.assertEqual(list(traces[1].phases), ["route", "queue", "remote", "read"])
+            self.assertEqual(traces[1].server, "127.0.0.1")
+            self.assertEqual(traces[1].status_code, 200)
+            self.assertGreaterEqual(traces[1].total, sum(traces[1].phases.values()))
+            # Trace ids are sent to the server
+            self.assertEqual(stub.headers[-1][Config.TRACE_HEADER], traces[1].trace_id)
+        stub.stop()
+
+    def test_no_trace_of_cached_task(self):
+        stub = StubServer().start()
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        for engine_cls in (DecisionEngine, AsyncDecisionEngine):
+            tracer = Tracer(sample_rate=1, sinks=[RingSink()])
+            started = list()
+            start = tracer.start
+            tracer.start = lambda task: started.append(task) or start(task)
+            de = engine_cls(decision_algorithm="default", server_list=server_list, tracer=tracer,
+                            result_cache=True)
+            try:
+                for _ in range(3):
+                    ret, _ = de.submit_task(FlaskTestInterfaces.get_double(7), port=stub.port)
+                    self.assertEqual(ret.result().text, "49.0")
+            finally:
+                de.close()
+            # Tasks served from cache never started a trace
+            self.assertEqual(len(started), 1)
+        stub.stop()
+
+
+class RecordingTestCase(unittest.TestCase):
+    def test_record_and_replay(self):
+        stub = StubServer().start()
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        fd, path = tempfile.mkstemp(suffix=".trace")
+        os.close(fd)
+        for engine_cls in (DecisionEngine, AsyncDecisionEngine):
+            recorder = TraceRecorder(path)
+            de = engine_cls(decision_algorithm="default", server_list=server_list, recorder=recorder)
+            try:
+                for i in range(3):
+                    ret, _ = de.submit_task(f"offloading/{i}", port=stub.port)
+                    ret.result()
+            finally:
+                de.close()
+                recorder.close()
+        stub.status = 503
+        stub.delay = 0.05
+
+        records = list(read_records(path))
+        self.assertEqual(len(records), 6)
+        self.assertEqual(records[0].interface, "offloading")
+        self.assertEqual((records[0].server, records[0].port, records[0].status), ("127.0.0.1", stub.port, 200))
+        self.assertGreater(records[0].latency, 0)
+
+        # Replayed twice as fast, against the same server answering 503 now
+        de = DecisionEngine(decision_algorithm="default", server_list=server_list)
+        try:
+            latencies, statuses = replay(records, de, speed=2)
+        finally:
+            de.close()
+        self.assertEqual(statuses, [503] * 6)
+        self.assertEqual(latencies, [])
+        self.assertEqual(stub.requests, 12)
+        os.remove(path)
+        stub.stop()
+
+
+class TaskLogTestCase(unittest.TestCase):
+    def test_sampled_logging(self):
+        stub = StubServer().start()
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        lines = list()
+        sink = logger.add(lines.append, level="INFO", filter="engine", format="{message}")
+        try:
+            for engine_cls in (DecisionEngine, AsyncDecisionEngine):
+                for rate, logged in ((0, 0), (1, 3)):
+                    de = engine_cls(decision_algorithm="default", server_list=server_list, log_sample_rate=rate)
+                    del lines[:]
+                    try:
+                        for i in range(3):
+                            ret, _ = de.submit_task(f"offloading/{i}", port=stub.port)
+                            ret.result()
+                    finally:
+                        de.close()
+                    # Counted whether logged or not
+                    self.assertEqual(de.task_log.counts["submitted"], 3)
+                    self.assertEqual(de.task_log.counts["call"], 3)
+                    self.assertEqual(sum(line.startswith("Call remote server") for line in lines), logged)
+        finally:
+            logger.remove(sink)
+            stub.stop()
+
+
+class AsyncEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubServer().start()
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        self.de = AsyncDecisionEngine(decision_algorithm="default", server_list=server_list)
+
+    def tearDown(self):
+        self.de.close()
+        self.stub.stop()
+
+    def test_submit_task_from_thread(self):
+        # A long period, so counting doesn't depend on how fast this test runs
+        self.de.throughput_counter = SlidingWindowCounter(period=60)
+        rets = [self.de.submit_task(f"offloading/{i}", port=self.stub.port) for i in range(20)]
+        for i, (ret, server) in enumerate(rets):
+            self.assertEqual(server, "127.0.0.1")
+            self.assertEqual(ret.result().status_code, 200)
+            self.assertEqual(ret.result().text, f"{float(i) ** 2}")
+        self.assertEqual(self.de.cal_throughput(), 20)
+
+    def test_slow_tasks_do_not_hold_threads(self):
+        self.stub.delay = 0.5
+
+        async def run():
+            rets = [await self.de.submit_task_async(f"offloading/{i}", port=self.stub.port)
+                    for i in range(100)]
+            return await asyncio.gather(*[ret for ret, server in rets])
+
+        st = time.time()
+        results = asyncio.run_coroutine_threadsafe(run(), self.de.loop).result()
+        # 100 tasks of 0.5 s each are all in flight at the same time,
+        # while only 20 worker threads exist.
+        self.assertLess(time.time() - st, 2.5)
+        self.assertEqual([r.text for r in results], [f"{float(i) ** 2}" for i in range(100)])
+
+    def test_hedge_slow_task(self):
+        # Same as HedgeTestCase, on the event loop
+        fast = StubServer(host="127.0.0.2", port=self.stub.port).start()
+        server_list = ServerList.specify_server_list({"slow": "127.0.0.1", "fast": "127.0.0.2"})
+        de = AsyncDecisionEngine(decision_algorithm="minimum_observed_latency", server_list=server_list,
+                                 hedge_percentile=95)
+        for _ in range(5):
+            de.record_latency(Server("slow", "127.0.0.1"), FlaskTestInterfaces.get_double(1), 0.05)
+            de.record_latency(Server("fast", "127.0.0.2"), FlaskTestInterfaces.get_double(1), 0.1)
+        self.stub.delay = 1
+
+        async def run():
+            ret, server = await de.submit_task_async(FlaskTestInterfaces.get_double(3), port=self.stub.port)
+            return (await ret).text, server
+
+        try:
+            st = time.time()
+            text, server = asyncio.run_coroutine_threadsafe(run(), de.loop).result()
+            self.assertEqual(server, "127.0.0.1")
+            self.assertEqual(text, "9.0")
+            self.assertLess(time.time() - st, 0.8)
+            self.assertEqual(de.hedged_tasks, 1)
+            self.assertEqual(de.hedge_wins, 1)
+        finally:
+            de.close()
+            fast.stop()
+
+    def test_reject_over_capacity(self):
+        # Same as AdmissionTestCase, slots of tasks in flight are the workers
+        self.stub.delay = 0.3
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        de = AsyncDecisionEngine(decision_algorithm="default", server_list=server_list, max_in_flight=1,
+                                 admission_control=True)
+        de.admission.max_queue = 2
+
+        async def run():
+            running, server = await de.submit_task_async("offloading/1", port=self.stub.port)
+            await asyncio.sleep(0.1)
+            queued = [(await de.submit_task_async(f"offloading/{i}", port=self.stub.port))[0] for i in range(2, 4)]
+            with self.assertRaises(EngineOverloaded):
+                await de.submit_task_async("offloading/4", port=self.stub.port)
+            return await asyncio.gather(running, *queued)
+
+        try:
+            st = time.time()
+            results = asyncio.run_coroutine_threadsafe(run(), de.loop).result()
+            self.assertEqual([r.status_code for r in results], [200] * 3)
+            # One task sent at a time
+            self.assertGreaterEqual(time.time() - st, 0.85)
+            self.assertEqual(de.admission.rejected, 1)
+            self.assertEqual(de.admission.queued, 0)
+        finally:
+            de.close()
 
-        self.assertEqual(de.cal_throughput(), de.default_throughput_period / 0.2)
+    def test_remove_server_after_close(self):
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        AsyncDecisionEngine(decision_algorithm="default", server_list=server_list).close()
+        # Raised "Event loop is closed" while the closed engine was a listener
+        server_list.remove_ip("127.0.0.1")
+        self.assertEqual(server_list.len(), 0)
 
 
 if __name__ == '__main__':
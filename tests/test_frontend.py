@@ -0,0 +1,98 @@
+import asyncio
+import socket
+import time
+import unittest
+
+import aiohttp
+import requests
+from flask import Flask, jsonify
+
+from engine import AsyncDecisionEngine, DecisionEngine, DeadlineExceeded
+from frontend import AsyncFrontend
+from server import ServerList
+from tests.stub_server import StubServer
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class AsyncFrontendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubServer().start()
+        server_list = ServerList.specify_server_list({"PC": "127.0.0.1"})
+        self.de = de = AsyncDecisionEngine(decision_algorithm="default", server_list=server_list)
+        app = Flask(__name__)
+        frontend = AsyncFrontend(app)
+        stub = self.stub
+
+        @app.errorhandler(DeadlineExceeded)
+        def deadline_exceeded(e):
+            return jsonify(error=f"504 Gateway Timeout: {e}"), 504
+
+        @app.route("/listservers")
+        def list_servers():
+            return jsonify(data=de.server_list.convert_to_ip_list())
+
+        @frontend.route("/square/{num}")
+        async def square(request):
+            timeout = float(request.query.get("timeout", 5))
+            ret, server = await de.submit_task_async(f"offloading/{request.match_info['num']}",
+                                                     port=stub.port, timeout=timeout)
+            response = await ret
+            return dict(data=response.text, server=server)
+
+        self.port = free_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        self.frontend = frontend.start(de, host="127.0.0.1", port=self.port)
+
+    def tearDown(self):
+        self.frontend.stop()
+        self.de.close()
+        self.stub.stop()
+
+    def test_async_and_flask_routes(self):
+        r = requests.get(f"{self.base}/square/3")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json(), {"data": "9.0", "server": "127.0.0.1"})
+        # Other paths are served by Flask routes
+        r = requests.get(f"{self.base}/listservers")
+        self.assertEqual(r.json(), {"data": ["127.0.0.1"]})
+        self.assertEqual(requests.get(f"{self.base}/missing").status_code, 404)
+
+    def test_errors_answered_by_flask_handlers(self):
+        self.stub.delay = 0.5
+        r = requests.get(f"{self.base}/square/3?timeout=0.1")
+        self.assertEqual(r.status_code, 504)
+        self.assertTrue(r.json()["error"].startswith("504 Gateway Timeout"))
+
+    def test_slow_requests_dont_hold_threads(self):
+        self.stub.delay = 0.5
+        count = 100
+
+        async def send_all():
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+                async def one(i):
+                    async with session.get(f"{self.base}/square/{i}") as r:
+                        return r.status
+
+                return await asyncio.gather(*(one(i) for i in range(count)))
+
+        st = time.perf_counter()
+        statuses = asyncio.run(send_all())
+        elapsed = time.perf_counter() - st
+        self.assertEqual(statuses, [200] * count)
+        # 20 worker threads holding a request each would take 2.5 s
+        self.assertLess(elapsed, 1.5)
+
+    def test_needs_async_engine(self):
+        de = DecisionEngine(decision_algorithm="default", server_list=ServerList.specify_server_list({"PC": "127.0.0.1"}))
+        with self.assertRaises(TypeError):
+            AsyncFrontend(Flask(__name__)).start(de, port=free_port())
+        de.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from latency import LatencyEstimator, percentile
+
+
+class LatencyEstimatorTestCase(unittest.TestCase):
+    def test_ewma(self):
+        estimator = LatencyEstimator(alpha=0.5)
+        estimator.update(1.0, now=0)
+        self.assertEqual(estimator.mean, 1.0)
+        self.assertEqual(estimator.std(), 0.0)
+
+        estimator.update(3.0, now=1)
+        self.assertAlmostEqual(estimator.mean, 2.0)
+        self.assertAlmostEqual(estimator.var, 1.0)
+
+        # Old samples decay
+        for i in range(20):
+            estimator.update(10.0, now=2 + i)
+        self.assertAlmostEqual(estimator.mean, 10.0, places=3)
+
+    def test_is_warm(self):
+        estimator = LatencyEstimator()
+        self.assertFalse(estimator.is_warm(1, 10, now=0))
+        estimator.update(1.0, now=0)
+        estimator.update(1.0, now=1)
+        self.assertFalse(estimator.is_warm(3, 10, now=1))
+        estimator.update(1.0, now=2)
+        self.assertTrue(estimator.is_warm(3, 10, now=2))
+        self.assertFalse(estimator.is_warm(3, 10, now=13))
+
+
+class PercentileTestCase(unittest.TestCase):
+    def test_nearest_rank(self):
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(percentile([1, 2], 50), 1)
+        self.assertEqual(percentile([1, 2, 3, 4, 5, 6], 50), 3)
+        self.assertEqual(percentile(list(range(1, 11)), 50), 5)
+        self.assertEqual(percentile(list(range(1, 11)), 95), 10)
+        self.assertEqual(percentile(list(range(1, 101)), 99), 99)
+        self.assertEqual(percentile([1, 2, 3], 0), 1)
+        self.assertEqual(percentile([1, 2, 3], 100), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from metrics import Histogram, MetricsRegistry
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_buckets(self):
+        histogram = Histogram((0.1, 0.5, 1))
+        for value in (0.05, 0.1, 0.3, 2, 5):
+            histogram.observe(value)
+        # Upper bounds are inclusive, and large samples go to +Inf
+        self.assertEqual(histogram.counts, [2, 1, 0, 2])
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.sum, 7.45)
+
+
+class MetricsRegistryTestCase(unittest.TestCase):
+    def test_render(self):
+        registry = MetricsRegistry(prefix="test_")
+        tasks = registry.counter("tasks", "Tasks", ("server",))
+        latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+        registry.gauge("workers", "Workers", lambda: {(): 20})
+        tasks.labels("127.0.0.1").inc()
+        tasks.labels("127.0.0.1").inc()
+        tasks.labels('a"b').inc()
+        latency.labels().observe(0.5)
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE test_tasks counter", lines)
+        self.assertIn('test_tasks_total{server="127.0.0.1"} 2', lines)
+        self.assertIn('test_tasks_total{server="a\\"b"} 1', lines)
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 0', lines)
+        self.assertIn('test_latency_seconds_bucket{le="1"} 1', lines)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn("test_latency_seconds_sum 0.5", lines)
+        self.assertIn("test_latency_seconds_count 1", lines)
+        self.assertIn("test_workers 20", lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prober import HealthProber
+from server import Server, ServerList, ServerInfo
+
+
+class FakeServer(Server):
+    """
+    A Server with scripted ping delays, None means unreachable.
+    """
+
+    def __init__(self, name, ip, delays):
+        super().__init__(name, ip)
+        self.delays = list(delays)
+        self.pings = 0
+
+    def test_availability(self):
+        delay = self.delays[min(self.pings, len(self.delays) - 1)]
+        self.pings += 1
+        self.availability.append(ServerInfo(delay is not None, delay or 0, time.time()))
+        return delay is not None
+
+
+def make_server_list(servers):
+    server_list = ServerList.specify_server_list(dict())
+    server_list.serverList = list(servers)
+    return server_list
+
+
+class HealthProberTestCase(unittest.TestCase):
+    def test_ranking_and_smoothing(self):
+        fast = FakeServer("fast", "10.0.0.1", [1.0, 1.0, 9.0])
+        slow = FakeServer("slow", "10.0.0.2", [5.0])
+        down = FakeServer("down", "10.0.0.3", [None])
+        server_list = make_server_list([fast, slow, down])
+        prober = HealthProber(server_list, alpha=0.5)
+        prober._pool = ThreadPoolExecutor(3)
+        server_list.prober = prober
+
+        prober.probe_once()
+        self.assertEqual(prober.ranking, [fast, slow])
+        self.assertFalse(down.reachable)
+
+        prober.probe_once()
+        prober.probe_once()
+        # 0.5 * 9 + 0.5 * 1, one spike doesn't flip the ranking yet
+        self.assertAlmostEqual(fast.smoothed_delay, 5.0)
+
+        # Decisions read the ranking, no more pings
+        pings = fast.pings
+        self.assertEqual(server_list.select_min_ping_server(), fast)
+        self.assertEqual(server_list.without_ip("10.0.0.1").select_min_ping_server(), slow)
+        self.assertEqual(fast.pings, pings)
+
+    def test_adaptive_interval(self):
+        flapping = FakeServer("flapping", "10.0.0.1", [1.0, 1.0, None])
+        server_list = make_server_list([flapping])
+        prober = HealthProber(server_list, interval=1, min_interval=0.1, max_interval=3)
+        prober._pool = ThreadPoolExecutor(1)
+
+        prober.probe_once()
+        self.assertEqual(prober.cur_interval, 2)
+        prober.probe_once()
+        self.assertEqual(prober.cur_interval, 3)
+        prober.probe_once()
+        self.assertEqual(prober.cur_interval, 0.1)
+        self.assertEqual(prober.ranking, [])
+
+    def test_inline_ping_reads_newest_sample(self):
+        first = FakeServer("first", "10.0.0.1", [1.0, 9.0])
+        second = FakeServer("second", "10.0.0.2", [5.0])
+        server_list = make_server_list([first, second])
+        self.assertEqual(server_list.select_min_ping_server(), first)
+        self.assertEqual(server_list.select_min_ping_server(), second)
+
+    def test_inline_ping_skips_unreachable(self):
+        # Unreachable servers are stored with delay 0.0, less than any real ping
+        down = FakeServer("down", "10.0.0.2", [None])
+        up = FakeServer("up", "10.0.0.1", [5.0])
+        server_list = make_server_list([down, up])
+        for _ in range(3):
+            self.assertEqual(server_list.select_min_ping_server(), up)
+        self.assertIsNone(make_server_list([FakeServer("down", "10.0.0.2", [None])]).select_min_ping_server())
+
+    def test_background_thread(self):
+        server = FakeServer("s", "10.0.0.1", [2.0])
+        server_list = make_server_list([server])
+        prober = HealthProber(server_list, interval=0.01, max_interval=0.01).start()
+        try:
+            time.sleep(0.2)
+            self.assertGreater(prober.rounds, 1)
+            self.assertEqual(server_list.select_min_ping_server(), server)
+        finally:
+            prober.stop()
+        self.assertIsNone(server_list.prober)
+
+
+if __name__ == '__main__':
+    unittest.main()
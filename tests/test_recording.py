@@ -0,0 +1,82 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from config import Config
+from recording import MAGIC, TaskRecord, TraceRecorder, read_records
+
+
+class TraceRecorderTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".trace")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        recorder = TraceRecorder(self.path)
+        recorder.record("offloading/1", 5000, "127.0.0.1", 100.0, 0.25, 200)
+        recorder.record("hello", 5000, None, 101.0, 0.0, 0)
+        recorder.record("offloading/1", 5000, "192.168.56.2", 102.0, 0.5, 503)
+        recorder.close()
+
+        self.assertEqual(list(read_records(self.path)), [
+            TaskRecord(100.0, "offloading", "offloading/1", "127.0.0.1", 5000, 0.25, 200),
+            TaskRecord(101.0, "hello", "hello", None, 5000, 0.0, 0),
+            TaskRecord(102.0, "offloading", "offloading/1", "192.168.56.2", 5000, 0.5, 503),
+        ])
+        # Strings used again are stored once
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read().count(b"offloading/1"), 1)
+
+    def test_buffered_until_flush(self):
+        recorder = TraceRecorder(self.path, flush_interval=60)
+        recorder.record("offloading/1", 5000, "127.0.0.1", 100.0, 0.25, 200)
+        self.assertEqual(os.path.getsize(self.path), len(MAGIC))
+        recorder.flush()
+        self.assertEqual(len(list(read_records(self.path))), 1)
+        recorder.close()
+
+    def test_flushed_while_idle(self):
+        recorder = TraceRecorder(self.path, flush_interval=0.05)
+        recorder.record("offloading/1", 5000, "127.0.0.1", 100.0, 0.25, 200)
+        time.sleep(0.3)
+        self.assertEqual(len(list(read_records(self.path))), 1)
+        recorder.close()
+
+    def test_append_and_truncated(self):
+        for i in range(2):
+            recorder = TraceRecorder(self.path)
+            recorder.record(f"offloading/{i}", 5000, "127.0.0.1", float(i), 0.1, 200)
+            recorder.close()
+        # Ids start over in every session, definitions hold until redefined
+        self.assertEqual([record.task for record in read_records(self.path)], ["offloading/0", "offloading/1"])
+
+        # A frame cut short by a crash is ignored
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 3)
+        self.assertEqual([record.task for record in read_records(self.path)], ["offloading/0"])
+
+        with open(self.path, "wb") as f:
+            f.write(b"not a trace")
+        with self.assertRaises(ValueError):
+            TraceRecorder(self.path)
+
+    def test_string_table_is_bounded(self):
+        with mock.patch.object(Config, "RECORD_STRING_TABLE_SIZE", 4):
+            recorder = TraceRecorder(self.path)
+            for i in range(10):
+                recorder.record(f"offloading/{i}", 5000, "127.0.0.1", float(i), 0.1, 200)
+            self.assertLessEqual(len(recorder._ids), 4)
+            recorder.close()
+        records = list(read_records(self.path))
+        self.assertEqual([record.task for record in records], [f"offloading/{i}" for i in range(10)])
+        self.assertTrue(all(record.interface == "offloading" for record in records))
+        self.assertTrue(all(record.server == "127.0.0.1" for record in records))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import PriorityScheduler
+
+
+class PrioritySchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        # Holds the only worker until set, so tasks queue up behind it
+        self.gate = threading.Event()
+        self.order = list()
+
+    def tearDown(self):
+        self.gate.set()
+        self.pool.shutdown(wait=True)
+
+    def run_all(self, scheduler, tasks):
+        scheduler.submit("high", self.gate.wait)
+        futures = [scheduler.submit(priority, self.order.append, name) for priority, name in tasks]
+        self.gate.set()
+        for future in futures:
+            future.result()
+
+    def test_strict(self):
+        scheduler = PriorityScheduler(self.pool, mode="strict")
+        self.run_all(scheduler, [("low", "l1"), ("normal", "n1"), ("low", "l2"), ("high", "h1")])
+        self.assertEqual(self.order, ["h1", "n1", "l1", "l2"])
+        stats = scheduler.stats()
+        self.assertEqual(stats["low"]["started"], 2)
+        self.assertEqual(stats["low"]["depth"], 0)
+        self.assertGreater(stats["low"]["max_wait"], 0)
+
+    def test_weighted(self):
+        scheduler = PriorityScheduler(self.pool, mode="weighted", weights={"high": 3, "low": 1})
+        self.run_all(scheduler, [("low", f"l{i}") for i in range(4)] + [("high", f"h{i}") for i in range(6)])
+        # Low class gets a share instead of waiting for all high tasks
+        self.assertEqual(self.order[:4], ["h0", "h1", "l0", "h2"])
+        self.assertEqual(sorted(self.order), sorted([f"l{i}" for i in range(4)] + [f"h{i}" for i in range(6)]))
+
+    def test_cancel_queued(self):
+        scheduler = PriorityScheduler(self.pool, mode="strict")
+        scheduler.submit("high", self.gate.wait)
+        future = scheduler.submit("normal", self.order.append, "cancelled")
+        self.assertTrue(future.cancel())
+        self.assertEqual(scheduler.depth("normal"), 1)
+        self.gate.set()
+        scheduler.submit("normal", self.order.append, "n1").result()
+        self.assertEqual(self.order, ["n1"])
+        self.assertRaises(ValueError, scheduler.submit, "unknown", print)
+
+
+if __name__ == '__main__':
+    unittest.main()
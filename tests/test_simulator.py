@@ -0,0 +1,53 @@
+import unittest
+
+from simulator import SimServer, Simulation, constant, exponential
+
+
+def servers(outages=()):
+    return [
+        SimServer("127.0.0.1", service=exponential(0.2), capacity=2),
+        SimServer("192.168.56.2", service=exponential(0.05), capacity=4, network_delay=constant(0.002)),
+        SimServer("192.168.56.3", service=exponential(0.05), capacity=4, network_delay=constant(0.004),
+                  outages=outages),
+    ]
+
+
+class SimulationTestCase(unittest.TestCase):
+    def test_all_tasks_finish(self):
+        result = Simulation(servers()).run("least_outstanding", rate=20, duration=60, seed=1)
+        summary = result.summary()
+        self.assertGreater(summary["tasks"], 0)
+        self.assertTrue(all(task.finished is not None for task in result.tasks))
+        self.assertEqual(summary["ok"], summary["tasks"])
+        # Service time of 0.05 s plus a few ms of network
+        self.assertLess(summary["p50"], 0.5)
+
+    def test_same_seed_same_result(self):
+        sim = Simulation(servers())
+        first = sim.run("power_of_two_choices", rate=20, duration=30, seed=7).summary()
+        second = sim.run("power_of_two_choices", rate=20, duration=30, seed=7).summary()
+        for key in ("tasks", "ok", "p50", "p99", "servers"):
+            self.assertEqual(first[key], second[key])
+
+    def test_same_workload_for_every_algorithm(self):
+        sim = Simulation(servers())
+        arrivals = [
+            [task.arrival for task in sim.run(algorithm, rate=10, duration=20, seed=3).tasks]
+            for algorithm in ("default", "minimum_observed_latency")
+        ]
+        self.assertEqual(arrivals[0], arrivals[1])
+
+    def test_outage_fails_tasks(self):
+        result = Simulation(servers(outages=[(10, 20)])).run("default", rate=20, duration=30, seed=1)
+        down = [task for task in result.tasks if task.error == "down"]
+        self.assertGreater(len(down), 0)
+        self.assertTrue(all(10 <= task.arrival < 20 for task in down))
+        self.assertTrue(all(task.server.serverIP == "192.168.56.3" for task in down))
+
+    def test_consider_throughput_runs_locally(self):
+        result = Simulation(servers(), consider_throughput=True).run("default", rate=5, duration=30, seed=1)
+        self.assertGreater(result.summary()["local"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
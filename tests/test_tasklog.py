@@ -0,0 +1,77 @@
+import sys
+import unittest
+
+from loguru import logger
+
+from tasklog import TaskLog, configure_logging
+
+
+class Formatted:
+    """
+    Counts how many times it's formatted into a message.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __format__(self, spec):
+        self.calls += 1
+        return "formatted"
+
+
+class TaskLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lines = list()
+        logger.remove()
+        self.sink = logger.add(self.lines.append, level="INFO", format="{message}")
+
+    def tearDown(self):
+        logger.remove()
+        logger.add(sys.stderr)
+
+    def test_sampled_tasks_are_logged_all_counted(self):
+        task_log = TaskLog(sample_rate=0)
+        for i in range(10):
+            sampled = task_log.begin()
+            task_log.event("chosen", "Choose server {}", i)
+            task_log.event("submitted", "Submit task {}", i, sampled=sampled)
+        self.assertEqual(self.lines, [])
+        self.assertEqual(task_log.snapshot(), {"chosen": 10, "submitted": 10})
+
+        task_log = TaskLog(sample_rate=1)
+        task_log.begin()
+        task_log.event("chosen", "Choose server {}", 1)
+        self.assertEqual([line.strip() for line in self.lines], ["Choose server 1"])
+
+    def test_pick_follows_task_to_other_threads(self):
+        task_log = TaskLog(sample_rate=1)
+        task_log.begin(False)
+        task_log.event("chosen", "Choose server {}", 1)
+        task_log.event("submitted", "Submit task {}", 1, sampled=True)
+        self.assertEqual([line.strip() for line in self.lines], ["Submit task 1"])
+
+    def test_lazy_formatting(self):
+        task_log = TaskLog(sample_rate=1)
+        value = Formatted()
+        # Not sampled, or level disabled: never formatted
+        task_log.event("submitted", "Submit task {}", value, sampled=False)
+        task_log.event("submitted", "Submit task {}", value, level="DEBUG")
+        self.assertEqual(value.calls, 0)
+        task_log.event("submitted", "Submit task {}", value)
+        self.assertEqual(value.calls, 1)
+        # Braces in arguments are not templates
+        task_log.event("submitted", "Submit task {}", "{task}")
+        self.assertEqual(self.lines[-1].strip(), "Submit task {task}")
+
+    def test_configure_logging_enqueue(self):
+        lines = list()
+        configure_logging(lines.append, level="WARNING", format="{message}")
+        logger.info("dropped")
+        logger.warning("kept")
+        # Written by a background thread
+        logger.complete()
+        self.assertEqual([line.strip() for line in lines], ["kept"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import threading
+
+from throughput import SlidingWindowCounter
+
+
+class SlidingWindowCounterTestCase(unittest.TestCase):
+    def test_count_in_window(self):
+        counter = SlidingWindowCounter(period=1, buckets=10, clock=lambda: 100.0)
+        for i in range(10):
+            counter.record(now=100.05 + i * 0.1)
+        self.assertEqual(counter.count(now=100.95), 10)
+        self.assertEqual(counter.rate(now=100.95), 10)
+
+        # The oldest bucket [100.0, 100.1) expires first
+        self.assertEqual(counter.count(now=101.05), 9)
+        # Whole window expires
+        self.assertEqual(counter.count(now=102.5), 0)
+
+    def test_memory_is_bounded(self):
+        counter = SlidingWindowCounter(period=1, buckets=10, clock=lambda: 0.0)
+        for i in range(100000):
+            counter.record(now=i * 0.001)
+        self.assertEqual(len(counter._counts), 10)
+        # Last 0.9 s full buckets + the current partial bucket
+        self.assertAlmostEqual(counter.count(now=99.9995), 1000, delta=100)
+
+    def test_record_from_threads(self):
+        counter = SlidingWindowCounter(period=60, buckets=10)
+
+        def worker():
+            for _ in range(10000):
+                counter.record()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(counter.count(), 80000)
+
+    def test_invalid_params(self):
+        with self.assertRaises(ValueError):
+            SlidingWindowCounter(period=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
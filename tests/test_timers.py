@@ -0,0 +1,38 @@
+import unittest
+import threading
+import time
+
+from timers import TimerQueue
+
+
+class TimerQueueTestCase(unittest.TestCase):
+    def test_call_later(self):
+        timers = TimerQueue()
+        calls = list()
+        done = threading.Event()
+        try:
+            timers.call_later(0.2, lambda: (calls.append("late"), done.set()))
+            timers.call_later(0.05, lambda: calls.append("early"))
+            timers.call_later(0.1, lambda: calls.append("cancelled")).cancel()
+            # A failing call doesn't stop the queue
+            timers.call_later(0.0, lambda: 1 / 0)
+            st = time.monotonic()
+            self.assertTrue(done.wait(2))
+            self.assertGreaterEqual(time.monotonic() - st, 0.15)
+            self.assertEqual(calls, ["early", "late"])
+        finally:
+            timers.stop()
+
+    def test_stop_runs_pending(self):
+        timers = TimerQueue()
+        calls = list()
+        timers.call_later(60, lambda: calls.append("late"))
+        timers.call_later(30, lambda: calls.append("early"))
+        timers.call_later(10, lambda: calls.append("cancelled")).cancel()
+        timers.stop()
+        self.assertEqual(calls, ["early", "late"])
+        self.assertRaises(RuntimeError, timers.call_later, 0, lambda: None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+import unittest
+
+from tracing import JsonlSink, RingSink, TaskTrace, Tracer
+
+
+class TracerTestCase(unittest.TestCase):
+    def test_sampling(self):
+        self.assertIsNone(Tracer(sample_rate=0).start("offloading/1"))
+        trace = Tracer(sample_rate=1).start("offloading/1")
+        self.assertEqual(len(trace.trace_id), 16)
+        self.assertEqual(trace.attempt, 0)
+
+        attempt = Tracer.next_attempt(trace, "127.0.0.2")
+        self.assertEqual((attempt.trace_id, attempt.attempt, attempt.server), (trace.trace_id, 1, "127.0.0.2"))
+        self.assertIsNone(Tracer.next_attempt(None, "127.0.0.2"))
+
+    def test_phases(self):
+        trace = TaskTrace("1", "offloading/1")
+        trace.mark("route")
+        trace.add("connect", 0.1)
+        trace.request_finished(sent=10.0, finished=10.5, headers=10.4)
+        self.assertEqual(list(trace.phases), ["route", "connect", "remote", "read"])
+        self.assertAlmostEqual(trace.phases["remote"], 0.3)
+        self.assertAlmostEqual(trace.phases["read"], 0.1)
+
+    def test_sinks(self):
+        ring = RingSink(size=2)
+        called = []
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        jsonl = JsonlSink(path)
+
+        def broken(trace):
+            raise ValueError("broken sink")
+
+        tracer = Tracer(sample_rate=1, sinks=[ring, jsonl, called.append, broken])
+        try:
+            for i in range(3):
+                tracer.finish(tracer.start(f"offloading/{i}"), status_code=200)
+            tracer.finish(tracer.start("offloading/3"), error=ValueError("failed"))
+        finally:
+            jsonl.close()
+
+        # Ring keeps the latest ones, and a broken sink doesn't stop others
+        self.assertEqual([trace.task for trace in ring.traces()], ["offloading/2", "offloading/3"])
+        self.assertEqual(len(called), 4)
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        os.remove(path)
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0]["status_code"], 200)
+        self.assertEqual(lines[3]["error"], "ValueError: failed")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# This is a sliding window counter used by DecisionEngine to calculate throughput.
+# Purpose of this module is to count requests in the last `period` seconds with
+# O(1) cost for both recording and querying, and a memory footprint that does not
+# grow with the number of requests.
+
+import threading
+import time
+
+
+class SlidingWindowCounter:
+    """
+    A bucketed ring buffer counting events in a sliding time window.
+
+    The window [now - period, now] is split into `buckets` slots of
+    period / buckets seconds each. Every slot holds the count of events whose
+    timestamp falls into it, and self._total holds the sum of all slots, so
+    querying the window count does not need to walk the ring.
+
+    When time moves forward, slots that fall out of the window are cleared and
+    their counts are subtracted from self._total. At most `buckets` slots are
+    cleared per call, so record() and count() are O(1) whatever the request rate.
+
+    The count is approximate at the oldest slot: events in the window are counted
+    with a resolution of one bucket width.
+    """
+
+    def __init__(self, period: float = 1, buckets: int = 10, clock=time.monotonic):
+        """
+        :param period : Window length in seconds.
+        :param buckets: Number of slots the window is split into. More buckets give
+                        a finer resolution at the cost of memory.
+        :param clock  : A function returning current time in seconds.
+        """
+        if period <= 0 or buckets <= 0:
+            raise ValueError("period and buckets must be positive")
+        self.period = period
+        self.buckets = buckets
+        self.bucket_width = period / buckets
+        self.clock = clock
+
+        self._counts = [0] * buckets
+        self._total = 0
+        # Absolute index of the newest slot, that is int(timestamp / bucket_width)
+        self._cur = int(clock() / self.bucket_width)
+        # record() is called by worker threads while request threads call count(),
+        # so every read-modify-write of the ring is protected by this lock.
+        self._lock = threading.Lock()
+
+    def _advance(self, now: float):
+        """
+        Move the newest slot to the slot containing now, clearing expired slots.
+        Must be called with self._lock held.
+        """
+        idx = int(now / self.bucket_width)
+        elapsed = idx - self._cur
+        if elapsed <= 0:
+            return
+        if elapsed >= self.buckets:
+            # The whole window expired
+            self._counts = [0] * self.buckets
+            self._total = 0
+        else:
+            for i in range(self._cur + 1, idx + 1):
+                slot = i % self.buckets
+                self._total -= self._counts[slot]
+                self._counts[slot] = 0
+        self._cur = idx
+
+    def record(self, n: int = 1, now: float = None):
+        """
+        Record n events happened at now (default: current time).
+        """
+        if now is None:
+            now = self.clock()
+        with self._lock:
+            self._advance(now)
+            self._counts[self._cur % self.buckets] += n
+            self._total += n
+
+    def count(self, now: float = None):
+        """
+        :return: Number of events recorded in the last self.period seconds.
+        """
+        if now is None:
+            now = self.clock()
+        with self._lock:
+            self._advance(now)
+            return self._total
+
+    def rate(self, now: float = None):
+        """
+        :return: A float value of events per second in the window.
+        """
+        return self.count(now) / self.period
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * self.buckets
+            self._total = 0
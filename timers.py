@@ -0,0 +1,100 @@
+# This is a queue of delayed calls run by one background thread.
+# DecisionEngine uses it to act on tasks after a delay (such as hedging a
+# slow task), without starting a thread per task like threading.Timer.
+
+import heapq
+import itertools
+import threading
+import time
+
+from loguru import logger
+
+
+class TimerHandle:
+    __slots__ = ("when", "func", "cancelled")
+
+    def __init__(self, when: float, func):
+        self.when = when
+        self.func = func
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerQueue:
+    """
+    Usage:
+        timers = TimerQueue()
+        handle = timers.call_later(0.5, func)
+        handle.cancel()
+
+    Calls run in the timer thread one after another, so they must be short
+    and not block, such as submitting work to a thread pool.
+    """
+
+    def __init__(self, name: str = "TimerQueue"):
+        self._heap = list()
+        # Breaks ties of calls at the same time, handles are not comparable
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay: float, func):
+        """
+        Call func() after delay seconds.
+        :return: A TimerHandle, call its cancel() to skip the call.
+        :raise RuntimeError: If the queue is stopped, like submit() of a shut
+                             down Executor, as the call would never run.
+        """
+        handle = TimerHandle(time.monotonic() + delay, func)
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Cannot schedule a call after TimerQueue is stopped")
+            heapq.heappush(self._heap, (handle.when, next(self._counter), handle))
+            # Wake up the thread if this call is the earliest one
+            if self._heap[0][2] is handle:
+                self._cond.notify()
+        return handle
+
+    def stop(self):
+        """
+        Stop the timer thread. Calls not run yet run now, before this returns,
+        so nothing waiting on them (such as a Future completed by a delayed
+        retry) waits forever.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    timeout = self._heap[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    pending = [item[2] for item in sorted(self._heap)]
+                    self._heap.clear()
+                    break
+                handle = heapq.heappop(self._heap)[2]
+            self._call(handle)
+        for handle in pending:
+            self._call(handle)
+
+    @staticmethod
+    def _call(handle: TimerHandle):
+        if handle.cancelled:
+            return
+        try:
+            handle.func()
+        except Exception as e:
+            logger.exception(f"Delayed call failed: {e}")
@@ -0,0 +1,285 @@
+# This is per-task tracing of the offloading pipeline.
+# DecisionEngine(tracer=Tracer(...)) timestamps every phase of a sampled task
+# from submit_task() to the end of offload_task(), so a slow task shows which
+# phase was slow, and sends the trace id to the server in Config.TRACE_HEADER.
+# Finished traces go to sinks: an in-memory ring, a JSONL file, or a callback.
+#
+# Phases, in seconds:
+#     route  : Cache lookup, admission and choosing a server, including pings
+#              of decision functions.
+#     queue  : Waiting for a worker thread (or the event loop).
+#     connect: Opening a new connection, absent if a pooled one is reused.
+#     remote : Sending the request until response headers arrive, mostly
+#              running the task on the server.
+#     read   : Reading and decoding the response body.
+
+import json
+import random
+import threading
+import time
+from collections import deque
+
+import aiohttp
+from loguru import logger
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+from config import Config
+
+# Trace of the task whose request is being sent in this thread, read by
+# TracedHTTPConnection. Only set while a sampled task is sent.
+_local = threading.local()
+
+
+class TaskTrace:
+    """
+    Phases of one attempt of a task. Retried and hedged attempts of a task get
+    their own TaskTrace with the same trace_id and the next attempt number.
+    """
+
+    __slots__ = ("trace_id", "task", "server", "attempt", "started", "phases",
+                 "status_code", "error", "total", "_start", "_last", "_headers")
+
+    def __init__(self, trace_id: str, task: str, attempt: int = 0):
+        self.trace_id = trace_id
+        self.task = task
+        self.server = None
+        self.attempt = attempt
+        # Wall clock time of the start, for sinks
+        self.started = time.time()
+        # Phase name -> seconds, in order of phases
+        self.phases = dict()
+        self.status_code = None
+        self.error = None
+        # Seconds from start to finish, set by Tracer.finish()
+        self.total = None
+        self._start = self._last = time.perf_counter()
+        # time.perf_counter() when response headers arrived, if known
+        self._headers = None
+
+    def __repr__(self):
+        return f"TaskTrace({self.trace_id}, {self.task}, attempt={self.attempt})"
+
+    def mark(self, phase: str):
+        """
+        End phase now, it started when the previous phase ended.
+        """
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def headers_received(self):
+        self._headers = time.perf_counter()
+
+    def request_finished(self, sent: float, finished: float, headers: float = None):
+        """
+        Split a finished request into remote and read phases. Connect phase,
+        if any, was added while sending, and is part of sent -> headers.
+        :param sent    : time.perf_counter() before sending the request.
+        :param finished: time.perf_counter() when the body was read.
+        :param headers : time.perf_counter() when response headers arrived,
+                         default is the time set by headers_received().
+        """
+        if headers is None:
+            headers = self._headers if self._headers is not None else finished
+        self.phases["remote"] = max(0.0, headers - sent - self.phases.get("connect", 0.0))
+        self.phases["read"] = max(0.0, finished - headers)
+        self._last = finished
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "task": self.task,
+            "server": self.server,
+            "attempt": self.attempt,
+            "started": self.started,
+            "phases": dict(self.phases),
+            "total": self.total,
+            "status_code": self.status_code,
+            "error": self.error,
+        }
+
+
+class RingSink:
+    """
+    Keep the latest size traces in memory.
+    """
+
+    def __init__(self, size: int = Config.TRACE_RING_SIZE):
+        self.ring = deque(maxlen=size)
+
+    def emit(self, trace: TaskTrace):
+        self.ring.append(trace)
+
+    def traces(self):
+        """
+        :return: A list of kept TaskTrace instances, oldest first.
+        """
+        return list(self.ring)
+
+
+class JsonlSink:
+    """
+    Append every trace as a line of JSON to a file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def emit(self, trace: TaskTrace):
+        line = json.dumps(trace.to_dict())
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class CallbackSink:
+    """
+    Call func(trace) for every trace.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def emit(self, trace: TaskTrace):
+        self.func(trace)
+
+
+class Tracer:
+    """
+    Usage:
+        ring = RingSink()
+        tracer = Tracer(sample_rate=0.1, sinks=[ring, JsonlSink("traces.jsonl"), print])
+        de = DecisionEngine(..., tracer=tracer)
+        ...
+        ring.traces()
+
+    Sinks are objects with an emit(trace) method, or functions called with
+    the trace. They are called in the thread finishing the task, so they
+    should be fast; exceptions of sinks are logged and dropped.
+    """
+
+    def __init__(self, *, sample_rate: float = Config.TRACE_SAMPLE_RATE, sinks=None,
+                 header: str = Config.TRACE_HEADER):
+        """
+        :param sample_rate: Fraction of tasks traced, such as 0.01 for 1%.
+        :param sinks      : A list of sinks, default is a RingSink.
+        :param header     : Header carrying the trace id to servers.
+        """
+        self.sample_rate = sample_rate
+        self.header = header
+        if sinks is None:
+            sinks = [RingSink()]
+        self.sinks = [sink if hasattr(sink, "emit") else CallbackSink(sink) for sink in sinks]
+
+    def start(self, task: str):
+        """
+        Start tracing a task, if it's sampled.
+        :return: A TaskTrace, None if the task is not sampled.
+        """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        return TaskTrace(f"{random.getrandbits(64):016x}", task)
+
+    @staticmethod
+    def next_attempt(trace: TaskTrace, server_ip: str):
+        """
+        Start tracing a retried or hedged attempt of a traced task on another server.
+        :return: A TaskTrace with the same trace_id, None if trace is None.
+        """
+        if trace is None:
+            return None
+        attempt = TaskTrace(trace.trace_id, trace.task, trace.attempt + 1)
+        attempt.server = server_ip
+        return attempt
+
+    def finish(self, trace: TaskTrace, status_code: int = None, error: Exception = None):
+        """
+        Finish a trace and pass it to sinks.
+        :param status_code: HTTP status code of the response, None if it failed.
+        :param error      : Exception of a failed task.
+        """
+        trace.total = time.perf_counter() - trace._start
+        trace.status_code = status_code
+        if error is not None:
+            trace.error = f"{type(error).__name__}: {error}"
+        for sink in self.sinks:
+            try:
+                sink.emit(trace)
+            except Exception as e:
+                logger.warning(f"Trace sink {sink} failed: {e}")
+
+
+class TracedHTTPConnection(HTTPConnection):
+    """
+    A urllib3 connection adding time of opening it to the trace being sent
+    in this thread as connect phase.
+    """
+
+    def connect(self):
+        trace = getattr(_local, "trace", None)
+        if trace is None:
+            return super().connect()
+        st = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            trace.add("connect", time.perf_counter() - st)
+
+
+class TracedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TracedHTTPConnection
+
+
+def trace_connections(adapter):
+    """
+    Time new connections of a requests HTTPAdapter for http:// urls.
+    :return: The adapter.
+    """
+    adapter.poolmanager.pool_classes_by_scheme = dict(
+        adapter.poolmanager.pool_classes_by_scheme, http=TracedHTTPConnectionPool
+    )
+    return adapter
+
+
+def set_sending(trace: TaskTrace = None):
+    """
+    Mark trace as the one being sent in this thread, None after sending.
+    """
+    _local.trace = trace
+
+
+async def _on_connection_create_start(session, context, params):
+    context.connect_start = time.perf_counter()
+
+
+async def _on_connection_create_end(session, context, params):
+    if context.trace_request_ctx is not None:
+        context.trace_request_ctx.add("connect", time.perf_counter() - context.connect_start)
+
+
+async def _on_request_end(session, context, params):
+    # Response headers arrived
+    if context.trace_request_ctx is not None:
+        context.trace_request_ctx.headers_received()
+
+
+def aiohttp_trace_config():
+    """
+    An aiohttp.TraceConfig adding connect phase to the TaskTrace passed as
+    trace_request_ctx of a request, and calling its headers_received().
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(_on_connection_create_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_request_end.append(_on_request_end)
+    return trace_config